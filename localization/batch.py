@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import tempfile
+import concurrent.futures
+import pandas as pd
+from tqdm import tqdm
+import commuting_model as como
+import cowork_locations as coloc
+import export
+
+
+# This code runs optimisations headless in batches, e.g. for planning studies over many county combinations, numbers of sites and seeds. A batch specification (JSON) lists jobs or grids of jobs; the jobs are distributed over a process pool and every finished job is written as a Parquet file of its own into a result directory, one subdirectory per algorithm. Jobs whose file already exists are skipped, so an interrupted batch is continued by starting it again. The result directory of an algorithm can be read as a whole with pd.read_parquet.
+#
+# The maximal error of the llcw lookup table (como.set_llcw_table) is part of every job: "llcw_error" in the specification, or --llcw-error for jobs without it. Jobs that differ only in it are different jobs with results of their own.
+#
+# usage: python localization/batch.py spec.json results/ [--jobs N] [--llcw-error 1e-4]
+#
+# Example specification; every list in a grid is combined with every other one:
+# {"grid": [{"algorithm": ["kLocs", "genetic_algorithm"],
+#            "region": [["01001", "01002"], ["01057"]],
+#            "fixed_cws": [["01001000"]],
+#            "n_new": [5, 10],
+#            "seed": [1, 2, 3],
+#            "params": [{"n_pop": 50, "n_gen": 20, "p_survive": 0.2, "p_mut": 0.1}]}],
+#  "jobs": [{"algorithm": "heatmap", "region": ["01057"], "fixed_cws": [], "llcw_error": 1e-4}]}
+
+
+ALGORITHMS = ('kLocs', 'genetic_algorithm', 'annealing', 'heatmap')
+JOB_KEYS = ('algorithm', 'region', 'fixed_cws', 'n_new', 'seed', 'params', 'llcw_error')
+
+
+def expand(spec, llcw_error = None):
+    """expands a batch specification into single jobs
+
+    Args:
+        spec (dict): 'jobs' (lst of job dicts) and/or 'grid' (lst of dicts of lists of values)
+        llcw_error (float, optional): llcw_error of the jobs that do not set it. Defaults to exact.
+
+    Returns:
+        lst of dict: jobs with the keys JOB_KEYS, without duplicates
+    """
+    jobs = list(spec.get('jobs', []))
+    for grid in spec.get('grid', []):
+        keys = list(grid)
+        jobs += [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+    res = {}
+    for job in jobs:
+        job = {'algorithm': job['algorithm'],
+               'region': sorted(job['region']),
+               'fixed_cws': sorted(job.get('fixed_cws', [])),
+               'n_new': job.get('n_new'),
+               'seed': job.get('seed'),
+               'params': job.get('params', {}),
+               'llcw_error': job.get('llcw_error', llcw_error)}
+        assert job['algorithm'] in ALGORITHMS, f"unknown algorithm {job['algorithm']}, use one of {ALGORITHMS}"
+        assert job['algorithm'] == 'heatmap' or job['n_new'], f"n_new is needed for {job['algorithm']}"
+        assert job['llcw_error'] is None or job['llcw_error'] > 0, f"llcw_error must be positive or None"
+        res[job_id(job)] = job
+    return list(res.values())
+
+def job_id(job):
+    """canonical id of a job. Exact llcw is left out, so that results from before llcw_error keep their id."""
+    key = {key: job.get(key) for key in JOB_KEYS if key != 'llcw_error' or job.get(key) is not None}
+    return hashlib.sha256(json.dumps(key, sort_keys = True).encode('utf-8')).hexdigest()[:16]
+
+def _path(job, out_dir):
+    return os.path.join(out_dir, job['algorithm'], job_id(job) + '.parquet')
+
+def run_job(job, out_dir):
+    """runs a job and writes its result; top level, so that it can run in a worker process
+
+    Returns:
+        float: seconds of computation
+    """
+    como.set_llcw_table(job['llcw_error']) # global in the process, which runs one job at a time
+    start = time.perf_counter()
+    fixed_cws = como.Municipality.get(job['fixed_cws'])
+    if job['algorithm'] == 'heatmap':
+        table = export.heatmap_table(coloc.heatmap(job['region'], fixed_cws, **job['params'])).reset_index()
+        stop_reason = None
+    else:
+        algorithm = getattr(coloc, job['algorithm'])
+        result_df = algorithm(region = job['region'], fixed_cws = fixed_cws,
+                              n_cws = len(fixed_cws) + job['n_new'], seed = job['seed'], **job['params'])
+        table = export.solution_table(result_df).reset_index()
+        stop_reason = result_df.attrs.get('stop_reason')
+    seconds = time.perf_counter() - start
+
+    # job description as columns, so that the results of all jobs can be read and filtered together
+    table.insert(0, 'Job', job_id(job))
+    table['Region'] = ' '.join(job['region'])
+    table['Bestehende CWS'] = ' '.join(job['fixed_cws'])
+    # nullable types, so that all files of an algorithm share one schema
+    table['Neue CWS'] = pd.Series(job['n_new'], index = table.index, dtype = 'Int64')
+    table['Seed'] = pd.Series(job['seed'], index = table.index, dtype = 'Int64')
+    table['Parameter'] = json.dumps(job['params'], sort_keys = True)
+    table['LLCW-Fehler'] = pd.Series(job['llcw_error'], index = table.index, dtype = 'Float64')
+    table['Abbruchgrund'] = pd.Series(stop_reason, index = table.index, dtype = 'string')
+    table['Rechenzeit'] = seconds
+
+    # atomic, so that an interrupted job leaves no file and is repeated on restart
+    path = _path(job, out_dir)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path), suffix = '.tmp')
+    os.close(fd)
+    try:
+        table.to_parquet(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return seconds
+
+def run(spec, out_dir, n_jobs = None, llcw_error = None):
+    """runs all jobs of a batch specification that have no result yet
+
+    Args:
+        spec (dict): batch specification, see expand
+        out_dir (str): result directory
+        n_jobs (int, optional): number of worker processes. Defaults to the number of processors.
+        llcw_error (float, optional): maximal error of llcw in the jobs that do not set it, see
+            como.set_llcw_table. Defaults to exact.
+
+    Returns:
+        pd.DataFrame: one row per job run now, with its id, algorithm, seconds of computation or the error
+    """
+    jobs = expand(spec, llcw_error)
+    todo = [job for job in jobs if not os.path.exists(_path(job, out_dir))]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(todo)} already done, {len(todo)} to run")
+    report = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        futures = {executor.submit(run_job, job, out_dir): job for job in todo}
+        for future in tqdm(concurrent.futures.as_completed(futures), total = len(futures), desc = 'Jobs'):
+            job = futures[future]
+            try:
+                report.append([job_id(job), job['algorithm'], future.result(), None])
+            except Exception as e: # a failing job must not stop the batch
+                report.append([job_id(job), job['algorithm'], None, repr(e)])
+    hours = (time.perf_counter() - start)/3600
+    if todo:
+        print(f"{len(todo)} jobs in {hours*3600:.1f} s, {len(todo)/hours:.0f} jobs per hour")
+    return pd.DataFrame(report, columns = ['Job', 'Algorithm', 'Seconds', 'Error'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Runs a batch of coworking space optimisations.')
+    parser.add_argument('spec', help = 'batch specification (JSON)')
+    parser.add_argument('out_dir', help = 'result directory; jobs with existing results are skipped')
+    parser.add_argument('--jobs', type = int, default = None, help = 'number of worker processes (default: all processors)')
+    parser.add_argument('--llcw-error', type = float, default = None,
+                        help = 'interpolate llcw in a lookup table with this maximal error in the jobs '
+                               'that do not set llcw_error (default: exact)')
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    report = run(spec, args.out_dir, args.jobs, args.llcw_error)
+    failed = report[report['Error'].notna()]
+    if len(failed):
+        print(failed.to_string(index = False))
+    sys.exit(1 if len(failed) else 0)
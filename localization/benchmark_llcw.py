@@ -0,0 +1,57 @@
+import sys
+import time
+import argparse
+import numpy as np
+import commuting_model as como
+
+
+# This code compares the throughput of llcw evaluated exactly with the beta distribution and interpolated in a precomputed LlcwTable (see como.set_llcw_table), and measures the actual error of the table. The queries are random travel times: half of them uniform in realistic ranges (to the workplace between 5 and 120 minutes, to the coworking space between 0 and 120 minutes), the other half near the diagonal, where llcw is steepest (to the workplace between 2 and 40 minutes, to the coworking space 0.8 to 1.2 times as far). The exit code is 1 if any query exceeds the maximal error.
+#
+# usage: python localization/benchmark_llcw.py [--max-error 1e-3 1e-4 1e-5] [-n 1000000] [--seed 1]
+
+
+def _throughput(func, *args, repeat = 3):
+    """best of repeat runs; returns values per second and the result"""
+    seconds = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        res = func(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    return len(res)/seconds, res
+
+def run(max_errors = (1e-3, 1e-4, 1e-5), n = 10**6, seed = None):
+    """benchmarks the table for several maximal errors against exact evaluation
+
+    Returns:
+        list of dict: per maximal error the build time in s, the share of interpolated cells, the error on the lattice,
+        the maximal error on the queries and the throughput of the table and of exact evaluation in values per second
+    """
+    rng = np.random.default_rng(seed)
+    n_diagonal = n//2
+    dist_wpl = np.r_[rng.uniform(5, 120, n - n_diagonal), rng.uniform(2, 40, n_diagonal)]
+    dist_cowork = np.r_[rng.uniform(0, 120, n - n_diagonal), dist_wpl[n - n_diagonal:]*rng.uniform(.8, 1.2, n_diagonal)]
+    exact, reference = _throughput(como.llcw_exact, dist_cowork, dist_wpl)
+    res = []
+    for max_error in max_errors:
+        start = time.perf_counter()
+        table = como.LlcwTable(max_error = max_error)
+        build = time.perf_counter() - start
+        throughput, values = _throughput(table, dist_cowork, dist_wpl)
+        res.append({'max_error': max_error, 'build': build, 'coverage': table.coverage, 'validated': table.error,
+                    'observed': np.max(np.abs(values - reference)), 'table': throughput, 'exact': exact})
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compares llcw with and without lookup table.')
+    parser.add_argument('--max-error', type = float, nargs = '+', default = [1e-3, 1e-4, 1e-5])
+    parser.add_argument('-n', type = int, default = 10**6, help = 'number of queries')
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+    results = run(args.max_error, args.n, args.seed)
+    print(f"exact: {results[0]['exact']/1e6:.1f} M values/s")
+    for r in results:
+        print(f"max error {r['max_error']:g}: built in {r['build']:.2f} s, {r['coverage']:.2%} of the cells interpolated, "
+              f"error on the lattice {r['validated']:.1e}, observed error {r['observed']:.1e}, "
+              f"{r['table']/1e6:.1f} M values/s ({r['table']/r['exact']:.0f}x)")
+    sys.exit(1 if any(r['observed'] > r['max_error'] for r in results) else 0)
@@ -0,0 +1,166 @@
+import numpy as np
+from scipy import sparse
+from scipy.optimize import milp, LinearConstraint, Bounds
+
+
+# This code limits how many commuters a coworking space can take in (its desks) and assigns the municipalities of a region to the coworking spaces accordingly. Without capacities every municipality is served by its nearest coworking space. With capacities the residents of a municipality go to the nearest coworking space that still has room: the assignment is a transportation problem in which every municipality sends shares of its residents to the coworking spaces in reach, as many as the capacities allow, at the smallest travel time. It is solved as linear program with the HiGHS solver shipped with scipy. As the solvers evaluate the same and similar location sets over and over, the nearest assignment is tried first and kept if it respects all capacities, and solved assignments are memorised per location set, sparsely and within a memory limit.
+
+
+CAPACITY = None # default capacity of every cws in addressed commuters. None means unlimited, see set_capacity
+SITE_CAPACITY = dict() # AGS -> capacity of single cws, e.g. of existing ones, overrides CAPACITY
+MAX_BYTES = 64 * 2**20 # memory limit of the memorised assignments
+
+_cache = dict() # (RegionModel.key, locs, capacities) -> (municipalities, cws, shares) of the nonzero shares, oldest first
+_cached_bytes = 0
+_stats = {'nearest': 0, 'cached': 0, 'solved': 0}
+
+
+def set_capacity(default = None, sites = None):
+    """sets the capacities of coworking spaces in addressed commuters. Solution, evaluate_many and evaluate_positions,
+    and thereby the genetic algorithms, kLocs, the Pareto search and heatmap, assign municipalities with respect to
+    them; the result_cache keeps heatmaps separately per setting. annealing, greedy and pair_heatmap still optimise
+    on the nearest assignment and scenarios.monte_carlo samples it, their solutions are evaluated with capacities.
+    exact does not support capacities.
+
+    Args:
+        default (float, optional): capacity of every cws that is not in sites. Defaults to None (unlimited).
+        sites (dict, optional): AGS -> capacity (None for unlimited) of single cws, e.g. of the existing ones
+    """
+    global CAPACITY, SITE_CAPACITY
+    sites = dict(sites or {})
+    assert all(cap is None or cap > 0 for cap in [default, *sites.values()]), f"capacities must be positive or None"
+    CAPACITY = default
+    SITE_CAPACITY = sites
+    _clear()
+
+def _clear():
+    global _cached_bytes
+    _cache.clear()
+    _cached_bytes = 0
+
+def active():
+    """True if any coworking space has a limited capacity"""
+    return CAPACITY is not None or any(cap is not None for cap in SITE_CAPACITY.values())
+
+def capacities(locs):
+    """capacities of coworking spaces
+
+    Args:
+        locs (lst of como.Municipality or AGS): the coworking spaces
+
+    Returns:
+        np.array: capacity of every cws in addressed commuters, np.inf if unlimited
+    """
+    res = [SITE_CAPACITY.get(getattr(loc, 'ags', loc), CAPACITY) for loc in locs]
+    return np.array([np.inf if cap is None else cap for cap in res], dtype = float)
+
+def nearest(model, locs):
+    """assigns every municipality completely to its nearest cws, first one on ties like como.nearest
+
+    Args:
+        model (RegionModel): the model of the region
+        locs (np.array of int): positions of the cws in the model
+
+    Returns:
+        np.array: (municipality, cws) shares of the residents of a municipality served by a cws, 0 or 1
+    """
+    dist = model.dist[:, locs]
+    res = np.zeros(dist.shape)
+    if len(locs):
+        assigned = np.argmin(dist, axis = 1)
+        served = np.isfinite(dist[np.arange(len(model)), assigned])
+        res[np.flatnonzero(served), assigned[served]] = 1
+    return res
+
+def assign(model, locs, capacity = None):
+    """assigns the municipalities of a region to coworking spaces with limited capacities. The shares x[r, c] of the
+    residents of municipality r served by cws c solve the transportation problem
+
+        min  sum_rc w[r] x[r, c] (dist[r, c] - M)
+        s.t. sum_c x[r, c] <= 1                    for every municipality r
+             sum_r commuters[r, c] x[r, c] <= cap[c] for every cws c
+             0 <= x[r, c] <= 1                       for every cws c in reach of r
+
+    with w the commuters living in r and M larger than any travel time: as many residents as possible are served,
+    each as near as possible. The own municipality of a cws is served by it first, as far as its capacity allows.
+    If the nearest assignment respects all capacities it solves the problem and is returned without solving.
+
+    Args:
+        model (RegionModel): the model of the region
+        locs (np.array of int): positions of the cws in the model
+        capacity (np.array, optional): capacity of every cws. Defaults to capacities(locs).
+
+    Returns:
+        np.array: (municipality, cws) shares of the residents of a municipality served by a cws
+    """
+    global _cached_bytes
+    locs = np.asarray(locs, dtype = int)
+    if capacity is None:
+        capacity = capacities([model.muns[c] for c in locs])
+    key = (model.key, tuple(locs.tolist()), tuple(capacity.tolist()))
+    res = np.zeros((len(model), len(locs)))
+    if key in _cache:
+        _stats['cached'] += 1
+        entry = _cache[key] = _cache.pop(key) # most recently used last
+        res[entry[0], entry[1]] = entry[2]
+        return res
+
+    commuters = model.commuters[:, locs]
+    res = nearest(model, locs)
+    load = np.sum(np.where(res > 0, commuters, 0), axis = 0)
+    if np.all(load <= capacity):
+        _stats['nearest'] += 1
+    else:
+        _stats['solved'] += 1
+        res = _solve(model, locs, capacity)
+    rows, cols = np.nonzero(res) # a basic solution has at most n + k nonzero shares
+    entry = (rows.astype(np.int32), cols.astype(np.int32), res[rows, cols])
+    _cache[key] = entry
+    _cached_bytes += _size(key, entry)
+    while _cached_bytes > MAX_BYTES and len(_cache) > 1:
+        oldest = next(iter(_cache))
+        _cached_bytes -= _size(oldest, _cache.pop(oldest))
+    return res
+
+def _size(key, entry):
+    """approximate memory of a memorised assignment in bytes"""
+    return 64*(len(key[1]) + len(key[2])) + sum(array.nbytes for array in entry) + 256
+
+def _solve(model, locs, capacity):
+    """solves the transportation problem of assign with HiGHS"""
+    n, k = len(model), len(locs)
+    dist = model.dist[:, locs]
+    commuters = model.commuters[:, locs]
+    residents = np.maximum(np.bincount(model.workplaces[0], weights = model.workplaces[2], minlength = n), 1e-3)
+    rows, cols = np.nonzero(np.isfinite(dist)) # one variable per pair in reach
+    n_var = len(rows)
+    big = np.max(dist[rows, cols], initial = 0) + 1
+
+    # every municipality at most once, every cws at most its capacity
+    limited = np.flatnonzero(np.isfinite(capacity))
+    per_cws = np.searchsorted(limited, cols)
+    in_limited = np.isin(cols, limited)
+    A = sparse.vstack([sparse.csr_array((np.ones(n_var), (rows, np.arange(n_var))), shape = (n, n_var)),
+                       sparse.csr_array((commuters[rows, cols][in_limited],
+                                         (per_cws[in_limited], np.flatnonzero(in_limited))),
+                                        shape = (len(limited), n_var))])
+    upper = np.r_[np.ones(n), capacity[limited]]
+
+    # own municipality first
+    lower = np.zeros(n_var)
+    own = rows == locs[cols]
+    with np.errstate(divide = 'ignore'):
+        lower[own] = np.minimum(1, capacity[cols[own]]/commuters[rows[own], cols[own]])
+
+    res = milp(residents[rows]*(dist[rows, cols] - big),
+               constraints = [LinearConstraint(A, -np.inf, upper)],
+               bounds = Bounds(lower, 1),
+               options = {'disp': False})
+    assert res.x is not None, f"No assignment found: {res.message}"
+    shares = np.zeros((n, k))
+    shares[rows, cols] = np.clip(np.where(res.x > 1e-9, res.x, 0), 0, 1)
+    return shares
+
+def stats():
+    """number of assignments that were nearest, memorised or solved since the start"""
+    return dict(_stats)
@@ -1,4 +1,5 @@
 import os
+import sys
 import pickle
 import pandas as pd
 import numpy as np
@@ -6,6 +7,7 @@ import requests
 import geopandas as gpd
 from scipy.stats import beta
 from scipy.special import expit
+from scipy.spatial import cKDTree
 from functools import total_ordering
 from tqdm import tqdm
 
@@ -17,36 +19,182 @@ from tqdm import tqdm
 
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 # is /home/<name>/co2work
+
+EARTH_RADIUS = 6371 # km
+MAX_SPEED = 200/60 # km per minute; lower limit for the speed bound used to prune travel time lookups
+RADIUS = None # minutes; coworking spaces farther away are unreachable. None means no limit, see set_radius
+DATA_VERSION = 0 # increased by every load_data; derived caches (e.g. RegionModel) are dropped when it changes
+DATA_FILES = [os.path.join(os.path.dirname(__file__), 'commuters.pickle'),
+              os.path.join(ROOT_DIR, 'data', 'processed', 'Gemeinden', 'AlleGemeinden.csv'),
+              os.path.join(os.path.dirname(__file__), 'distances.pickle'),
+              os.path.join(os.path.dirname(__file__), 'distances_added.pickle'),
+              os.path.join(os.path.dirname(__file__), 'distances.npz')] # the files the data is loaded from
+DATA_SNAPSHOT = [] # name, size and modification time of every DATA_FILES entry when the data was loaded
+COEFFS = (2.42853131, -8.19792602) # logistic model of the mean of the beta distribution in llcw: intercept, slope
+PHI = 3.9282610641028697 # precision of the beta distribution in llcw
+LLCW_MAX_ERROR = None # maximal absolute error of llcw if it interpolates in an LlcwTable. None means exact, see set_llcw_table
         
-def llcw(dist_cowork, dist_wpl):
+def llcw(dist_cowork, dist_wpl, coeffs = COEFFS, phi = PHI):
     """calculates the likelihood to use the coworking space
     Arguments:
         dist_cowork : the distance to the coworking space in minutes
         dist_wpl : the distance to the workplace in minutes
+        coeffs : intercept and slope of the logistic model of the mean. default is COEFFS
+        phi : precision of the beta distribution. default is PHI
+        All arguments are broadcast against each other, e.g. to evaluate several parameter sets at once.
+        If LLCW_MAX_ERROR is set and the parameters are scalars, the result is interpolated in an LlcwTable.
 
     Returns:
         res : a double value between 0 and 1. Interpret as probability that coworking is used.
     """
-    
-    coeffs = [2.42853131, -8.19792602]
-    phi = 3.9282610641028697
-    X = np.stack((np.ones_like(dist_wpl), 1/np.log(dist_wpl)), axis = -1)
-    mu_ = expit(np.dot(X, coeffs))
+    if LLCW_MAX_ERROR is not None and np.ndim(coeffs[0]) == np.ndim(coeffs[1]) == np.ndim(phi) == 0:
+        return LlcwTable.get(coeffs, phi, LLCW_MAX_ERROR)(dist_cowork, dist_wpl)
+    return llcw_exact(dist_cowork, dist_wpl, coeffs, phi)
+
+def llcw_exact(dist_cowork, dist_wpl, coeffs = COEFFS, phi = PHI):
+    """llcw, always evaluated with the beta distribution"""
+    mu_ = expit(coeffs[0] + coeffs[1]/np.log(dist_wpl))
     a_ = mu_ * phi
     b_ = phi - a_
     ratio_ = (dist_wpl - dist_cowork)/dist_wpl
-    param_stack = np.stack((a_, b_, ratio_), axis = -1)
-    if param_stack.ndim == 1:
-        param_stack = param_stack[np.newaxis,:]
-    res = [beta(a, b).cdf(ratio)
-            for a, b, ratio in param_stack]
-    
-    res = np.array(res)
+    # elementwise, so dist_cowork and dist_wpl may be broadcastable arrays of any shape
+    res = np.atleast_1d(beta.cdf(ratio_, a_, b_))
     
     return res
     # res = dist_cowork < dist_wpl
     # return res
 
+class LlcwTable:
+    """llcw on a grid of travel times, answering queries by bilinear interpolation with a bounded error.
+    The error of every grid cell is validated against llcw_exact on a lattice of points in the cell, including its
+    edges, when the table is built. The lattice does not bound the error between its points, so a cell is only
+    interpolated if its error on the lattice is at most max_error/safety. Other cells (e.g. where llcw rises steeply
+    for coworking spaces almost as far away as the workplace) are split into finer cells, which are validated likewise;
+    queries in finer cells that still fail and outside the grid are evaluated exactly.
+    """
+    __tables = dict() # cache of all tables: (intercept, slope, phi, max_error) -> LlcwTable
+    
+    def __init__(self, coeffs = COEFFS, phi = PHI, max_error = 1e-4, max_dist = 240, min_wpl = 2, step = 1, refine = 8, k = 4,
+                 safety = 2):
+        """
+        Args:
+            coeffs, phi (optional): parameters of llcw. Default are COEFFS and PHI.
+            max_error (float, optional): maximal absolute error of an interpolated value. Defaults to 1e-4.
+            max_dist (float, optional): largest travel time in minutes in the grid. Defaults to 240.
+            min_wpl (float, optional): smallest travel time to the workplace in minutes in the grid. Defaults to 2.
+            step (float, optional): grid spacing in minutes. Defaults to 1.
+            refine (int, optional): cells above the maximal error are split into refine x refine cells. Defaults to 8.
+            k (int, optional): validation intervals per cell and axis, i.e. (k+1) x (k+1) points. Defaults to 4.
+            safety (float, optional): cells are interpolated if their error on the lattice is at most max_error/safety.
+                Defaults to 2.
+        """
+        assert max_error > 0, f"max_error must be positive, not {max_error}"
+        self.coeffs, self.phi, self.max_error = coeffs, phi, max_error
+        self.__wpl0, self.__step, self.__refine = min_wpl, step, refine
+        self.__shape = (int(round((max_dist - min_wpl)/step)), int(round(max_dist/step)))
+        wpl, cowork = np.meshgrid(min_wpl + step*np.arange(self.__shape[0]), step*np.arange(self.__shape[1]),
+                                  indexing = 'ij')
+        coef, error = self.__fit(wpl.ravel(), cowork.ravel(), step, k)
+        accepted = max_error/safety
+        
+        # finer cells for the cells above the accepted error
+        coarse = np.flatnonzero(error > accepted)
+        sub = np.arange(refine)*step/refine
+        fine_wpl, fine_cowork = (np.broadcast_to(origin, (len(coarse), refine, refine)).ravel() for origin in
+                                 (wpl.ravel()[coarse, np.newaxis, np.newaxis] + sub[:, np.newaxis],
+                                  cowork.ravel()[coarse, np.newaxis, np.newaxis] + sub[np.newaxis, :]))
+        fine_coef, fine_error = self.__fit(fine_wpl, fine_cowork, step/refine, k)
+        
+        ok, fine_ok = error <= accepted, fine_error <= accepted
+        self.error = max(np.max(error[ok], initial = 0), np.max(fine_error[fine_ok], initial = 0)) # error on the lattice
+        self.coverage = (np.sum(ok) + np.sum(fine_ok)/refine**2)/len(error) # share of the grid that is interpolated
+        # coefficients contiguous per coefficient, nan for cells that are refined or evaluated exactly;
+        # the last column stands for queries out of the grid
+        coef[:, ~ok] = np.nan
+        fine_coef[:, ~fine_ok] = np.nan
+        self.__coef = np.hstack([coef, np.full((4, 1), np.nan)])
+        self.__fine_coef = fine_coef
+        self.__fine = np.full(len(error) + 1, -1) # first fine cell of every refined cell
+        self.__fine[coarse] = np.arange(len(coarse))*refine**2
+    
+    def __fit(self, wpl, cowork, step, k):
+        """bilinear coefficients and maximal error of cells given by their smallest travel times
+        
+        Returns:
+            np.array: (4, cells) coefficients of g00 + (g10 - g00) fx + (g01 - g00) fy + (g11 - g10 - g01 + g00) fx fy
+            np.array: maximal absolute error of every cell on the validation lattice
+        """
+        s = np.arange(k + 1)/k # including the edges, which neighbouring cells share
+        fx, fy = s[:, np.newaxis], s[np.newaxis, :]
+        ex = llcw_exact(cowork[:, np.newaxis, np.newaxis] + fy*step, wpl[:, np.newaxis, np.newaxis] + fx*step,
+                        self.coeffs, self.phi)
+        g00, g10, g01, g11 = ex[:, 0, 0], ex[:, k, 0], ex[:, 0, k], ex[:, k, k]
+        coef = np.array([g00, g10 - g00, g01 - g00, g11 - g10 - g01 + g00])
+        c = coef[:, :, np.newaxis, np.newaxis]
+        interpolated = c[0] + c[1]*fx + (c[2] + c[3]*fx)*fy
+        return coef, np.max(np.abs(interpolated - ex), axis = (1, 2))
+    
+    @classmethod
+    def get(cls, coeffs = COEFFS, phi = PHI, max_error = 1e-4):
+        """returns the (cached) table of a parameter set"""
+        key = (float(coeffs[0]), float(coeffs[1]), float(phi), float(max_error))
+        if key not in cls.__tables:
+            cls.__tables[key] = cls(coeffs, phi, max_error)
+        return cls.__tables[key]
+    
+    @staticmethod
+    def __interpolate(coef, cell, fx, fy):
+        c0, c1, c2, c3 = (c.take(cell) for c in coef)
+        return c0 + c1*fx + (c2 + c3*fx)*fy
+    
+    def __call__(self, dist_cowork, dist_wpl):
+        """llcw of the table's parameters, see llcw"""
+        dist_cowork, dist_wpl = np.asarray(dist_cowork, dtype = float), np.asarray(dist_wpl, dtype = float)
+        if dist_cowork.shape != dist_wpl.shape:
+            dist_cowork, dist_wpl = np.broadcast_arrays(dist_cowork, dist_wpl)
+        shape = dist_cowork.shape
+        dist_cowork, dist_wpl = dist_cowork.ravel(), dist_wpl.ravel()
+        n_wpl, n_cowork = self.__shape
+        x = (dist_wpl - self.__wpl0)/self.__step
+        y = dist_cowork/self.__step
+        outside = ~((x >= 0) & (x < n_wpl) & (y >= 0) & (y < n_cowork)) # also nan and inf
+        x[outside] = y[outside] = 0
+        i, j = x.astype(np.intp), y.astype(np.intp)
+        cell = i*n_cowork + j
+        cell[outside] = n_wpl*n_cowork
+        x -= i
+        y -= j
+        res = self.__interpolate(self.__coef, cell, x, y)
+        
+        missing = np.flatnonzero(np.isnan(res))
+        if len(missing):
+            # queries in refined cells
+            fine = self.__fine[cell[missing]]
+            refined, fine = missing[fine >= 0], fine[fine >= 0]
+            if len(refined):
+                m = self.__refine
+                x, y = x[refined]*m, y[refined]*m
+                i, j = np.minimum(x.astype(np.intp), m - 1), np.minimum(y.astype(np.intp), m - 1)
+                res[refined] = self.__interpolate(self.__fine_coef, fine + i*m + j, x - i, y - j)
+            exact = missing[np.isnan(res[missing])]
+            if len(exact):
+                res[exact] = llcw_exact(dist_cowork[exact], dist_wpl[exact], self.coeffs, self.phi)
+        return np.atleast_1d(res.reshape(shape))
+
+def set_llcw_table(max_error):
+    """sets LLCW_MAX_ERROR: with a maximal absolute error, llcw interpolates in a precomputed LlcwTable, which is
+    much faster than evaluating the beta distribution; None switches back to exact evaluation. Derived caches
+    (RegionModel, result_cache) are kept separately per setting.
+    The setting is global in the process: in the webapp it applies to all sessions of the server. batch.py and
+    service.py select it per job or request, as each of their worker processes runs one at a time.
+
+    Args:
+        max_error (float or None): the maximal absolute error of llcw, e.g. 1e-4
+    """
+    global LLCW_MAX_ERROR
+    assert max_error is None or max_error > 0, f"max_error must be positive or None, not {max_error}"
+    LLCW_MAX_ERROR = max_error
+
 def spcw(dist_cowork, dist_wpl, metric= np.abs):
     """calculates the savings per coworker
     Arguments:
@@ -73,18 +221,21 @@ def assess_savings(mun0, area):
     # assert isinstance(mun0, Municipality), f"{mun0} not an municipality, but {type(mun0)}"
     assert area != [], f"Empty area given: {mun0} und {area}"
     
-    llcw_ = [llcw(np.ones(len(res.commutes_to)) * get_dist(res, mun0),
-                       np.array([get_dist(res, wpl) for wpl in res.commutes_to]))
-             for res in area]
+    dist_cws_ = [get_reach(res, mun0) for res in area] # np.inf if out of RADIUS
+    dist_wpl_ = [np.array([get_dist(res, wpl) for wpl in res.commutes_to], dtype = float) for res in area]
+    # llcw once for all residences of the area (elementwise, so the same values as per residence)
+    n_wpl = [len(dist_wpl) for dist_wpl in dist_wpl_]
+    llcw_ = np.split(llcw(np.repeat(np.array(dist_cws_, dtype = float), n_wpl), np.concatenate(dist_wpl_)),
+                     np.cumsum(n_wpl)[:-1])
     comm_res_wpl_ = [np.array([get_commuters(res, wpl) for wpl in res.commutes_to])
                      for res in area]
-    spcw_ = [spcw(np.ones(len(res.commutes_to)) * get_dist(res, mun0),
-                       np.array([get_dist(res, wpl) for wpl in res.commutes_to]))
-             for res in area]
+    spcw_ = [spcw(np.ones(len(dist_wpl)) * dist_cws, dist_wpl)
+             for dist_wpl, dist_cws in zip(dist_wpl_, dist_cws_)]
     
     # calculate exact pairs res, wpl, cws
     commuters = [x*y for x,y in zip(llcw_, comm_res_wpl_)]
-    savings = [x*y for x,y in zip(spcw_, commuters)]
+    savings = [x*y if np.isfinite(dist_cws) else np.zeros_like(y)
+               for x, y, dist_cws in zip(spcw_, commuters, dist_cws_)]
     
     # aggregate over wpl to res, cws
     commuters = np.array([np.sum(x) for x in commuters])
@@ -109,47 +260,85 @@ def ags(mun_list):
 class Municipality:
     __mundict = dict() # dictionary of all instances: ags -> municipality
     __munset = set() # set of all instances: municipality
+    __muns = [] # all instances by id
+    __coords = np.zeros((0, 2)) # (lat, lon) by id; grows by doubling
+    __rank = None # rank of the AGS by id, dropped when a municipality is added
+    __commutes = None # commuting destinations of all instances as ids (flat, offsets by id), dropped when they change
+    __slots__ = ('__ags', '__name', '__id', '__commutes_to')
     
     ags = property(lambda self : self.__ags) # str -> unique ID
     name = property(lambda self : self.__name) # str -> Klartext Name
-    coord = property(lambda self : self.__coord) # (lat, lon) tuple -> Siedlungsschwerpunkt
+    id = property(lambda self : self.__id) # int -> dense ID, position in all arrays of the registry
+    coord = property(lambda self : tuple(Municipality.__coords[self.__id].tolist())) # (lat, lon) tuple -> Siedlungsschwerpunkt
     commutes_to = property(lambda self : self.__commutes_to) # commuting destinations
     
+    @property
+    def commutes_ids(self):
+        """ids of the commuting destinations as int array"""
+        cls = Municipality
+        if cls.__commutes is None:
+            ids = [cls.ids(getattr(mun, '_Municipality__commutes_to', [])) for mun in cls.__muns]
+            cls.__commutes = (np.concatenate([np.zeros(0, dtype = int), *ids]),
+                              np.cumsum([0, *map(len, ids)]))
+        flat, offsets = cls.__commutes
+        return flat[offsets[self.__id]:offsets[self.__id + 1]]
+    
     def __init__(self, ags, name, coord):
+        cls = Municipality
+        ags = sys.intern(ags)
         self.__ags = ags
         self.__name = f"{name.split(',')[0].strip()} ({name.split(',')[1].strip()})" if ',' in name else name
-        self.__coord = coord
+        # an AGS keeps its id, also if it is read again
+        self.__id = cls.__mundict[ags].id if ags in cls.__mundict else len(cls.__muns)
+        if self.__id == len(cls.__muns):
+            cls.__muns.append(self)
+            cls.__rank = cls.__commutes = None
+            if self.__id == len(cls.__coords):
+                cls.__coords = np.concatenate([cls.__coords, np.zeros((max(len(cls.__coords), 64), 2))])
+        else:
+            cls.__muns[self.__id] = self
+        cls.__coords[self.__id] = coord
         self.__mundict[ags] = self
         self.__munset.add(self)
         pass
+    
+    def __reduce__(self):
+        # pickled as a reference into the registry, e.g. for worker processes
+        return (Municipality.get, (self.ags,))
 
     def _set_commutes_to(self):
         try:
             self.__commutes_to = Municipality.get(get_commuters.image(self.ags))
         except KeyError:
             self.__commutes_to = []
+        Municipality.__commutes = None
     
     def __eq__(self, other):
-        if type(other) == str:
-            eq = self.ags == other
-        else:
-            eq = self.ags == other.ags
-        return eq
+        if other.__class__ is Municipality:
+            return self.__id == other.__id
+        return self.ags == other # AGS string
 
     def __lt__(self, other):
-        if type(other) == str:
-            lt = self.ags < other
-        else:
-            lt = self.ags < other.ags
-        return lt
+        if other.__class__ is Municipality:
+            return self.__ags < other.__ags
+        return self.ags < other # AGS string
     
     def __hash__(self):
         return hash(self.ags)        
     
     @classmethod
     def read_csv(cls, file):
+        """reads municipalities (AGS, Name, Latitude, Longitude). Known AGS update their existing instance in place,
+        so that instances held elsewhere (e.g. in a session) stay valid."""
         df = pd.read_csv(file, dtype={'AGS': str})
-        muns = {cls(e.AGS, e.Name, (e.Latitude, e.Longitude)) for e in df.itertuples()}
+        muns = set()
+        for e in df.itertuples():
+            if e.AGS in cls.__mundict:
+                mun = cls.__mundict[e.AGS]
+                mun.__init__(e.AGS, e.Name, (e.Latitude, e.Longitude))
+            else:
+                mun = cls(e.AGS, e.Name, (e.Latitude, e.Longitude))
+            muns.add(mun)
         [mun._set_commutes_to() for mun in muns]   
         return muns
     
@@ -177,6 +366,40 @@ class Municipality:
     def get_mundict(cls):     
         return cls.__mundict
     
+    @classmethod
+    def ids(cls, muns):
+        """ids of municipalities as int array"""
+        return np.fromiter((mun.id for mun in muns), dtype = int, count = len(muns))
+    
+    @classmethod
+    def from_ids(cls, ids):
+        """municipalities of ids as list"""
+        return [cls.__muns[i] for i in ids]
+    
+    @classmethod
+    def coords(cls, muns):
+        """(lat, lon) of municipalities as (n, 2) array"""
+        return cls.__coords[cls.ids(muns)]
+    
+    @classmethod
+    def sort_ids(cls, ids):
+        """sorts ids by AGS, i.e. in the order of sorting the municipalities; returns an int array"""
+        if cls.__rank is None:
+            cls.__rank = np.empty(len(cls.__muns), dtype = int)
+            cls.__rank[np.argsort([mun.ags for mun in cls.__muns], kind = 'stable')] = np.arange(len(cls.__muns))
+        ids = np.asarray(ids, dtype = int)
+        return ids[np.argsort(cls.__rank[ids], kind = 'stable')]
+    
+    @classmethod
+    def intersect_ids(cls, ids, other_ids):
+        """like np.intersect1d on municipalities, on ids: sorted by AGS, unique"""
+        return cls.sort_ids(np.intersect1d(ids, other_ids))
+    
+    @classmethod
+    def union_ids(cls, ids, other_ids):
+        """like np.union1d on municipalities, on ids: sorted by AGS, unique"""
+        return cls.sort_ids(np.union1d(ids, other_ids))
+    
     def __repr__(self) -> str:
         return f"{self.name}"
     
@@ -223,9 +446,134 @@ def get_commuters(origin, destination):
     
     return res
 
+def chord(orig_coords, dest_coords):
+    """straight line distance through the earth between (lat, lon) coordinates in km.
+    It is never longer than any route between them.
+
+    Args:
+        orig_coords (array of (lat, lon)): coordinates in degrees
+        dest_coords (array of (lat, lon)): coordinates in degrees, broadcastable to orig_coords
+
+    Returns:
+        np.array: the distances in km
+    """
+    return np.linalg.norm(_xyz(orig_coords) - _xyz(dest_coords), axis = -1)
+
+def _xyz(coords):
+    lat, lon = np.radians(np.moveaxis(np.asarray(coords, dtype = float), -1, 0))
+    return EARTH_RADIUS * np.stack((np.cos(lat)*np.cos(lon),
+                                    np.cos(lat)*np.sin(lon),
+                                    np.sin(lat)), axis = -1)
+
+def max_speed():
+    """upper bound for the speed in km per minute of every cached connection, at least MAX_SPEED.
+    chord(origin, destination) / max_speed() is a lower bound for get_dist(origin, destination).
+    """
+    if get_dist._max_speed is None:
+        mundict = Municipality.get_mundict()
+        graph = get_dist._graph
+        # the cached distances are only looked up for pairs out of a graph covering RADIUS
+        cached = get_dist._dist_cache if graph is not None and RADIUS is not None and RADIUS <= graph.radius \
+            else cached_dists()
+        pairs = [(mundict[orig].coord, mundict[dest].coord, val['duration'])
+                 for orig, dests in (cached or {}).items() if orig in mundict
+                 for dest, val in dests.items() if dest in mundict and orig != dest]
+        pairs = [tuple(map(np.array, zip(*pairs)))] if pairs else []
+        if get_dist._graph is not None:
+            pairs.append(get_dist._graph.pairs())
+        speed = MAX_SPEED
+        for orig_coords, dest_coords, durations in pairs:
+            if len(durations):
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    speed = max(speed, np.nanmax(chord(orig_coords, dest_coords)/durations))
+        get_dist._max_speed = speed
+    return get_dist._max_speed
+
+def nearest(origins, destinations):
+    """finds the destination with the shortest travel time for every origin.
+    Result is identical to np.argmin([get_reach(origin, dest) for dest in destinations]) for every origin,
+    but destinations are visited in order of their straight line distance (KD-tree) and travel times are
+    only looked up until the lower bound chord / max_speed() exceeds the shortest travel time found or RADIUS.
+
+    Args:
+        origins (lst of Municipality): the origins
+        destinations (lst of Municipality): the destinations
+
+    Returns:
+        np.array: for every origin the position of its nearest destination in destinations, -1 if none is in reach
+    """
+    if not len(origins):
+        return np.zeros(0, dtype = int)
+    tree = cKDTree(_xyz(Municipality.coords(destinations)))
+    points = _xyz(Municipality.coords(origins))
+    speed = max_speed()
+    
+    def query(k):
+        bounds, idx = tree.query(points, k = list(range(1, k + 1)))
+        return bounds/speed, idx
+    
+    radius = np.inf if RADIUS is None else RADIUS
+    k = min(8, len(destinations))
+    bounds, idx = query(k)
+    res = np.zeros(len(origins), dtype = int)
+    for o, origin in enumerate(origins):
+        best, best_j, pruned = np.inf, -1, False
+        for bound, j in zip(bounds[o], idx[o]):
+            if bound > min(best, radius):
+                pruned = True
+                break
+            dist = get_reach(origin, destinations[j])
+            if dist < best or (dist == best and j < best_j):
+                best, best_j = dist, j
+        if not pruned and k < len(destinations):
+            # the k nearest destinations by air were not enough; visit all of them
+            if len(bounds[o]) == k:
+                bounds, idx = query(len(destinations))
+            for bound, j in zip(bounds[o][k:], idx[o][k:]):
+                if bound > min(best, radius):
+                    break
+                dist = get_reach(origin, destinations[j])
+                if dist < best or (dist == best and j < best_j):
+                    best, best_j = dist, j
+        res[o] = best_j if np.isfinite(best) else -1
+    return res
+
+def set_radius(radius):
+    """sets RADIUS, the travel time in minutes beyond which coworking spaces are unreachable.
+    Out of radius pairs do not contribute to assess_savings and are never assigned to each other.
+
+    Args:
+        radius (float or None): the radius in minutes; None means no limit
+    """
+    global RADIUS
+    RADIUS = radius
+
+def get_reach(origin, cws):
+    """looks up the travel time from a municipality to a coworking space.
+    Like get_dist, but np.inf if the coworking space is farther away than RADIUS. If the loaded
+    DistanceGraph covers RADIUS, pairs missing in it are out of radius and not looked up at all.
+
+    Args:
+        origin (municipality): the municipality of residence
+        cws (municipality): the municipality hosting the coworking space
+
+    Returns:
+        np.float: travel time in minutes or np.inf
+    """
+    if RADIUS is None:
+        return get_dist(origin, cws)
+    graph = get_dist._graph
+    if graph is not None and RADIUS <= graph.radius:
+        res = graph.get(origin.ags, cws.ags)
+        res = np.inf if res is None else res
+    else:
+        res = get_dist(origin, cws)
+    return res if res <= RADIUS else np.inf
+
 def get_dist(origin, destination, disttype = 'duration'):
     """looks up the linear distance between two municipalities.
-    If no look-up is available, distance is calculated and stored.
+    Travel times are looked up in the DistanceGraph first, if there is one, then in the cached distances
+    (see cached_dists). If no look-up is available, distance is calculated and stored.
 
     Args:
         origin (municipality): The AGS (LAU_ID) of a german municipality
@@ -241,11 +589,18 @@ def get_dist(origin, destination, disttype = 'duration'):
     if origin.ags > destination.ags:
         origin, destination = destination, origin
         
-    try: 
-        #look-up in cache
-        res = get_dist._dist_cache[origin.ags][destination.ags][disttype]
-        
-    except:
+    #look-up in sparse travel times
+    res = get_dist._graph.get(origin.ags, destination.ags) \
+        if get_dist._graph is not None and disttype == 'duration' else None
+    
+    if res is None:
+        try: 
+            #look-up in cache
+            res = cached_dists()[origin.ags][destination.ags][disttype]
+        except KeyError:
+            res = None
+    
+    if res is None:
         
         #get coordinates
         orig_coord = origin.coord  # lat, lon tuple
@@ -263,20 +618,21 @@ def get_dist(origin, destination, disttype = 'duration'):
         distance = response_json['routes'][0]['distance']/1000
         duration = response_json['routes'][0]['duration']/60                        
         
-        # save in local cache
-        try:
-            get_dist._dist_cache[origin.ags][destination.ags] = {'duration' : duration,
-                                                'distance' : distance}
-        except:
-            get_dist._dist_cache[origin.ags] = {destination.ags : {'duration' : duration,
-                                                  'distance' : distance}}
+        # save in local cache and among the pairs added since distances.pickle was written
+        for cache in (get_dist._dist_cache, get_dist._added):
+            cache.setdefault(origin.ags, {})[destination.ags] = {'duration' : duration,
+                                                                'distance' : distance}
+        
+        # keep the speed bound valid
+        if get_dist._max_speed is not None and duration > 0:
+            get_dist._max_speed = max(get_dist._max_speed, chord(orig_coord, dest_coord)/duration)
         
         # update saved cache
         get_dist._new_cached += 1
         if get_dist._new_cached > 999:
-            """Saves the cached distances on the hard drive for future loads"""
-            with open(os.path.dirname(__file__) + '/distances.pickle', 'wb') as f:
-                    pickle.dump(get_dist._dist_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            """Saves the added distances on the hard drive for future loads; the large distances.pickle is not rewritten"""
+            with open(os.path.dirname(__file__) + '/distances_added.pickle', 'wb') as f:
+                    pickle.dump(get_dist._added, f, protocol=pickle.HIGHEST_PROTOCOL)
             get_dist._new_cached = 0
             
         # look up in cache
@@ -284,34 +640,187 @@ def get_dist(origin, destination, disttype = 'duration'):
             
     return res
 
+def cached_dists():
+    """returns the cached distances, {AGS: {AGS: {'duration': minutes, 'distance': km}}} with the smaller AGS first.
+    They are loaded from distances.pickle and distances_added.pickle (the pairs looked up since) on first use, so that
+    a process whose lookups are covered by the DistanceGraph never holds them in memory.
+    """
+    if get_dist._dist_cache is None:
+        cache, added = {}, {}
+        try:
+            with open(os.path.dirname(__file__) + '/distances.pickle', 'rb') as f:
+                cache = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        try:
+            with open(os.path.dirname(__file__) + '/distances_added.pickle', 'rb') as f:
+                added = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+        for orig, dests in added.items():
+            cache.setdefault(orig, {}).update(dests)
+        get_dist._dist_cache, get_dist._added = cache, added
+        get_dist._max_speed = None # recomputed including the loaded pairs
+    return get_dist._dist_cache
+
 def delete_dist():
     """Deletes the cached distances on hard drive and in workspace"""
-    try:
-        os.remove(os.path.dirname(__file__) + '/distances.pickle')
-    except:
-        print("no cache")
-    finally:
-        # reset work memory
-        get_dist._dist_cache = {}
-        get_dist._new_cached = 0
-    pass
-
-  
-# load commuter data
-with open(os.path.dirname(__file__) + '/commuters.pickle', 'rb') as f:
-    get_commuters.__commuter_dict = pickle.load(f)
-    
-get_commuters.image = lambda ags: get_commuters.__commuter_dict[ags].keys() 
-
-# loading municipality data
-with open(ROOT_DIR + '/data/processed/Gemeinden/AlleGemeinden.csv') as f:
-    Municipality.read_csv(f)
-    
-# load cached distances
-try:
-    with open(os.path.dirname(__file__) + '/distances.pickle', 'rb') as f:
-        get_dist._dist_cache = pickle.load(f)
-        get_dist._new_cached = 0
-except:
+    for file in ('/distances.pickle', '/distances_added.pickle'):
+        try:
+            os.remove(os.path.dirname(__file__) + file)
+        except FileNotFoundError:
+            print(f"no cache {file[1:]}")
+    # reset work memory
     get_dist._dist_cache = {}
-    get_dist._new_cached = 0 
+    get_dist._added = {}
+    get_dist._new_cached = 0
+    get_dist._max_speed = None
+
+class DistanceGraph:
+    """travel times between municipalities as sparse, quantised matrix.
+    Keeps only pairs within a radius (and all pairs with commuters between them), so that even
+    nationwide travel times fit into memory. Only the upper triangle (smaller AGS first) is stored.
+    """
+    ags = property(lambda self : self.__ags) # np.array of AGS, fixes the order of rows and columns
+    radius = property(lambda self : self.__radius) # minutes; all pairs within are stored
+    
+    def __init__(self, ags, indptr, indices, data, radius, scale = 1):
+        """
+        Args:
+            ags (array of str): sorted AGS of all municipalities
+            indptr, indices, data (np.array): the upper triangle in CSR format
+            radius (float): all pairs with a travel time up to radius minutes are stored
+            scale (float, optional): data is the travel time in minutes times scale. Defaults to 1.
+        """
+        self.__ags = np.asarray(ags, dtype = str)
+        self.__index = {a: i for i, a in enumerate(self.ags)}
+        self.__indptr, self.__indices, self.__data = indptr, indices, data
+        self.__radius = radius
+        self.__scale = scale
+    
+    @classmethod
+    def from_cache(cls, radius, dtype = np.uint16, scale = 10):
+        """builds the graph from the cached distances of get_dist.
+
+        Args:
+            radius (float): travel time in minutes up to which pairs are kept
+            dtype (np.dtype, optional): storage type; np.uint16 (default) or np.float32
+            scale (float, optional): resolution for integer types; 10 stores tenths of minutes. Defaults to 10.
+
+        Returns:
+            DistanceGraph: the graph
+        """
+        scale = scale if np.issubdtype(dtype, np.integer) else 1
+        mundict = Municipality.get_mundict()
+        ags = np.array(sorted(mundict), dtype = str)
+        index = {a: i for i, a in enumerate(ags)}
+        rows, cols, durations = [], [], []
+        for orig, dests in cached_dists().items():
+            for dest, val in dests.items():
+                if orig in index and dest in index and orig != dest and (val['duration'] <= radius
+                        or get_commuters(mundict[orig], mundict[dest])
+                        or get_commuters(mundict[dest], mundict[orig])):
+                    rows.append(index[orig]); cols.append(index[dest]); durations.append(val['duration'])
+        rows, cols, durations = np.array(rows, dtype = int), np.array(cols, dtype = int), np.array(durations)
+        order = np.lexsort((cols, rows))
+        indptr = np.searchsorted(rows[order], np.arange(len(ags) + 1)).astype(np.int64)
+        data = durations[order]*scale
+        if np.issubdtype(dtype, np.integer):
+            data = np.clip(np.round(data), 0, np.iinfo(dtype).max)
+        return cls(ags, indptr, cols[order].astype(np.int32), data.astype(dtype), radius, scale)
+    
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as f:
+            return cls(f['ags'], f['indptr'], f['indices'], f['data'], float(f['radius']), float(f['scale']))
+    
+    def save(self, file):
+        np.savez_compressed(file, ags = self.ags, indptr = self.__indptr, indices = self.__indices,
+                            data = self.__data, radius = self.radius, scale = self.__scale)
+    
+    @property
+    def nbytes(self):
+        return self.__indptr.nbytes + self.__indices.nbytes + self.__data.nbytes
+    
+    def get(self, orig_ags, dest_ags):
+        """travel time in minutes between two municipalities or None if not stored"""
+        if orig_ags == dest_ags:
+            return 0.
+        try:
+            i, j = sorted((self.__index[orig_ags], self.__index[dest_ags]))
+        except KeyError:
+            return None
+        start, end = self.__indptr[i], self.__indptr[i + 1]
+        pos = start + np.searchsorted(self.__indices[start:end], j)
+        if pos < end and self.__indices[pos] == j:
+            return float(self.__data[pos])/self.__scale
+        return None
+    
+    def pairs(self):
+        """all stored pairs as arrays of origin coordinates, destination coordinates and travel times"""
+        mundict = Municipality.get_mundict()
+        coords = np.array([mundict[a].coord if a in mundict else (np.nan, np.nan) for a in self.ags])
+        rows = np.repeat(np.arange(len(self.ags)), np.diff(self.__indptr))
+        return coords[rows], coords[self.__indices], self.__data.astype(float)/self.__scale
+
+def compress_dist(radius, dtype = np.uint16, scale = 10):
+    """Stores the cached distances within radius as DistanceGraph on the hard drive and uses it from now on.
+    Travel times of pairs out of radius are then only looked up if needed for commuters.
+    
+    Args: see DistanceGraph.from_cache
+
+    Returns:
+        DistanceGraph: the graph
+    """
+    global DATA_VERSION
+    get_dist._graph = DistanceGraph.from_cache(radius, dtype, scale)
+    get_dist._graph.save(os.path.dirname(__file__) + '/distances.npz')
+    get_dist._max_speed = None
+    # travel times are now taken from the graph
+    _snapshot()
+    DATA_VERSION += 1
+    return get_dist._graph
+
+def _snapshot():
+    """records DATA_SNAPSHOT"""
+    global DATA_SNAPSHOT
+    DATA_SNAPSHOT = []
+    for file in DATA_FILES:
+        try:
+            stat = os.stat(file)
+            DATA_SNAPSHOT.append([os.path.basename(file), stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            DATA_SNAPSHOT.append([os.path.basename(file), None, None])
+
+def load_data():
+    """loads commuters, municipalities and travel times from disk. Runs once on import, so all users of the module
+    in a process share the data; call it again only to pick up changed data files. Municipality instances are
+    updated in place and derived caches are invalidated via DATA_VERSION. DATA_SNAPSHOT records the state of the
+    files before they are read, so that results can be keyed by the data actually loaded (see result_cache).
+    """
+    global DATA_VERSION
+    _snapshot()
+    # load commuter data
+    with open(os.path.dirname(__file__) + '/commuters.pickle', 'rb') as f:
+        get_commuters.__commuter_dict = pickle.load(f)
+        
+    get_commuters.image = lambda ags: get_commuters.__commuter_dict[ags].keys() 
+
+    # loading municipality data
+    with open(ROOT_DIR + '/data/processed/Gemeinden/AlleGemeinden.csv') as f:
+        Municipality.read_csv(f)
+        
+    # cached distances, loaded on first use (see cached_dists)
+    get_dist._dist_cache = None
+    get_dist._added = {}
+    get_dist._new_cached = 0
+    get_dist._max_speed = None
+
+    # load sparse travel times (see compress_dist)
+    try:
+        get_dist._graph = DistanceGraph.load(os.path.dirname(__file__) + '/distances.npz')
+    except FileNotFoundError:
+        get_dist._graph = None
+    DATA_VERSION += 1
+
+load_data() 
@@ -4,18 +4,36 @@ from tqdm import tqdm
 from functools import lru_cache, total_ordering
 import concurrent
 import copy
+import heapq
+import time
+from scipy import sparse
+from scipy.optimize import milp, LinearConstraint, Bounds
 import sys
 sys.path.append('.../co2work/code/localization')
 import commuting_model as como
+import result_cache
+import capacity
+from region_model import RegionModel
 
 
 # This code gives solutions to a coworking space optimization problem within a specified region. It does so by cinluding methods for mutation, combination, and updating based on specific criteria. The code further implements a genetic algorithm and a kLocs algorithm for optimizing coworking space locations. Additionally, there is a function for generating heatmaps to visualize potential improvements in coworking space locations compared to a reference solution.
 
 
+# reasons why an optimizer stopped; reported in result_df.attrs['stop_reason']
+STOP_REASONS = {
+    'n_gen' : "Alle Generationen wurden berechnet.",
+    'converged' : "Die Lösung ist lokal optimal.",
+    'stagnation' : "Die Lösungen haben sich nicht mehr nennenswert verbessert.",
+    'max_steps' : "Die maximale Anzahl an Schritten wurde erreicht.",
+    'time_budget' : "Das Zeitbudget wurde ausgeschöpft.",
+    'optimal' : "Die Lösung ist beweisbar optimal.",
+}
+
+
 @total_ordering
 class Solution:    
     
-    def __init__(self, region, locs = False, **kwargs) -> None:
+    def __init__(self, region, locs = False, rng = None, **kwargs) -> None:
         """generates a Solution in a region, either with given locations
         for coworoking spaces or with randomly assigned locations from the region.
         
@@ -23,10 +41,14 @@ class Solution:
         Args:
             region (lst of AGS-Prefix or lst of como.Municipality): region in which coworking spaces shall be optimized
             locs (lst of AGS, optional): Given Locations. Defaults to False -> Randomly generating.
+            rng (np.random.Generator or seed, optional): random number generator for the random locations,
+                mutate and combine. Defaults to a freshly seeded one.
             n_cws (int, mandatory if no locs are given): number of randomly generated locations.
             fixed_cws (lst of AGS, optional): fixed locations for coworking spaces
            
         """
+        self.__rng = rng
+        self.__region_ids = None
         # set region
         if all(isinstance(el, como.Municipality) for el in region):
             self.__region = region
@@ -46,9 +68,9 @@ class Solution:
             assert self.n_cws > self.n_fixed, f"More fixed cws than cws to be set. Ensure n_cws > len(fixed_cws)"
             candidates = [mun for mun in self.region if mun not in fixed_cws]
             locs = [*fixed_cws,
-                    *np.random.choice(candidates,
-                                      size=self.n_cws-self.n_fixed,
-                                      replace=False)]
+                    *self.rng.choice(candidates,
+                                     size=self.n_cws-self.n_fixed,
+                                     replace=False)]
         else:
             self.__n_cws = len(locs)
             assert(all([e in locs for e in fixed_cws])), f"locs must contain every fixed_cws"
@@ -85,8 +107,16 @@ class Solution:
             self.__region = val
         else:
             self.__region = como.Municipality.dissolve(tuple(val))
+        self.__region_ids = None
         self.update()  
     
+    @property
+    def region_ids(self):
+        """ids of the municipalities of the region as int array"""
+        if self.__region_ids is None:
+            self.__region_ids = como.Municipality.ids(self.region)
+        return self.__region_ids
+    
     @property
     def fixed_cws(self):
         return self.locs[0:self.__n_fixed]
@@ -103,6 +133,12 @@ class Solution:
     def n_fixed(self):
         return self.__n_fixed   
     
+    @property
+    def rng(self):
+        if not isinstance(self.__rng, np.random.Generator): # created on first use
+            self.__rng = np.random.default_rng(self.__rng)
+        return self.__rng
+    
     @property
     def areas(self):
         return self.__areas        
@@ -147,22 +183,50 @@ class Solution:
         pass   
         
     def update(self):
-        """updates areas and savings of a solution."""    
+        """updates areas and savings of a solution. If coworking spaces have limited capacities (see
+        capacity.set_capacity), municipalities are assigned by capacity.assign and may be split between areas."""    
+        if capacity.active():
+            return self.__update_capacitated()
         # calculating areas        
-        nearest_loc = {mun: self.locs[np.argmin([como.get_dist(mun, loc) for loc in self.locs])] for mun in self.region}
-        new_areas = [[mun for mun in self.region if nearest_loc[mun] == loc] for loc in self.locs]        
+        assigned = como.nearest(self.region, self.locs)
+        new_areas = [[] for loc in self.locs]
+        for mun, pos in zip(self.region, assigned):
+            if pos >= 0: # else no cws in reach (como.RADIUS)
+                new_areas[pos].append(mun)
         self.__areas = new_areas
         
         sav_comm = [como.assess_savings(locs, new_areas[i])
                           for i, locs in enumerate(self.locs)] 
         self.__savings = [saving for saving, _ in sav_comm]
-        self.__commuters = [commuter for _, commuter in sav_comm]        
-        self.__area_savings = [np.sum(area_savings) for area_savings in self.savings]  
-        self.__area_commuters = [np.sum(area_commuters) for area_commuters in self.commuters]      
-        self.__total_saving = np.sum(self.area_savings) 
-        self.__total_commuters = np.sum(self.area_commuters)
+        self.__commuters = [commuter for _, commuter in sav_comm]
+        # aggregated over vectors in the order of the region with zeros for other areas,
+        # so that evaluate_many reproduces the sums exactly
+        savings = np.zeros(len(self.region))
+        commuters = np.zeros(len(self.region))
+        for i in range(self.n_cws):
+            savings[assigned == i] = self.savings[i]
+            commuters[assigned == i] = self.commuters[i]
+        self.__area_savings = [np.sum(np.where(assigned == i, savings, 0)) for i in range(self.n_cws)]
+        self.__area_commuters = [np.sum(np.where(assigned == i, commuters, 0)) for i in range(self.n_cws)]
+        self.__total_saving = np.sum(savings)
+        self.__total_commuters = np.sum(commuters)
         pass
     
+    def __update_capacitated(self):
+        model = RegionModel.get(self.region)
+        locs = model.index(self.locs)
+        shares = capacity.assign(model, locs)
+        # same operations as in evaluate_positions
+        savings = np.where(shares > 0, shares * model.savings[:, locs], 0)
+        commuters = np.where(shares > 0, shares * model.commuters[:, locs], 0)
+        self.__areas = [[model.muns[r] for r in np.flatnonzero(shares[:, i] > 0)] for i in range(self.n_cws)]
+        self.__savings = [savings[shares[:, i] > 0, i] for i in range(self.n_cws)]
+        self.__commuters = [commuters[shares[:, i] > 0, i] for i in range(self.n_cws)]
+        self.__area_savings = list(np.sum(savings, axis = 0))
+        self.__area_commuters = list(np.sum(commuters, axis = 0))
+        self.__total_saving = np.sum(np.sum(savings, axis = 1))
+        self.__total_commuters = np.sum(np.sum(commuters, axis = 1))
+
     def __repr__(self):
         return f"{self.locs}"
     
@@ -174,22 +238,21 @@ class Solution:
         """
         p_stay = 1 - p_mut
         
-        exclude = []
-        def mut(locs, pos):
-            mun = locs[pos]
-            candidates = np.intersect1d(mun.commutes_to, self.region)
-            candidates = [cand for cand in candidates \
-                          if cand not in locs
-                          and cand not in exclude]
-            weights = [mun.get_commuters(wpl) for wpl in candidates]
-            candidates = [mun, *candidates] # candidates at least one long (original)
+        Mun = como.Municipality
+        exclude = list(Mun.ids(self.locs)) # ids of locs and of muns already mutated to
+        def mut(mun):
+            # set operations on ids, candidates in the order of the municipalities like np.intersect1d
+            candidates = Mun.intersect_ids(mun.commutes_ids, self.region_ids)
+            candidates = candidates[~np.isin(candidates, exclude)]
+            weights = [mun.get_commuters(wpl) for wpl in Mun.from_ids(candidates)]
+            candidates = [mun.id, *candidates] # candidates at least one long (original)
             weights = [p_stay*np.sum(weights)+.1, *weights] # original location gets p_mut of weight + epsilon (.1) to ensure it is picked if no 
-            res = np.random.choice(candidates,
-                                   p = weights/np.sum(weights))
+            res = self.rng.choice(candidates,
+                                  p = weights/np.sum(weights))
             exclude.append(res) # ensure that not two muns mutate to same mun         
-            return res
+            return Mun.from_ids([res])[0]
             
-        mut_alt = [mut(self.locs, pos) for pos in np.arange(self.n_fixed,self.n_cws)]
+        mut_alt = [mut(self.locs[pos]) for pos in np.arange(self.n_fixed,self.n_cws)]
         
             
         self.locs = [*self.fixed_cws, *mut_alt]
@@ -200,125 +263,377 @@ class Solution:
 
         Args:
             other (solution): another solution
-            agg_func (method, optional): how region is aggregated. Defaults to np.union1d.
+            agg_func (method, optional): how region is aggregated. Defaults to np.union1d (computed on ids).
             agg_n_cws (method, optional): how n_cws is aggregated. Defaults to max.
 
         Returns:
-            Solution: a new solution based on seld and other
+            Solution: a new solution based on seld and other, using the random number generator of self
         """
-        region = agg_func(self.region, other.region)
-        fixed_cws = np.union1d(self.fixed_cws, other.fixed_cws)
-        candidates = np.intersect1d(np.union1d(self.locs, other.locs), region)
-        candidates = [cand for cand in candidates \
-            if cand not in fixed_cws]
+        Mun = como.Municipality
+        if agg_func is np.union1d:
+            region_ids = Mun.union_ids(self.region_ids, other.region_ids)
+            region = Mun.from_ids(region_ids)
+        else:
+            region = agg_func(self.region, other.region)
+            region_ids = Mun.ids(region)
+        fixed_ids = Mun.union_ids(Mun.ids(self.fixed_cws), Mun.ids(other.fixed_cws))
+        fixed_cws = Mun.from_ids(fixed_ids)
+        candidates = Mun.intersect_ids(Mun.union_ids(Mun.ids(self.locs), Mun.ids(other.locs)), region_ids)
+        candidates = candidates[~np.isin(candidates, fixed_ids)]
         n_cws = agg_n_cws(self.n_cws, other.n_cws)
         locs = [*fixed_cws,
-                *np.random.choice(candidates,
-                                  size = n_cws - len(fixed_cws),
-                                  replace = False)]
+                *Mun.from_ids(self.rng.choice(candidates,
+                                              size = n_cws - len(fixed_cws),
+                                              replace = False))]
         return Solution(region = region,
                         fixed_cws = fixed_cws,
-                        locs = locs)
+                        locs = locs,
+                        rng = self.rng)
         
-    def step(self):     
+    def step(self, positions = None):     
         """
         for every area, that does belong to a placed coworking space, i.e. not belongs to an existing coworking space,
         find that alternative municipality inside that label that is also a candidate and minimizes the target function       
+        With capacities (see capacity.set_capacity) a candidate is scored on the shares of the municipalities in the area,
+        its savings rationed proportionally if the area would exceed its capacity. The other areas are kept, so the score
+        approximates the saving after the step, which update computes with a new assignment.
+        
+        Args:
+            positions (iterable of int, optional): positions in locs to which the step is restricted. Defaults to all non-fixed cws.
         """
-        alt_centers = [[mun for mun in self.areas[pos]]
-                       for pos in np.arange(self.n_fixed,self.n_cws)]
+        if positions is None:
+            positions = np.arange(self.n_fixed, self.n_cws)
+        positions = [pos for pos in positions if pos >= self.n_fixed and len(self.areas[pos])]
                 
+        if capacity.active():
+            model = RegionModel.get(self.region)
+            shares = capacity.assign(model, model.index(self.locs))
+
         def calc_alt_saving(pos):
-            alt_center_list = alt_centers[pos - self.n_fixed]
+            # with capacities an area can contain the municipality of another cws, which must not be placed twice
+            taken = {mun.ags for i, mun in enumerate(self.locs) if i != pos}
+            alt_center_list = [mun for mun in self.areas[pos] if mun.ags not in taken]
+            if not alt_center_list:
+                return self.locs[pos]
+            if capacity.active():
+                members = model.index(alt_center_list)
+                share = shares[members, pos]
+                saving = share @ model.savings[np.ix_(members, members)]
+                load = share @ np.where(np.isfinite(model.dist[np.ix_(members, members)]),
+                                        model.commuters[np.ix_(members, members)], 0)
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    rationed = np.minimum(1, np.where(load > 0, capacity.capacities(alt_center_list)/load, 1))
+                return alt_center_list[np.argmax(saving * rationed)]
             alt_saving = [np.sum(como.assess_savings(alt_center, self.areas[pos])[0])
                           for alt_center in alt_center_list]
             alt_center = alt_center_list[np.argmax(alt_saving)]
             return alt_center
         
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            best_alt = list(executor.map(calc_alt_saving, np.arange(self.n_fixed, self.n_cws)))
+            best_alt = dict(zip(positions, executor.map(calc_alt_saving, positions)))
+        # overlapping areas may propose the same municipality, the later positions then keep their cws
+        chosen = set()
+        for pos in positions:
+            if best_alt[pos].ags in chosen:
+                best_alt[pos] = self.locs[pos]
+            chosen.add(best_alt[pos].ags)
         
-        self.locs = [*self.fixed_cws, *best_alt]
+        self.locs = [*self.fixed_cws, *[best_alt.get(pos, self.locs[pos])
+                                        for pos in np.arange(self.n_fixed, self.n_cws)]]
         self.update()
         return self
     
     
     def check(self):
         return all([self.locs[i] in self.areas[i] for i in range(self.n_cws)])
-        
-def genetic_algorithm(n_pop, n_gen, p_survive, p_mut, n_best =5, **kwargs):
-    """performs the genetic algorithm on a given set of solution parameters (kwargs)
+
+EVAL_CHUNK = 2**24 # maximal number of (location set, cws, municipality) values evaluate_many holds at once
+
+def evaluate_many(region, fixed_cws, locs_matrix, areas = False):
+    """evaluates many location sets at once on the RegionModel of the region, in chunks of rows.
+    The totals agree exactly with total_saving and total_commuters of the corresponding Solutions.
+
+    Args:
+        region (lst of AGS-Prefix or lst of como.Municipality): the region
+        fixed_cws (lst of como.Municipality): fixed coworking spaces, part of every location set
+        locs_matrix (2d array-like of como.Municipality or AGS): one set of new coworking spaces per row
+        areas (bool, optional): additionally return savings and commuters per area like area_savings
+            and area_commuters. Defaults to False.
+
+    Returns:
+        result_df : a pandas dataframe with one row per location set; columns are
+        'Total saving' and 'Total commuters' and, if areas, 'Area savings' and 'Area commuters'
+        (arrays over fixed_cws and the row)
+    """
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    model = RegionModel.get(region)
+    locs_matrix = [list(row) for row in locs_matrix]
+    locs = np.array([model.index([*fixed_cws, *row]) for row in locs_matrix], dtype = int)
+    return pd.DataFrame(evaluate_positions(model, locs.reshape(len(locs_matrix), -1), areas))
+
+def evaluate_positions(model, locs, areas = False):
+    """evaluates many location sets given as positions in a RegionModel, see evaluate_many.
+    Location sets whose nearest assignment exceeds the capacity of a cws are assigned by capacity.assign.
+
+    Args:
+        model (RegionModel): the model of the region
+        locs (2d np.array of int): one location set per row, including the fixed cws
+        areas (bool, optional): additionally return savings and commuters per area. Defaults to False.
+
+    Returns:
+        dict: 'Total saving' and 'Total commuters' (arrays over the rows) and, if areas, 'Area savings' and
+        'Area commuters' (lists of arrays over the columns of locs)
+    """
+    n_rows, n_cws = locs.shape
+    n = len(model)
+
+    result = {'Total saving': np.zeros(n_rows), 'Total commuters': np.zeros(n_rows)}
+    if areas:
+        result['Area savings'] = np.zeros((n_rows, n_cws))
+        result['Area commuters'] = np.zeros((n_rows, n_cws))
+    n_chunk = max(1, EVAL_CHUNK // max(n * n_cws, 1))
+    if capacity.active():
+        limit = capacity.capacities(model.muns)
+    for start in range(0, n_rows, n_chunk):
+        rows = slice(start, start + n_chunk)
+        # nearest cws of every municipality, first one on ties like como.nearest
+        dist = np.moveaxis(model.dist[:, locs[rows]], 0, -1) # (row, cws, mun)
+        assigned = np.argmin(dist, axis = 1)
+        assigned[~np.isfinite(np.min(dist, axis = 1))] = -1 # no cws in reach
+        cws = np.take_along_axis(locs[rows], np.maximum(assigned, 0), axis = 1)
+        served = assigned >= 0
+        # per municipality in the order of the region, like Solution.update
+        savings = np.where(served, model.savings[np.arange(n), cws], 0)
+        commuters = np.where(served, model.commuters[np.arange(n), cws], 0)
+        result['Total saving'][rows] = np.sum(savings, axis = 1)
+        result['Total commuters'][rows] = np.sum(commuters, axis = 1)
+        if areas:
+            in_area = assigned[:, np.newaxis, :] == np.arange(n_cws)[:, np.newaxis]
+            result['Area savings'][rows] = np.sum(np.where(in_area, savings[:, np.newaxis, :], 0), axis = 2)
+            result['Area commuters'][rows] = np.sum(np.where(in_area, commuters[:, np.newaxis, :], 0), axis = 2)
+        if not capacity.active():
+            continue
+        # location sets with overfull cws, assigned like Solution.update
+        in_area = assigned[:, np.newaxis, :] == np.arange(n_cws)[:, np.newaxis]
+        load = np.sum(np.where(in_area, commuters[:, np.newaxis, :], 0), axis = 2)
+        overfull = np.any(load > (1 - 1e-9)*limit[locs[rows]], axis = 1) # capacity.assign decides on the edge
+        for row in start + np.flatnonzero(overfull):
+            shares = capacity.assign(model, locs[row])
+            row_savings = np.where(shares > 0, shares * model.savings[:, locs[row]], 0)
+            row_commuters = np.where(shares > 0, shares * model.commuters[:, locs[row]], 0)
+            result['Total saving'][row] = np.sum(np.sum(row_savings, axis = 1))
+            result['Total commuters'][row] = np.sum(np.sum(row_commuters, axis = 1))
+            if areas:
+                result['Area savings'][row] = np.sum(row_savings, axis = 0)
+                result['Area commuters'][row] = np.sum(row_commuters, axis = 0)
+
+    if areas:
+        result['Area savings'] = list(result['Area savings'])
+        result['Area commuters'] = list(result['Area commuters'])
+    return result
+
+def warm_start_solutions(previous, n = 1, rng = None, **kwargs):
+    """maps the solutions of a previous result into a changed problem, e.g. after the user added a county or a fixed cws.
+    Locations of a previous solution that are still in the region and not fixed are kept, those with the largest area
+    savings first; superfluous ones are dropped, missing ones are placed one after another where they improve most
+    (as in greedy, on the RegionModel of the new region).
+
+    Args:
+        previous (pd.DataFrame, Solution or lst of Solution): previous result with a 'Solution' column, or solutions
+        n (int, optional): maximal number of solutions, from the best previous ones. Defaults to 1.
+        rng (np.random.Generator or seed, optional): random number generator of the new solutions
+        kwargs: region, fixed_cws and n_cws of the new problem as for initializing Solutions. Mandatory.
+
+    Returns:
+        lst of Solution: up to n solutions of the new problem that differ in the kept locations
+    """
+    if isinstance(previous, pd.DataFrame):
+        previous = list(previous['Solution'])
+    elif isinstance(previous, Solution):
+        previous = [previous]
+    rng = np.random.default_rng(rng)
+    Mun = como.Municipality
+    region = kwargs['region']
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = Mun.dissolve(tuple(region))
+    fixed_cws = list(kwargs.get('fixed_cws', []))
+    n_new = kwargs['n_cws'] - len(fixed_cws)
+    in_region = np.zeros(max(len(Mun.get_mundict()), 1), dtype = bool)
+    in_region[Mun.ids(region)] = True
+    in_region[Mun.ids(fixed_cws)] = False
+    
+    def fill(kept, k):
+        """places k further cws greedily"""
+        model = RegionModel.get(region)
+        n = len(model)
+        placed = model.index([*fixed_cws, *kept])
+        if len(placed):
+            nearest = placed[np.argmin(model.dist[:, placed], axis = 1)]
+            dist, current = model.dist[np.arange(n), nearest], model.savings[np.arange(n), nearest]
+        else:
+            dist, current = np.full(n, np.inf), np.zeros(n)
+        candidate = np.ones(n, dtype = bool)
+        candidate[placed] = False
+        res = []
+        for i in range(k):
+            gains = np.sum(np.where(model.dist < dist[:, np.newaxis], model.savings - current[:, np.newaxis], 0), axis = 0)
+            c = np.argmax(np.where(candidate, gains, -np.inf))
+            closer = model.dist[:, c] < dist
+            dist[closer], current[closer] = model.dist[closer, c], model.savings[closer, c]
+            candidate[c] = False
+            res.append(model.muns[c])
+        return res
+    
+    res, kept_before = [], set()
+    for sol in sorted(previous, reverse = True):
+        order = np.argsort(sol.area_savings[sol.n_fixed:], kind = 'stable')[::-1]
+        kept = [sol.variable_cws[i] for i in order if in_region[sol.variable_cws[i].id]][:n_new]
+        if frozenset(kept) in kept_before:
+            continue
+        kept_before.add(frozenset(kept))
+        res.append(Solution(region = region, fixed_cws = fixed_cws, rng = rng,
+                            locs = [*fixed_cws, *kept, *fill(kept, n_new - len(kept))]))
+        if len(res) == n:
+            break
+    return res
+
+def iter_genetic_algorithm(n_pop, n_gen, p_survive, p_mut, n_best = 5,
+                           time_budget = None, patience = None, rel_tol = 0, population = None, warm_start = None, **kwargs):
+    """performs the genetic algorithm generation by generation on a given set of solution parameters (kwargs).
+    Each generation is yielded as soon as it is evaluated, so callers can stream, persist or stop early.
 
     Args:
         n_pop (int): Population size 
         n_gen (int): Number of generations to calculate
         p_survive (float [0, 1]): probability of survival in each generation
         p_mut (float [0, 1]): probability of mutation in each location
+        n_best (int, optional): number of best solutions reported per generation. Defaults to 5.
+        time_budget (float, optional): wall-clock budget in seconds. No further generation is started
+            if it would probably not finish within the budget.
+        patience (int, optional): stop after that many generations without improvement of the best or mean saving
+        rel_tol (float, optional): relative increase of the best or mean saving that counts as improvement. Defaults to 0.
+        population (lst of Solution, optional): initial population of n_pop solutions, e.g. to continue a run.
+            Defaults to n_pop random solutions.
+        warm_start (optional): previous result (or solutions) of a changed problem, see warm_start_solutions.
+            Up to half of the initial population is mapped from its best solutions, the rest is random.
         kwargs: arguments for initializing Solutions. Mandatory.
-        seed (int; optional): seed for np.random
-        progress (optional) : a streamlit progressbar 
+        rng (np.random.Generator or seed; optional): random number generator of the run
+        seed (int; optional): seed, if no rng is given
 
-    Returns:
-        df: results
+    Yields:
+        dict: one per generation (0 is the initial population, n_gen the last one); keys are
+        'Generation' : the generation
+        'Best' : list of the n_best best (distinct) solutions, best first
+        'Max', 'Mean', 'Min' : statistics of total_saving over the population
+        'Stop' : None, or the reason (see STOP_REASONS) if this is the last generation
+        'Population' : the whole population of the generation; later generations do not change its solutions
     """
     n_survivors = int(p_survive*n_pop)
-    result_df = []
+    start = last = time.perf_counter()
     
-    if 'seed' in kwargs:
-        np.random.seed(kwargs['seed'])
+    rng = np.random.default_rng(kwargs.pop('rng', kwargs.pop('seed', None)))
         
     # generation
-    population = [Solution(**kwargs) for i in range(n_pop)]
+    if population is None:
+        population = warm_start_solutions(warm_start, max(n_pop//2, 1), rng, **kwargs) if warm_start is not None else []
+        population += [Solution(rng = rng, **kwargs) for i in range(n_pop - len(population))]
+    assert len(population) == n_pop, f"population must consist of n_pop solutions"
+    population = list(population)
     
-    wo_tqdm_range = range(n_gen) if 'progress' in kwargs else tqdm(range(n_gen), desc = "Generations")
-    for i in wo_tqdm_range: 
-        # save best results of that generation
+    for i in range(n_gen + 1):
+        # report best results of that generation
         best = np.unique(population)[-n_best:]
-        best = [copy.copy(sol) for sol in best]
-        for j in range(n_best):
-            result_df.append([i, n_best-j, best[j], best[j].check()])
+        best = [copy.copy(sol) for sol in best[::-1]]
         
         #fitness    
-        pop_fitness = [sol.total_saving for sol in population]
+        pop_fitness = np.array([sol.total_saving for sol in population])
         
-        if 'progress' in kwargs:
-            kwargs['progress'].progress((i+1)/(n_gen+1),
-                                        text=f"Die beste gefundene Lösung spart zusätzlich potentiell\
-                                            {'{:0,.2f}'.format(max(pop_fitness)-kwargs['ref_saving'])}\
-                                                Personenkilometer ein.")
+        # stopping criteria
+        if i == 0 or pop_fitness.max() > best_max + rel_tol*abs(best_max) \
+            or pop_fitness.mean() > best_mean + rel_tol*abs(best_mean):
+            best_max = max(pop_fitness.max(), best_max) if i else pop_fitness.max()
+            best_mean = max(pop_fitness.mean(), best_mean) if i else pop_fitness.mean()
+            stagnating = 0
+        else:
+            stagnating += 1
+        now = time.perf_counter()
+        if i == n_gen:
+            stop = 'n_gen'
+        elif patience is not None and stagnating >= patience:
+            stop = 'stagnation'
+        elif time_budget is not None and 2*now - last - start > time_budget:
+            stop = 'time_budget'
+        else:
+            stop = None
+        last = now
+        
+        yield {'Generation': i,
+               'Best': best,
+               'Max': pop_fitness.max(),
+               'Mean': pop_fitness.mean(),
+               'Min': pop_fitness.min(),
+               'Stop': stop,
+               'Population': population}
+        
+        if stop:
+            break
         
         pop_fitness = pop_fitness - min(pop_fitness)
 
         # selection (fitness-proportional roulette)
         population = np.array(population) # must be array
-        survivors = population[np.random.choice(n_pop,
-                                               size = n_survivors,
-                                               p = pop_fitness/sum(pop_fitness),
-                                               replace = False)]
+        survivors = population[rng.choice(n_pop,
+                                          size = n_survivors,
+                                          p = pop_fitness/sum(pop_fitness),
+                                          replace = False)]
         
 
         # combination
-        parents = [survivors[np.random.choice(n_survivors,
-                                              size = 2, replace = False)]
+        parents = [survivors[rng.choice(n_survivors,
+                                        size = 2, replace = False)]
                    for i in range(n_pop-n_survivors)]
         childs = [x.combine(y) for x, y in parents]
-        population = [*survivors, *childs]
+        # copies, as the yielded population must not change when the survivors mutate
+        population = [*(copy.copy(sol) for sol in survivors), *childs]
         assert all([sol.check() for sol in population])
 
         # mutation        
         [sol.mutate(p_mut) for sol in population]
-        
-    best = np.unique(population)[-n_best:]
-    best = [copy.copy(sol) for sol in best]
-    i += 1
-    for j in range(n_best):
-        result_df.append([i, n_best-j, best[j], best[j].check()])
+
+def genetic_algorithm(n_pop, n_gen, p_survive, p_mut, n_best =5, **kwargs):
+    """performs the genetic algorithm on a given set of solution parameters (kwargs)
+
+    Args:
+        n_pop (int): Population size 
+        n_gen (int): Number of generations to calculate
+        p_survive (float [0, 1]): probability of survival in each generation
+        p_mut (float [0, 1]): probability of mutation in each location
+        kwargs: arguments for initializing Solutions. Mandatory.
+        rng, seed (optional): random number generator or seed, see iter_genetic_algorithm
+        warm_start (optional): previous result of a changed problem, see iter_genetic_algorithm
+        progress (optional) : a streamlit progressbar 
+        time_budget, patience, rel_tol (optional): stopping criteria, see iter_genetic_algorithm
+
+    Returns:
+        df: results; the reason for stopping is stored in df.attrs['stop_reason']
+    """
+    result_df = []
+    
+    stream = iter_genetic_algorithm(n_pop, n_gen, p_survive, p_mut, n_best, **kwargs)
+    if 'progress' not in kwargs:
+        stream = tqdm(stream, total = n_gen + 1, desc = "Generations")
     
-    if 'progress' in kwargs:
-        kwargs['progress'].progress(100,
-                                    text=f"Die beste gefundene Lösung spart zusätzlich potentiell\
-                                        {'{:0,.2f}'.format(best[n_best-1].total_saving-kwargs['ref_saving'])}\
-                                            Personenkilometer ein.")
+    for generation in stream:
+        i = generation['Generation']
+        for j, sol in enumerate(generation['Best']):
+            result_df.append([i, j+1, sol, sol.check()])
+        
+        if 'progress' in kwargs:
+            kwargs['progress'].progress(100 if generation['Stop'] else (i+1)/(n_gen+1),
+                                        text=f"Die beste gefundene Lösung spart zusätzlich potentiell\
+                                            {'{:0,.2f}'.format(generation['Max']-kwargs['ref_saving'])}\
+                                                Personenkilometer ein.")
     
     result_df = pd.DataFrame(result_df,
                              columns=['Generation',
@@ -326,16 +641,25 @@ def genetic_algorithm(n_pop, n_gen, p_survive, p_mut, n_best =5, **kwargs):
                                       'Solution',
                                       'Check'])
     result_df.set_index(['Generation', 'Best'], inplace = True)
+    result_df.attrs['stop_reason'] = generation['Stop']
         
     return result_df
 
 #K-Locs Algorithm
-def kLocs(**kwargs):
+def kLocs(max_steps = None, time_budget = None, rel_tol = 0, **kwargs):
     """performs the kLoc algorithm
 
     Arguments:
+        max_steps (int, optional): maximal number of improvement steps
+        time_budget (float, optional): wall-clock budget in seconds. No further step is started
+            if it would probably not finish within the budget.
+        rel_tol (float, optional): stop if a step improves total_saving relatively by no more than rel_tol. Defaults to 0.
         kwargs: arguments for initializing Solutions. Mandatory.
-        seed (int; optional): seed for np.random
+        rng (np.random.Generator or seed; optional): random number generator for the initial solution
+        seed (int; optional): seed, if no rng is given
+        warm_start (optional): previous result (or solutions) of a changed problem; the initial solution is mapped
+            from its best solution instead of being random, see warm_start_solutions
+        progress (optional) : a streamlit progressbar, reported after every step (relative to max_steps, if given)
 
     Returns:
         result_df : a pandas dataframe that consist of the chosen municipalities to host coworking spaces including
@@ -345,6 +669,7 @@ def kLocs(**kwargs):
         'AGS' : the AGS of coworking space i
         'Value' : the value of coworking space i regarding the assess function
         'Area' : a list of AGS belonging to that coworking space
+        The reason for stopping is stored in result_df.attrs['stop_reason'].
     """
     
     # Initialization
@@ -352,34 +677,392 @@ def kLocs(**kwargs):
     total_saving = 0
     result_ls = []
     
-    if 'seed' in kwargs:
-        np.random.seed(kwargs['seed'])
+    rng = np.random.default_rng(kwargs.pop('rng', kwargs.pop('seed', None)))
+    warm_start = kwargs.pop('warm_start', None)
         
-    current = Solution(**kwargs)
+    start = time.perf_counter()
+    current = warm_start_solutions(warm_start, 1, rng, **kwargs) if warm_start is not None else []
+    current = current[0] if current else Solution(rng = rng, **kwargs)
+    last = time.perf_counter()
 
     # Iterationen
     while True:
         ## append results from step and continue with next iteration
         # result_ls +=  [[step, i, current.locs[i], current.savings[i], current.areas[i]] for i in current.n_cws]
         result_ls += [[step, copy.copy(current)]]
+        if 'progress' in kwargs:
+            kwargs['progress'].progress(min(step/max_steps, 1) if max_steps else 0,
+                                        text=f"Schritt {step}: {'{:0,.2f}'.format(current.total_saving)} Personenminuten")
+        
+        now = time.perf_counter()
+        if max_steps is not None and step >= max_steps:
+            stop = 'max_steps'
+            break
+        if time_budget is not None and 2*now - last - start > time_budget:
+            stop = 'time_budget'
+            break
+        last = now
+        
         current.step()
         
-        if current.total_saving > total_saving: # check if step has improved, else break
+        if current.total_saving > total_saving + rel_tol*abs(total_saving): # check if step has improved, else break
             total_saving = current.total_saving
             step += 1            
         else:
+            stop = 'converged' if current.total_saving <= total_saving else 'stagnation'
+            if stop == 'stagnation': # keep the small improvement, the best result found so far
+                result_ls += [[step + 1, copy.copy(current)]]
             break
 
     result_df = pd.DataFrame(result_ls, columns=['Step', 'Solution'])
     result_df.set_index(['Step'], inplace = True)
+    result_df.attrs['stop_reason'] = stop
+    return result_df
+
+def annealing(n_moves = 100000, temp = None, temp_ratio = 1e-3, tabu = 0, time_budget = None, patience = None,
+              n_reports = 50, **kwargs):
+    """performs simulated annealing (optionally with a tabu memory) on a single solution.
+    A move relocates one non-fixed cws to a municipality its residents commute to, weighted by the commuters like
+    Solution.mutate. Moves are evaluated incrementally on the RegionModel of the region: only the residents of the
+    relocated cws and those closer to the new location are reassigned and rescored.
+
+    Arguments:
+        n_moves (int, optional): number of moves. Defaults to 100000.
+        temp (float, optional): initial temperature in person minutes; a move that loses temp is accepted with
+            probability 1/e. Defaults to the mean loss of 100 random moves from the initial solution.
+        temp_ratio (float, optional): final temperature relative to temp; the temperature decreases geometrically. Defaults to 1e-3.
+        tabu (int, optional): number of moves during which a given up location must not be chosen again,
+            unless that leads to a new best solution. Defaults to 0 (no tabu memory).
+        time_budget (float, optional): wall-clock budget in seconds
+        patience (int, optional): stop after that many moves without a new best solution
+        n_reports (int, optional): the best solution is reported (and progress updated) up to n_reports times. Defaults to 50.
+        kwargs: arguments for initializing Solutions. Mandatory.
+        rng (np.random.Generator or seed; optional): random number generator of the run
+        seed (int; optional): seed, if no rng is given
+        warm_start (optional): previous result of a changed problem, the initial solution is mapped from it as in kLocs
+        progress (optional) : a streamlit progressbar 
+
+    Returns:
+        result_df : a pandas dataframe indexed by 'Step' (the number of moves) with the best solution found up to
+        that move in column 'Solution', and 'Accepted', the share of accepted moves since the last report.
+        The reason for stopping is stored in result_df.attrs['stop_reason'].
+    """
+    rng = np.random.default_rng(kwargs.pop('rng', kwargs.pop('seed', None)))
+    warm_start = kwargs.pop('warm_start', None)
+    start = time.perf_counter()
+    current = warm_start_solutions(warm_start, 1, rng, **kwargs) if warm_start is not None else []
+    current = current[0] if current else Solution(rng = rng, **kwargs)
+    region, fixed_cws = current.region, current.fixed_cws
+    
+    model = RegionModel.get(region)
+    n = len(model)
+    dist = model.dist
+    # rows are the travel times of all residents to a cws; a TruncatedMatrix stores columns contiguously anyway
+    dist_t = np.ascontiguousarray(dist.T) if isinstance(dist, np.ndarray) else None
+    def dist_to(c):
+        return dist_t[c] if dist_t is not None else dist[:, c]
+    
+    # neighbourhood of every municipality: the municipalities of the region its residents commute to
+    in_region = set(mun.ags for mun in model.muns)
+    targets, weights = [], []
+    for mun in model.muns:
+        wpls = [wpl for wpl in mun.commutes_to if wpl.ags in in_region and wpl != mun]
+        targets.append(model.index(wpls))
+        weights.append(np.cumsum([mun.get_commuters(wpl) for wpl in wpls]))
+    
+    # state: locations (model indices), assignment of every resident (position in locs), its travel time and saving
+    locs = model.index(current.locs)
+    is_loc = np.zeros(n, dtype = bool)
+    is_loc[locs] = True
+    def assign(residents, locs):
+        d = dist[np.ix_(residents, locs)]
+        pos = np.argmin(d, axis = 1) # first one on ties like como.nearest
+        near = d[np.arange(len(residents)), pos]
+        pos[~np.isfinite(near)] = -1 # no cws in reach
+        return pos, near, np.where(pos >= 0, model.savings[residents, locs[np.maximum(pos, 0)]], 0)
+    assigned, near, gain = assign(np.arange(n), locs)
+    total = np.sum(gain)
+    
+    def propose(p, u):
+        """new location for position p: a commuting target of its current location, else any municipality"""
+        a = locs[p]
+        if len(targets[a]):
+            return targets[a][np.searchsorted(weights[a], u*weights[a][-1], side = 'right')]
+        return int(u*n)
+    
+    def delta(p, b):
+        """change of the total saving if the cws at position p moves to b, and the affected residents' new state"""
+        residents = np.flatnonzero((assigned == p) | (dist_to(b) <= near))
+        new_locs = locs.copy()
+        new_locs[p] = b
+        pos, d, g = assign(residents, new_locs)
+        return np.sum(g) - np.sum(gain[residents]), residents, pos, d, g
+    
+    positions = np.arange(current.n_fixed, current.n_cws)
+    if not len(positions) or n <= len(locs):
+        n_moves = 0
+    if temp is None and n_moves:
+        losses = [delta(p, b)[0] for p, b in zip(rng.choice(positions, 100), rng.integers(n, size = 100))
+                  if not is_loc[b]]
+        losses = [-x for x in losses if x < 0]
+        temp = np.mean(losses) if losses else 1
+    cooling = temp_ratio**(1/max(n_moves, 1))
+    
+    best_total, best_locs, best_move = total, locs.copy(), 0
+    removed = np.full(n, -np.inf) # move in which a location was given up
+    report_every = max(1, -(-n_moves // n_reports))
+    result_ls = [[0, copy.copy(current), 1.0]]
+    accepted = reported = 0
+    
+    def report(move):
+        """appends the best solution up to move, if it changed since the last report"""
+        if result_ls[-1][1].locs != [model.muns[c] for c in best_locs]:
+            best = Solution(region = region, fixed_cws = fixed_cws, rng = rng,
+                            locs = [model.muns[c] for c in best_locs])
+            result_ls.append([move, best, accepted/(move - reported)])
+        else:
+            result_ls[-1][2] = accepted/(move - reported)
+        if 'progress' in kwargs:
+            kwargs['progress'].progress(move/n_moves,
+                                        text=f"Zug {move}: {'{:0,.2f}'.format(result_ls[-1][1].total_saving)} Personenminuten")
+    
+    stop = 'max_steps'
+    for move in range(n_moves):
+        i = move % 1024
+        if i == 0: # random numbers in blocks
+            ps = rng.choice(positions, 1024)
+            us = rng.random(1024)
+            accept_us = rng.random(1024)
+            total = np.sum(gain) # no drift from summing differences
+        p = ps[i]
+        b = propose(p, us[i])
+        if not is_loc[b]:
+            diff, residents, pos, d, g = delta(p, b)
+            if diff >= 0 or accept_us[i] < np.exp(diff/temp):
+                if move - removed[b] >= tabu or total + diff > best_total:
+                    removed[locs[p]] = move
+                    is_loc[locs[p]] = False
+                    is_loc[b] = True
+                    locs[p] = b
+                    assigned[residents], near[residents], gain[residents] = pos, d, g
+                    total += diff
+                    accepted += 1
+                    if total > best_total:
+                        best_total, best_locs, best_move = total, locs.copy(), move + 1
+        temp *= cooling
+        
+        if (move + 1) % report_every == 0 or move + 1 == n_moves:
+            report(move + 1)
+            accepted, reported = 0, move + 1
+        if i == 1023:
+            if patience is not None and move + 1 - best_move >= patience:
+                stop = 'stagnation'
+            elif time_budget is not None and time.perf_counter() - start > time_budget:
+                stop = 'time_budget'
+            else:
+                continue
+            if reported < move + 1:
+                report(move + 1)
+            break
+    
+    result_df = pd.DataFrame(result_ls, columns = ['Step', 'Solution', 'Accepted'])
+    result_df.set_index(['Step'], inplace = True)
+    result_df.attrs['stop_reason'] = stop
+    return result_df
+
+def exact(time_limit = None, **kwargs):
+    """solves the placement exactly as mixed integer linear program using the HiGHS solver shipped with scipy.
+    
+    The formulation is a p-median problem with closest assignment: every municipality is served by the
+    nearest open coworking space, exactly as in Solution.update. For every municipality its candidates are
+    sorted by travel time (up to the first fixed cws) and w[r, k] is 1 iff none of the k nearest candidates is open.
+
+    Arguments:
+        time_limit (float, optional): time limit of the solver in seconds. If it is hit, the best solution found so far is returned.
+        kwargs: arguments for initializing Solutions, i.e. region, fixed_cws and n_cws. Mandatory.
+
+    Returns:
+        result_df : a pandas dataframe with one row (Step 0) and the columns
+        'Solution' : the optimal (or best found) solution
+        'Bound' : an upper bound for the total saving of any solution
+        'Gap' : the relative optimality gap of the solution, 0 if it is optimal
+        The reason for stopping ('optimal' or 'time_budget') is stored in result_df.attrs['stop_reason'].
+    """
+    region = kwargs['region']
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    fixed_cws = list(kwargs.get('fixed_cws', []))
+    n_cws = kwargs['n_cws']
+    assert n_cws > len(fixed_cws), f"More fixed cws than cws to be set. Ensure n_cws > len(fixed_cws)"
+    assert not capacity.active(), f"exact assumes unlimited cws, reset capacity.set_capacity()"
+    
+    model = RegionModel.get(region)
+    n = len(model)
+    fixed = model.index(fixed_cws)
+    # rank of a cws in Solution.locs; decides between equally distant cws like np.argmin in Solution.update
+    rank = np.arange(n) + len(fixed)
+    rank[fixed] = np.arange(len(fixed))
+    
+    # variables: y (open cws) followed by the w of every residence
+    rows, cols, vals, upper = [], [], [], []
+    objective = [np.zeros(n)]
+    constant = 0
+    n_var = n
+    for r in range(n):
+        order = np.lexsort((rank, model.dist[r]))
+        if len(fixed):
+            order = order[:np.flatnonzero(np.isin(order, fixed))[0] + 1]
+        sav = model.savings[r, order]
+        n_w = len(order) - 1
+        w = n_var + np.arange(n_w)
+        
+        # saving of r is sum_k sav[k] * (w[k-1] - w[k]) with w[-1] = 1 and w[n_w] = 0
+        constant += sav[0]
+        objective.append(sav[1:] - sav[:-1])
+        
+        # w[k] + y[order[k]] <= 1
+        con = len(upper) + np.arange(n_w)
+        rows += [con, con]; cols += [w, order[:-1]]; vals += [np.ones(n_w), np.ones(n_w)]
+        upper += [1]*n_w
+        # w[k] - w[k-1] <= 0
+        con = len(upper) + np.arange(max(n_w - 1, 0))
+        rows += [con, con]; cols += [w[1:], w[:-1]]; vals += [np.ones(len(con)), -np.ones(len(con))]
+        upper += [0]*len(con)
+        # w[k-1] - w[k] - y[order[k]] <= 0
+        con = len(upper) + np.arange(n_w + 1)
+        prev, nxt = np.r_[-1, w], np.r_[w, -1]
+        rows += [con[1:], con[:-1], con]
+        cols += [prev[1:], nxt[:-1], order]
+        vals += [np.ones(n_w), -np.ones(n_w), -np.ones(n_w + 1)]
+        upper += [-1, *[0]*n_w]
+        n_var += n_w
+    
+    rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+    A = sparse.csr_array((vals, (rows, cols)), shape = (len(upper), n_var))
+    cardinality = sparse.csr_array((np.ones(n), (np.zeros(n, dtype = int), np.arange(n))), shape = (1, n_var))
+    lower_bounds = np.zeros(n_var)
+    lower_bounds[fixed] = 1
+    integrality = np.zeros(n_var)
+    integrality[:n] = 1
+    
+    options = {'disp': False}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    res = milp(-np.concatenate(objective),
+               constraints = [LinearConstraint(A, -np.inf, upper),
+                              LinearConstraint(cardinality, n_cws, n_cws)],
+               integrality = integrality,
+               bounds = Bounds(lower_bounds, 1),
+               options = options)
+    assert res.x is not None, f"No solution found: {res.message}"
+    
+    chosen = np.flatnonzero(res.x[:n] > .5)
+    chosen = chosen[~np.isin(chosen, fixed)]
+    sol = Solution(region = region, fixed_cws = fixed_cws,
+                   locs = [*fixed_cws, *[model.muns[i] for i in chosen]])
+    bound = constant - getattr(res, 'mip_dual_bound', res.fun)
+    bound = max(bound, sol.total_saving)
+    
+    result_df = pd.DataFrame([[0, sol, bound, (bound - sol.total_saving)/bound if bound else 0]],
+                             columns = ['Step', 'Solution', 'Bound', 'Gap'])
+    result_df.set_index(['Step'], inplace = True)
+    result_df.attrs['stop_reason'] = 'optimal' if res.status == 0 else 'time_budget'
+    return result_df
+
+def optimality_gap(result_df, exact_df):
+    """relative gap of the best solution of a result to the bound of an exact result.
+
+    Arguments:
+        result_df : result of kLocs, genetic_algorithm or any other optimizer with a 'Solution' column
+        exact_df : result of exact for the same problem
+
+    Returns:
+        float: (bound - best total saving) / bound; 0 means the result is optimal
+    """
+    best = max(result_df['Solution'])
+    bound = exact_df['Bound'].iloc[0]
+    return (bound - best.total_saving)/bound
+
+def greedy(n_new, **kwargs):
+    """places new coworking spaces one at a time, each time choosing the one with the largest improvement.
+    Uses lazy evaluation (CELF): the improvements of all candidates are kept in a priority queue and only
+    the top candidates are re-evaluated after each placement, since improvements mostly only shrink.
+
+    Arguments:
+        n_new (int): the number of new coworking spaces K
+        kwargs: region and fixed_cws as for initializing Solutions. Mandatory.
+        progress (optional) : a streamlit progressbar 
+
+    Returns:
+        result_df : a pandas dataframe with one row per number of new coworking spaces k = 1..K; columns are
+        'Solution' : the solution with the k first placed coworking spaces
+        'Improvement' : the improvement of that solution compared to fixed_cws only
+        'Evaluations' : the number of improvements evaluated up to that placement
+    """
+    region = kwargs['region']
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    fixed_cws = list(kwargs.get('fixed_cws', []))
+    
+    model = RegionModel.get(region)
+    fixed = model.index(fixed_cws)
+    n_new = min(n_new, len(model) - len(fixed))
+    
+    # reference assignment to the fixed cws
+    if len(fixed):
+        nearest = fixed[np.argmin(model.dist[:, fixed], axis = 1)]
+        dist = model.dist[np.arange(len(model)), nearest]
+        current = model.savings[np.arange(len(model)), nearest]
+    else:
+        dist = np.full(len(model), np.inf)
+        current = np.zeros(len(model))
+    
+    def improvement(c):
+        closer = model.dist[:, c] < dist
+        return np.sum(model.savings[closer, c] - current[closer])
+    
+    # initial improvements of all candidates at once (that is the heatmap)
+    closer = model.dist < dist[:, np.newaxis]
+    gains = np.sum(np.where(closer, model.savings - current[:, np.newaxis], 0), axis = 0)
+    candidates = np.setdiff1d(np.arange(len(model)), fixed)
+    queue = [(-gains[c], c, 0) for c in candidates] # (negative improvement, cws, placement it was evaluated for)
+    heapq.heapify(queue)
+    evaluations = len(candidates)
+    
+    chosen = []
+    results = []
+    reference = np.sum(current)
+    for k in range(n_new):
+        while True:
+            gain, c, evaluated = heapq.heappop(queue)
+            if evaluated == k:
+                break
+            evaluations += 1
+            heapq.heappush(queue, (-improvement(c), c, k))
+        
+        # place c
+        closer = model.dist[:, c] < dist
+        dist[closer] = model.dist[closer, c]
+        current[closer] = model.savings[closer, c]
+        chosen.append(model.muns[c])
+        
+        sol = Solution(region = region, fixed_cws = fixed_cws, locs = [*fixed_cws, *chosen])
+        results.append([k + 1, sol, sol.total_saving - reference, evaluations])
+        if 'progress' in kwargs:
+            kwargs['progress'].progress((k+1)/n_new,
+                                        text=f"Platziert CWS {k+1} von {n_new}")
+    
+    result_df = pd.DataFrame(results, columns = ['Sites', 'Solution', 'Improvement', 'Evaluations'])
+    result_df.set_index(['Sites'], inplace = True)
     return result_df
 
-def heatmap(region, fixed_cws, **kwargs):
+def heatmap(region, fixed_cws, cache = True, **kwargs):
     """calculates a heatmap
 
     Arguments:
         region : a list of AGS; the municipalities of the investigated region
         fixed_cws : a list of AGS; the municipalities in the region that already host a coworking space
+        cache : whether to serve and store the result in the persistent result_cache. Defaults to True.
 
     Returns:
         result_df : a pandas dataframe that consist of the chosen municipalities to host coworking spaces including
@@ -387,12 +1070,25 @@ def heatmap(region, fixed_cws, **kwargs):
         'AGS' : the ags of the municipality potentially hosting the new coworking space
         'Improvement' : the improvement of that coworking space to the status quo ante
         'Area' : a list of AGS belonging to that coworking space
+        result_df.attrs contains the AGS of the 'fixed_cws' and whether the result was 'cached'.
+        Results served from the cache carry no Solution (None).
     """        
     
     # n_cws = len(fixed_cws) + 1
         
     region = como.Municipality.dissolve(region)
     
+    if cache:
+        key = result_cache.key('heatmap', region, fixed_cws)
+        cached = result_cache.load(key)
+        if cached is not None:
+            result_df = pd.DataFrame({'LAU_ID': cached['LAU_ID'],
+                                      'LAU': [como.Municipality.get(ags) for ags in cached['LAU_ID']],
+                                      'Solution': None,
+                                      'Improvement': cached['Improvement']})
+            result_df.attrs.update({'fixed_cws': como.ags(fixed_cws), 'cached': True})
+            return result_df
+    
     if fixed_cws:
         ref_sol =Solution(region = region, fixed_cws = fixed_cws, locs = fixed_cws)
         reference = ref_sol.total_saving
@@ -422,5 +1118,124 @@ def heatmap(region, fixed_cws, **kwargs):
     # result_df = pd.DataFrame(results, columns=['CWS', 'Improvement'])
     # result_df.Improvement = result_df.Improvement - reference.total_saving
     # result_df.set_index(['CWS'], inplace = True)
-    return pd.DataFrame(results,
-                        columns = ['LAU_ID', 'LAU', 'Solution', 'Improvement'])
+    result_df = pd.DataFrame(results,
+                             columns = ['LAU_ID', 'LAU', 'Solution', 'Improvement'])
+    if cache:
+        result_cache.store(key, result_df[['LAU_ID', 'Improvement']])
+    result_df.attrs.update({'fixed_cws': como.ags(fixed_cws), 'cached': False})
+    return result_df
+
+PAIR_CHUNK = 2**24 # maximal number of (resident or first site, partner) values pair_heatmap holds at once
+
+def pair_heatmap(region, fixed_cws, top = 100, **kwargs):
+    """calculates the joint improvement of every pair of new coworking spaces and the best partner of every municipality.
+    Two good candidates close together share their residents, so the improvement of a pair is the sum of the single
+    improvements (see heatmap) minus what they cannibalise. It is computed on the RegionModel for all pairs at once:
+    for a chunk of first sites, all residents that would switch to one of them are compared with all second sites.
+    Of two equally distant new cws, the one earlier in the region serves the resident, as in Solution.update.
+    Only the (resident, site) pairs with a switch are stored, sparsely; dense arrays are bounded by PAIR_CHUNK.
+
+    Arguments:
+        region : a list of AGS or como.Municipality; the municipalities of the investigated region
+        fixed_cws : a list of como.Municipality; the municipalities in the region that already host a coworking space
+        top (int, optional): number of best pairs to report. Defaults to 100.
+        progress (optional) : a streamlit progressbar 
+
+    Returns:
+        result_df : a pandas dataframe with one row per municipality of the region; columns are
+        'LAU_ID', 'LAU', 'Improvement' : like heatmap (without Solution)
+        'Partner' : the AGS of the municipality that together with this one gives the largest improvement (None for fixed_cws)
+        'Pair improvement' : the improvement of both together to the status quo ante
+        'Interaction' : Pair improvement minus both single improvements, i.e. the negative cannibalisation
+        result_df.attrs contains the AGS of the 'fixed_cws' and the 'pairs', a dataframe of the top best pairs
+        with the columns 'LAU_ID', 'Partner', 'Pair improvement' and 'Interaction'.
+    """
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(region)
+    fixed_cws = list(fixed_cws)
+    model = RegionModel.get(region)
+    n = len(model)
+    fixed = model.index(fixed_cws)
+    
+    # reference assignment to the fixed cws, as in greedy
+    if len(fixed):
+        nearest = fixed[np.argmin(model.dist[:, fixed], axis = 1)]
+        dist = model.dist[np.arange(n), nearest]
+        current = model.savings[np.arange(n), nearest]
+    else:
+        dist = np.full(n, np.inf)
+        current = np.zeros(n)
+    # sparse (res, cws): res would switch to cws, and its gain; built in blocks of cws
+    switching, gains, n_switching = [], [], np.zeros(n, dtype = int)
+    width = max(PAIR_CHUNK // max(n, 1), 1)
+    for start in range(0, n, width):
+        cols = np.arange(start, min(start + width, n))
+        switch = model.dist[:, cols] < dist[:, np.newaxis]
+        col, res = np.nonzero(switch.T) # by cws, then res
+        switching.append(res)
+        gains.append(model.savings[res, cols[col]] - current[res])
+        n_switching[cols] = np.sum(switch, axis = 0)
+    indptr = np.r_[0, np.cumsum(n_switching)]
+    switching, gains = np.concatenate(switching), np.concatenate(gains)
+    closer = sparse.csc_array((np.ones(len(switching), dtype = bool), switching, indptr), shape = (n, n)).tocsr()
+    gain = sparse.csc_array((gains, switching, indptr), shape = (n, n)).tocsr()
+    single = np.bincount(np.repeat(np.arange(n), n_switching), weights = gains, minlength = n) # the heatmap
+    candidates = np.setdiff1d(np.arange(n), fixed)
+    is_candidate = np.isin(np.arange(n), candidates)
+    
+    # chunks of first sites a, such that (residents switching to a, second sites) and (a, second sites) together
+    # fit into PAIR_CHUNK
+    cost = n_switching[candidates] + 1
+    chunks = np.split(candidates, np.flatnonzero(np.diff(np.cumsum(cost) // max(PAIR_CHUNK // max(n, 1), 1))) + 1)
+    partner = np.full(n, -1)
+    pair_gain = np.full(n, np.nan)
+    best_pairs = np.zeros((0, 3)) # a, b, improvement
+    for k, chunk in enumerate(chunks):
+        if not len(chunk):
+            continue
+        # every resident switching to a site a of the chunk, as row of (a, resident)
+        rows = np.repeat(np.arange(len(chunk)), n_switching[chunk])
+        res = np.concatenate([switching[indptr[a]:indptr[a + 1]] for a in chunk])
+        a = chunk[rows]
+        dist_res = model.dist[res]
+        dist_a = dist_res[np.arange(len(res)), a][:, np.newaxis]
+        a_serves = (dist_a < dist_res) | ((dist_a == dist_res) & (a[:, np.newaxis] < np.arange(n)))
+        # the gain of a resident that switches to both is realized only once, by the site serving it
+        gain_res = gain[res].toarray()
+        lost = np.where(closer[res].toarray(),
+                        np.where(a_serves, gain_res, gain_res[np.arange(len(res)), a][:, np.newaxis]), 0)
+        per_site = sparse.csr_array((np.ones(len(rows)), (rows, np.arange(len(rows)))), shape = (len(chunk), len(rows)))
+        joint = single[chunk, np.newaxis] + single[np.newaxis, :] - per_site @ lost
+        joint[:, ~is_candidate] = -np.inf
+        joint[np.arange(len(chunk)), chunk] = -np.inf
+        
+        best = np.argmax(joint, axis = 1)
+        partner[chunk] = np.where(np.isfinite(joint[np.arange(len(chunk)), best]), best, -1)
+        pair_gain[chunk] = joint[np.arange(len(chunk)), best]
+        # every pair once (a < b), merged into the top pairs
+        joint[chunk[:, np.newaxis] >= np.arange(n)] = -np.inf
+        flat = np.argpartition(-joint, min(top, joint.size) - 1, axis = None)[:top] if top and joint.size else []
+        flat = [i for i in flat if np.isfinite(joint.flat[i])]
+        a_top, b_top = np.unravel_index(np.array(flat, dtype = int), joint.shape)
+        best_pairs = np.concatenate([best_pairs, np.column_stack([chunk[a_top], b_top, joint[a_top, b_top]])])
+        best_pairs = best_pairs[np.argsort(-best_pairs[:, 2], kind = 'stable')[:top]]
+        if 'progress' in kwargs:
+            kwargs['progress'].progress((k+1)/len(chunks),
+                                        text=f"Berechnet Gemeinde {chunk[-1]+1} von {n}")
+    
+    def interaction(a, b, joint):
+        return np.where(b >= 0, joint - single[a] - single[np.maximum(b, 0)], np.nan)
+    ags = np.array(como.ags(model.muns), dtype = object)
+    result_df = pd.DataFrame({'LAU_ID': ags,
+                              'LAU': model.muns,
+                              'Improvement': np.where(is_candidate, single, 0),
+                              'Partner': np.where(partner >= 0, ags[np.maximum(partner, 0)], None),
+                              'Pair improvement': np.where(partner >= 0, pair_gain, np.nan),
+                              'Interaction': interaction(np.arange(n), partner, pair_gain)})
+    a, b = best_pairs[:, 0].astype(int), best_pairs[:, 1].astype(int)
+    pairs = pd.DataFrame({'LAU_ID': ags[a],
+                          'Partner': ags[b],
+                          'Pair improvement': best_pairs[:, 2],
+                          'Interaction': interaction(a, b, best_pairs[:, 2])})
+    result_df.attrs.update({'fixed_cws': como.ags(fixed_cws), 'pairs': pairs})
+    return result_df
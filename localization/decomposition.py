@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+import time
+import concurrent.futures
+from scipy.cluster.vq import kmeans2
+import commuting_model as como
+import cowork_locations as coloc
+
+
+# This code optimizes large regions (several states or all of Germany) by decomposition: the region is split into partitions, e.g. counties or spatial clusters, the new coworking spaces are allocated to the partitions according to their commuters, and every partition is optimized on its own in a separate process. Afterwards a local search repairs the solution along the partition borders, where catchment areas of neighbouring partitions interact.
+
+
+def partition(region, by = 'county', n_parts = None, seed = None):
+    """splits a region into partitions
+
+    Args:
+        region (lst of como.Municipality): the region
+        by (str, optional): 'county' splits by the first five digits of the AGS,
+            'cluster' by k-means on the coordinates. Defaults to 'county'.
+        n_parts (int, mandatory for 'cluster'): number of clusters
+        seed (int, optional): seed of the clustering
+
+    Returns:
+        lst of lst of como.Municipality: the partitions
+    """
+    if by == 'county':
+        labels = [mun.ags[:5] for mun in region]
+    elif by == 'cluster':
+        assert n_parts, f"n_parts is needed for partitioning by cluster"
+        _, labels = kmeans2(como._xyz(como.Municipality.coords(region)), n_parts,
+                            minit = '++', seed = seed)
+    else:
+        raise ValueError(f"cannot partition by {by}")
+    parts = {}
+    for mun, label in zip(region, labels):
+        parts.setdefault(label, []).append(mun)
+    return [parts[label] for label in sorted(parts)]
+
+def allocate(parts, n_new, fixed_cws = []):
+    """allocates new coworking spaces to partitions proportional to their outgoing commuters (largest remainder)
+
+    Args:
+        parts (lst of lst of como.Municipality): the partitions
+        n_new (int): number of new coworking spaces
+        fixed_cws (lst of como.Municipality, optional): existing coworking spaces
+
+    Returns:
+        np.array: number of new coworking spaces per partition
+    """
+    weights = np.array([sum(sum(como.get_commuters(res, wpl) for wpl in res.commutes_to) for res in part)
+                        for part in parts], dtype = float)
+    capacity = np.array([len([mun for mun in part if mun not in fixed_cws]) for part in parts])
+    assert capacity.sum() >= n_new, f"Not enough candidates for {n_new} new cws"
+    weights = weights/weights.sum() if weights.sum() else capacity/capacity.sum()
+    quota = weights*n_new
+    res = np.minimum(np.floor(quota).astype(int), capacity)
+    while res.sum() < n_new:
+        remainder = np.where(res < capacity, quota - res, -np.inf)
+        res[np.argmax(remainder)] += 1
+    return res
+
+def _solve_part(job):
+    """optimizes one partition; runs in a worker process and works on AGS only"""
+    algorithm, part, fixed_cws, n_cws, params = job
+    kwargs = dict(region = como.Municipality.get(part),
+                  fixed_cws = como.Municipality.get(fixed_cws),
+                  n_cws = n_cws,
+                  **params)
+    if algorithm == 'kLocs':
+        result = coloc.kLocs(**kwargs)
+    elif algorithm == 'genetic_algorithm':
+        result = coloc.genetic_algorithm(**kwargs)
+    elif algorithm == 'annealing':
+        result = coloc.annealing(**kwargs)
+    elif algorithm == 'exact':
+        result = coloc.exact(**kwargs)
+    else:
+        raise ValueError(f"unknown algorithm {algorithm}")
+    return como.ags(max(result['Solution']).variable_cws)
+
+def boundary_repair(solution, parts, max_steps = None):
+    """local search along partition borders.
+    Performs kLocs steps restricted to the coworking spaces whose catchment area reaches into another
+    partition, as long as they improve the solution.
+
+    Args:
+        solution (Solution): solution in the whole region, assembled from the partitions
+        parts (lst of lst of como.Municipality): the partitions
+        max_steps (int, optional): maximal number of steps
+
+    Returns:
+        lst of Solution: the solution after every improving step, starting with the given one
+    """
+    part_of = {mun.ags: i for i, part in enumerate(parts) for mun in part}
+    results = [solution]
+    while max_steps is None or len(results) <= max_steps:
+        current = results[-1]
+        border = [pos for pos in range(current.n_fixed, current.n_cws)
+                  if len({part_of[mun.ags] for mun in current.areas[pos]} | {part_of[current.locs[pos].ags]}) > 1]
+        if not border:
+            break
+        candidate = coloc.Solution(region = current.region, fixed_cws = current.fixed_cws,
+                                   locs = current.locs).step(border)
+        if candidate.total_saving > current.total_saving:
+            results.append(candidate)
+        else:
+            break
+    return results
+
+def partitioned(n_new, algorithm = 'kLocs', by = 'county', n_parts = None, n_jobs = None,
+                compare = False, seed = None, **kwargs):
+    """optimizes a large region by decomposition into partitions which are solved in parallel processes,
+    followed by a boundary repair
+
+    Arguments:
+        n_new (int): number of new coworking spaces in the whole region
+        algorithm (str, optional): 'kLocs', 'genetic_algorithm', 'annealing' or 'exact' for every partition. Defaults to 'kLocs'.
+        by, n_parts (optional): how to partition, see partition
+        n_jobs (int, optional): number of worker processes. Defaults to the number of processors.
+            With 1 the partitions are solved one after another in this process, with identical results.
+        compare (bool, optional): additionally run the algorithm on the whole region for comparison
+        seed (int, optional): seed; every partition gets its own independent random stream spawned from it
+        kwargs: region and fixed_cws as for initializing Solutions (mandatory) and further parameters of the algorithm
+
+    Returns:
+        result_df : a pandas dataframe like the one of kLocs, 'Step' 0 is the assembled solution and every further step
+        an improvement of the boundary repair. result_df.attrs contains
+        'allocation' : the number of new cws per partition
+        'time' : seconds spent on partitions, repair and (if compare) monolithic run
+        'monolithic' : (if compare) total saving of the monolithic run and the difference to the partitioned one
+    """
+    region = kwargs.pop('region')
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    fixed_cws = list(kwargs.pop('fixed_cws', []))
+    parts = partition(region, by, n_parts, seed)
+    allocation = allocate(parts, n_new, fixed_cws)
+    seeds = np.random.SeedSequence(seed).spawn(len(parts))
+
+    start = time.perf_counter()
+    jobs = []
+    for part, n_part, part_seed in zip(parts, allocation, seeds):
+        if n_part:
+            part_fixed = [mun for mun in fixed_cws if mun in part]
+            jobs.append((algorithm, como.ags(part), como.ags(part_fixed),
+                         len(part_fixed) + n_part, {**kwargs, 'rng': part_seed}))
+    if n_jobs == 1:
+        new_cws = [ags for job in jobs for ags in _solve_part(job)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            new_cws = [ags for part_cws in executor.map(_solve_part, jobs) for ags in part_cws]
+    t_parts = time.perf_counter() - start
+
+    start = time.perf_counter()
+    solution = coloc.Solution(region = region, fixed_cws = fixed_cws,
+                              locs = [*fixed_cws, *como.Municipality.get(new_cws)])
+    results = boundary_repair(solution, parts)
+    t_repair = time.perf_counter() - start
+
+    result_df = pd.DataFrame([[step, sol] for step, sol in enumerate(results)],
+                             columns = ['Step', 'Solution'])
+    result_df.set_index(['Step'], inplace = True)
+    result_df.attrs['allocation'] = allocation
+    result_df.attrs['time'] = {'partitions': t_parts, 'repair': t_repair}
+
+    if compare:
+        start = time.perf_counter()
+        job = (algorithm, como.ags(region), como.ags(fixed_cws), len(fixed_cws) + n_new, {**kwargs, 'rng': seed})
+        monolithic = coloc.Solution(region = region, fixed_cws = fixed_cws,
+                                    locs = [*fixed_cws, *como.Municipality.get(_solve_part(job))])
+        result_df.attrs['time']['monolithic'] = time.perf_counter() - start
+        result_df.attrs['monolithic'] = {'total_saving': monolithic.total_saving,
+                                         'difference': results[-1].total_saving - monolithic.total_saving}
+    return result_df
@@ -0,0 +1,151 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# This code exports the results of the optimizers and the heatmap in columnar form (Parquet, or CSV) and as geometry-bearing files (GeoJSON, GeoPackage) with the dissolved catchment areas of the coworking spaces. The tables are built column by column over all solutions instead of row by row; long results such as GA histories are written in chunks of solutions.
+
+
+CHUNK_SIZE = 500 # solutions written at once
+
+# formats offered for download: file extension, mime type
+FORMATS = {
+    'CSV' : ('csv', 'text/csv'),
+    'Parquet' : ('parquet', 'application/vnd.apache.parquet'),
+    'GeoJSON' : ('geojson', 'application/geo+json'),
+    'GeoPackage' : ('gpkg', 'application/geopackage+sqlite3'),
+}
+
+COLUMNS = {
+    'savings' : 'Pot. gesparte Personenminuten',
+    'commuters' : 'Pot. addressierte Pendler',
+}
+
+
+def solution_table(result_df):
+    """one row per result and coworking space
+
+    Args:
+        result_df (pd.DataFrame): result of an optimizer with a 'Solution' column
+
+    Returns:
+        pd.DataFrame: indexed by the index of result_df and 'Cluster' (position of the cws in locs); columns are
+        'AGS' and 'CWS' (name) of the coworking space, 'Bestehend' (fixed cws), 'Einzugsgebiet' (list of AGS),
+        and the savings and commuters of the area
+    """
+    sols = result_df['Solution'].to_numpy()
+    n_cws = np.array([sol.n_cws for sol in sols], dtype = int)
+    table = pd.DataFrame({
+        'Cluster' : np.concatenate([np.arange(n) for n in n_cws]) if len(sols) else np.zeros(0, dtype = int),
+        'AGS' : [mun.ags for sol in sols for mun in sol.locs],
+        'CWS' : [mun.name for sol in sols for mun in sol.locs],
+        'Bestehend' : np.concatenate([np.arange(n) < sol.n_fixed for n, sol in zip(n_cws, sols)]) if len(sols) else np.zeros(0, dtype = bool),
+        'Einzugsgebiet' : [[mun.ags for mun in area] for sol in sols for area in sol.areas],
+        COLUMNS['savings'] : np.array([saving for sol in sols for saving in sol.area_savings], dtype = float),
+        COLUMNS['commuters'] : np.array([commuters for sol in sols for commuters in sol.area_commuters], dtype = float),
+        }, index = result_df.index.repeat(n_cws))
+    return table.set_index('Cluster', append = True)
+
+def heatmap_table(res_heatmap):
+    """the heatmap without the Solution objects, indexed by 'AGS'"""
+    table = res_heatmap[['LAU_ID', 'LAU', 'Improvement']].rename(
+        columns = {'LAU_ID': 'AGS', 'LAU': 'Gemeinde', 'Improvement': 'Verbesserung'})
+    table['Gemeinde'] = table['Gemeinde'].map(lambda mun : mun.name)
+    return table.set_index('AGS')
+
+def to_csv(result_df, file):
+    """writes solution_table as CSV; catchment areas are space separated AGS"""
+    table = solution_table(result_df)
+    table['Einzugsgebiet'] = table['Einzugsgebiet'].map(' '.join)
+    table.to_csv(file, float_format = '%.4f')
+
+def to_parquet(result_df, file, chunk_size = CHUNK_SIZE):
+    """writes solution_table as Parquet, chunk_size solutions at once; catchment areas are lists of AGS"""
+    writer = None
+    for start in range(0, max(len(result_df), 1), chunk_size):
+        table = pa.Table.from_pandas(solution_table(result_df.iloc[start:start + chunk_size]))
+        if writer is None:
+            writer = pq.ParquetWriter(file, table.schema)
+        writer.write_table(table)
+    writer.close()
+
+def catchment_areas(result_df, region_df):
+    """dissolves the catchment areas of every solution into one polygon per coworking space
+
+    Args:
+        result_df (pd.DataFrame): result of an optimizer with a 'Solution' column
+        region_df (gpd.GeoDataFrame): municipality shapes with column 'LAU_ID'
+
+    Yields:
+        gpd.GeoDataFrame: solution_table of a chunk of solutions with the polygons of the catchment areas;
+        the index is reset into columns
+    """
+    for start in range(0, len(result_df), CHUNK_SIZE):
+        chunk = result_df.iloc[start:start + CHUNK_SIZE]
+        table = solution_table(chunk)
+        # every municipality of an area joined to its (result, cluster) row, then dissolved
+        members = table['Einzugsgebiet'].explode().dropna().rename('LAU_ID').reset_index()
+        members = members.merge(region_df[['LAU_ID', 'geometry']], on = 'LAU_ID')
+        shapes = gpd.GeoDataFrame(members, geometry = 'geometry', crs = region_df.crs) \
+            .dissolve(by = list(table.index.names))[['geometry']]
+        table['Einzugsgebiet'] = table['Einzugsgebiet'].map(' '.join) # no list columns in GIS formats
+        yield gpd.GeoDataFrame(table.join(shapes, how = 'inner').reset_index(),
+                               geometry = 'geometry', crs = region_df.crs)
+
+def to_geofile(result_df, region_df, file, driver = 'GPKG'):
+    """writes the catchment areas of all solutions as GeoPackage (appending chunk by chunk) or GeoJSON
+
+    Args:
+        result_df (pd.DataFrame): result of an optimizer with a 'Solution' column
+        region_df (gpd.GeoDataFrame): municipality shapes with column 'LAU_ID'
+        file (str): path of the file
+        driver (str, optional): 'GPKG' or 'GeoJSON'. Defaults to 'GPKG'.
+    """
+    chunks = catchment_areas(result_df, region_df)
+    if driver == 'GPKG':
+        for i, chunk in enumerate(chunks):
+            chunk.to_file(file, driver = driver, layer = 'Einzugsgebiete', mode = 'a' if i else 'w')
+    else: # GeoJSON cannot be appended
+        pd.concat(chunks).to_file(file, driver = driver)
+
+def heatmap_areas(res_heatmap, region_df):
+    """the heatmap joined to the municipality shapes"""
+    return gpd.GeoDataFrame(region_df[['LAU_ID', 'geometry']].rename(columns = {'LAU_ID': 'AGS'})
+                            .merge(heatmap_table(res_heatmap).reset_index(), on = 'AGS'),
+                            geometry = 'geometry', crs = region_df.crs)
+
+def to_bytes(write, fmt, *args):
+    """runs a writer on a temporary file of the format (key of FORMATS) and returns the content, e.g. for downloads
+
+    Args:
+        write (function): called as write(*args, path)
+        fmt (str): key of FORMATS
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'export.' + FORMATS[fmt][0])
+        write(*args, path)
+        with open(path, 'rb') as file:
+            return file.read()
+
+def solutions(result_df, region_df, fmt):
+    """the content of an export of result_df in a format (key of FORMATS)"""
+    if fmt == 'CSV':
+        return to_bytes(to_csv, fmt, result_df)
+    if fmt == 'Parquet':
+        return to_bytes(to_parquet, fmt, result_df)
+    driver = {'GeoJSON': 'GeoJSON', 'GeoPackage': 'GPKG'}[fmt]
+    return to_bytes(lambda res, reg, path : to_geofile(res, reg, path, driver), fmt, result_df, region_df)
+
+def heatmap(res_heatmap, region_df, fmt):
+    """the content of an export of the heatmap in a format (key of FORMATS)"""
+    if fmt == 'CSV':
+        return heatmap_table(res_heatmap).to_csv().encode('utf-8')
+    if fmt == 'Parquet':
+        return heatmap_table(res_heatmap).to_parquet()
+    driver = {'GeoJSON': 'GeoJSON', 'GeoPackage': 'GPKG'}[fmt]
+    return to_bytes(lambda res, reg, path : heatmap_areas(res, reg).to_file(path, driver = driver),
+                    fmt, res_heatmap, region_df)
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import time
+import concurrent.futures
+import commuting_model as como
+import cowork_locations as coloc
+
+
+# This code runs the genetic algorithm as an island model: several populations evolve independently in separate processes, each with its own random stream, and every few generations the best individuals of an island migrate to its neighbours according to a topology. The islands explore different parts of the search space, so the model converges less prematurely than one large population, and the islands are evolved in parallel.
+
+
+TOPOLOGIES = ('ring', 'full', 'random')
+
+
+def _evolve(job):
+    """evolves one island for some generations; runs in a worker process and works on AGS only
+
+    Returns:
+        tuple: the history (one dict per generation), the final population as (AGS of locs, total saving),
+        best first, and the advanced random number generator
+    """
+    region, fixed_cws, n_cws, population, rng, n_gen, params = job
+    region = como.Municipality.get(region)
+    fixed_cws = como.Municipality.get(fixed_cws)
+    if population is not None:
+        population = [coloc.Solution(region = region, fixed_cws = fixed_cws, rng = rng,
+                                     locs = como.Municipality.get(locs)) for locs, _ in population]
+    history = []
+    for generation in coloc.iter_genetic_algorithm(n_gen = n_gen, population = population, rng = rng,
+                                                   region = region, fixed_cws = fixed_cws, n_cws = n_cws, **params):
+        history.append({'Generation': generation['Generation'],
+                        'Max': generation['Max'],
+                        'Mean': generation['Mean'],
+                        'Min': generation['Min'],
+                        'Best': [(como.ags(sol.locs), sol.total_saving) for sol in generation['Best']]})
+    population = sorted(generation['Population'], reverse = True)
+    return history, [(como.ags(sol.locs), sol.total_saving) for sol in population], rng
+
+def migrate(populations, n_migrants, topology = 'ring', rng = None):
+    """exchanges the best individuals between islands; migrants replace the worst individuals of an island
+
+    Args:
+        populations (lst of lst of (locs, total saving)): the population of every island, best first
+        n_migrants (int): number of individuals an island receives
+        topology (str, optional): 'ring' (from the previous island), 'full' (the best of all other islands)
+            or 'random' (from a randomly chosen other island). Defaults to 'ring'.
+        rng (np.random.Generator, mandatory for 'random'): random number generator
+
+    Returns:
+        lst of lst of (locs, total saving): the new populations, best first
+    """
+    n = len(populations)
+    others = [[j for j in range(n) if j != i] for i in range(n)]
+    if topology == 'ring':
+        sources = [[(i - 1) % n] if n > 1 else [] for i in range(n)]
+    elif topology == 'full':
+        sources = others
+    elif topology == 'random':
+        sources = [[rng.choice(js)] if js else [] for js in others]
+    else:
+        raise ValueError(f"unknown topology {topology}, use one of {TOPOLOGIES}")
+
+    res = []
+    for i, population in enumerate(populations):
+        migrants = sorted((ind for j in sources[i] for ind in populations[j][:n_migrants]),
+                          key = lambda ind : ind[1], reverse = True)[:n_migrants]
+        res.append(sorted(population[:len(population) - len(migrants)] + migrants,
+                          key = lambda ind : ind[1], reverse = True))
+    return res
+
+def island_genetic_algorithm(n_islands, n_pop, n_gen, p_survive, p_mut, n_best = 5, migration_interval = 5,
+                             n_migrants = 2, topology = 'ring', n_jobs = None, time_budget = None, seed = None, **kwargs):
+    """performs the genetic algorithm on several islands in parallel processes with periodic migration
+
+    Arguments:
+        n_islands (int): number of islands
+        n_pop, n_gen, p_survive, p_mut, n_best: as for genetic_algorithm; n_pop is the population of every island
+        migration_interval (int, optional): generations between two migrations. Defaults to 5.
+        n_migrants (int, optional): number of individuals every island receives per migration. Defaults to 2.
+        topology (str, optional): who sends migrants to whom, see migrate. Defaults to 'ring'.
+        n_jobs (int, optional): number of worker processes. Defaults to the number of processors.
+            With 1 the islands are evolved one after another in this process, with identical results.
+        time_budget (float, optional): wall-clock budget in seconds. No further migration interval is started
+            if it would probably not finish within the budget.
+        seed (int, optional): seed; every island gets its own independent random stream spawned from it
+        kwargs: arguments for initializing Solutions (region, fixed_cws, n_cws). Mandatory.
+        progress (optional) : a streamlit progressbar
+
+    Returns:
+        result_df : a pandas dataframe like the one of genetic_algorithm, with the n_best best solutions of all islands
+        per generation. The reason for stopping is stored in result_df.attrs['stop_reason'], the history of every island in
+        result_df.attrs['islands'], a dataframe indexed by 'Island' and 'Generation' with the columns 'Max', 'Mean', 'Min'
+        and 'Best' (AGS of the best solution of the island). Migrations take place after the generations that are
+        multiples of migration_interval, the history shows the island before the migration.
+    """
+    progress = kwargs.pop('progress', None)
+    region = kwargs.pop('region')
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    fixed_cws = list(kwargs.pop('fixed_cws', []))
+    n_cws = kwargs.pop('n_cws')
+    params = dict(n_pop = n_pop, p_survive = p_survive, p_mut = p_mut, n_best = n_best, **kwargs)
+    seeds = np.random.SeedSequence(seed).spawn(n_islands + 1)
+    rngs = [np.random.default_rng(island_seed) for island_seed in seeds[:-1]]
+    rng = np.random.default_rng(seeds[-1]) # of the migration
+
+    start = last = time.perf_counter()
+    populations = [None]*n_islands
+    histories = [[] for i in range(n_islands)]
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers = n_jobs) if n_jobs != 1 else None
+    try:
+        gen = 0
+        while True:
+            n_epoch = min(migration_interval, n_gen - gen)
+            jobs = [(como.ags(region), como.ags(fixed_cws), n_cws, populations[i], rngs[i], n_epoch, params)
+                    for i in range(n_islands)]
+            results = executor.map(_evolve, jobs) if executor else map(_evolve, jobs)
+            for i, (history, population, island_rng) in enumerate(results):
+                for record in history[1 if gen else 0:]: # generation 0 of an interval is the last one of the previous
+                    histories[i].append({**record, 'Generation': gen + record['Generation']})
+                populations[i], rngs[i] = population, island_rng
+            gen += n_epoch
+
+            now = time.perf_counter()
+            if gen >= n_gen:
+                stop = 'n_gen'
+            elif time_budget is not None and 2*now - last - start > time_budget:
+                stop = 'time_budget'
+            else:
+                stop = None
+            last = now
+            if progress is not None:
+                best = max(record['Max'] for history in histories for record in history[-1:])
+                progress.progress(1 if stop else gen/max(n_gen, 1),
+                                  text=f"Generation {gen}: {'{:0,.2f}'.format(best)} Personenminuten")
+            if stop:
+                break
+            populations = migrate(populations, n_migrants, topology, rng)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    # overall best per generation, every distinct solution evaluated once
+    solutions = dict()
+    def solution(locs):
+        if tuple(locs) not in solutions:
+            solutions[tuple(locs)] = coloc.Solution(region = region, fixed_cws = fixed_cws,
+                                                    locs = como.Municipality.get(locs))
+        return solutions[tuple(locs)]
+    result_df = []
+    for records in zip(*histories):
+        best = sorted((ind for record in records for ind in record['Best']), key = lambda ind : ind[1], reverse = True)
+        savings = set()
+        best = [ind for ind in best if not (ind[1] in savings or savings.add(ind[1]))][:n_best] # distinct like np.unique
+        for j, (locs, _) in enumerate(best):
+            sol = solution(locs)
+            result_df.append([records[0]['Generation'], j+1, sol, sol.check()])
+    result_df = pd.DataFrame(result_df, columns = ['Generation', 'Best', 'Solution', 'Check'])
+    result_df.set_index(['Generation', 'Best'], inplace = True)
+    result_df.attrs['stop_reason'] = stop
+
+    islands = pd.DataFrame([{'Island': i, **record, 'Best': record['Best'][0][0]}
+                            for i, history in enumerate(histories) for record in history])
+    result_df.attrs['islands'] = islands.set_index(['Island', 'Generation'])
+    return result_df
@@ -0,0 +1,93 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+
+
+# This code measures the latency of the optimisation service (localization/service.py) under concurrent load. It sends a number of requests with a given concurrency; a share of them are identical, as when several dashboards ask for the same region, so that the effect of request coalescing shows. It reports the percentiles of the latency, the throughput and how many requests were coalesced.
+#
+# usage: python localization/loadtest.py request.json [--url http://127.0.0.1:8765/kLocs] [-n 100] [-c 10] [--distinct 0.2]
+#
+# request.json is the body of a request, e.g. {"region": ["01001"], "fixed_cws": [], "n_new": 3, "seed": 1}.
+# Distinct requests are made by changing the seed (or, for the heatmap, the fixed coworking spaces).
+
+
+async def _post(host, port, path, body):
+    """sends one request; returns (status, headers, body)"""
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body).encode('utf-8')
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n").encode('latin-1') + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, value = line.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    content = await reader.read()
+    writer.close()
+    return status, headers, content
+
+def _variant(body, i):
+    """a request that differs from body"""
+    body = dict(body)
+    if 'n_new' in body:
+        body['seed'] = 10**6 + i
+    else:
+        body['fixed_cws'] = [*body.get('fixed_cws', []), random.choice(body['region'])]
+    return body
+
+async def run(url, body, n_requests = 100, concurrency = 10, distinct = 0.2):
+    """sends n_requests, concurrency at a time; a share distinct of them differ from body
+
+    Returns:
+        dict: latency percentiles in s, throughput in requests/s, number of coalesced and failed requests
+    """
+    host, _, rest = url.split('://', 1)[-1].partition(':')
+    port, _, path = rest.partition('/')
+    port, path = int(port or 80), '/' + path
+    bodies = [_variant(body, i) if random.random() < distinct else body for i in range(n_requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, coalesced, failed = [], 0, 0
+
+    async def one(body):
+        nonlocal coalesced, failed
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                status, headers, _ = await _post(host, port, path, body)
+            except OSError:
+                status, headers = None, {}
+            latencies.append(time.perf_counter() - start)
+            coalesced += headers.get('x-coalesced') == '1'
+            failed += status != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    seconds = time.perf_counter() - start
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'requests': n_requests, 'concurrency': concurrency, 'seconds': seconds,
+            'throughput': n_requests/seconds, 'p50': p50, 'p90': p90, 'p99': p99, 'max': max(latencies),
+            'coalesced': coalesced, 'failed': failed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Measures the latency of the optimisation service.')
+    parser.add_argument('request', help = 'request body (JSON file)')
+    parser.add_argument('--url', default = 'http://127.0.0.1:8765/kLocs')
+    parser.add_argument('-n', type = int, default = 100, help = 'number of requests')
+    parser.add_argument('-c', type = int, default = 10, help = 'concurrent requests')
+    parser.add_argument('--distinct', type = float, default = 0.2, help = 'share of requests that differ from the others')
+    args = parser.parse_args()
+    with open(args.request) as f:
+        body = json.load(f)
+    res = asyncio.run(run(args.url, body, args.n, args.c, args.distinct))
+    print(f"{res['requests']} requests, {res['concurrency']} concurrent, {res['seconds']:.2f} s, "
+          f"{res['throughput']:.1f} requests/s")
+    print(f"latency p50 {res['p50']*1000:.0f} ms, p90 {res['p90']*1000:.0f} ms, p99 {res['p99']*1000:.0f} ms, "
+          f"max {res['max']*1000:.0f} ms")
+    print(f"{res['coalesced']} coalesced, {res['failed']} failed")
+    sys.exit(1 if res['failed'] else 0)
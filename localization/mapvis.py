@@ -1,7 +1,11 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import contextily as ctx
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PathCollection
+from matplotlib.path import Path
 import pickle 
 import os
 import sys
@@ -100,3 +104,143 @@ class mapvis:
         #print(f"Legende = {legend_x}, {legend_y}")
         self.f.legend(loc = 'upper right', bbox_to_anchor=(.85, .75))
         #self.f.legend(loc = 'upper right')
+
+
+class mapbatch(mapvis):
+    """renders many maps of the same region on a shared background.
+    
+    The municipality borders (and the optional basemap) are drawn only once and
+    rasterized. Every frame then just overlays its highlights and points on that
+    raster as a single collection each, which is a lot cheaper than a full
+    render with mapvis.
+    """
+    
+    def __init__(self, l_ags, basemap=False):
+        assert len(l_ags), f"An empty list was inputted."
+        super().__init__()
+        which = _shapedf['LAU_ID'].str.startswith(tuple(l_ags)).to_numpy()
+        shapes = _shapedf[which]
+        self.__lau = shapes['LAU_ID'].to_numpy(dtype=str)
+        self.__pos = {ags: i for i, ags in enumerate(self.__lau)}
+        self.__paths = [_path(geom) for geom in shapes.geometry]
+        
+        # render the shared background once
+        shapes.exterior.plot(ax=self.ax,
+                             linewidth=self.linewidth,
+                             edgecolor=self.edgecolor)
+        if basemap:
+            self.add_basemap()
+        self.__xlim, self.__ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        self.f.canvas.draw()
+        bbox = np.round(self.ax.get_window_extent().get_points()).astype(int)
+        raster = np.asarray(self.f.canvas.buffer_rgba())
+        height = raster.shape[0]
+        raster = raster[height - bbox[1, 1]:height - bbox[0, 1],
+                        bbox[0, 0]:bbox[1, 0]].copy()
+        
+        # replace the vector background by its raster
+        for artist in [*self.ax.collections, *self.ax.images, *self.ax.lines]:
+            artist.remove()
+        self.ax.imshow(raster, extent=(*self.__xlim, *self.__ylim),
+                       aspect=self.ax.get_aspect(), interpolation='nearest', zorder=0)
+        self.ax.set_xlim(self.__xlim)
+        self.ax.set_ylim(self.__ylim)
+        self.ax.set_autoscale_on(False)
+        self.__overlay = []
+        
+    def _select(self, l_ags):
+        prefix = tuple(l_ags)
+        if all(ags in self.__pos for ags in prefix): # full AGS, no prefix search needed
+            return np.array([self.__pos[ags] for ags in prefix], dtype=int)
+        return np.flatnonzero([ags.startswith(prefix) for ags in self.__lau])
+        
+    def highlight(self, l_ags, color='C0', alpha=1):
+        assert len(l_ags), f"An empty list was inputted."
+        self.highlight_many([l_ags], [color], alpha)
+        pass
+    
+    def highlight_many(self, l_l_ags, colors, alpha=1):
+        """highlights several groups of municipalities in one collection"""
+        paths, facecolors = [], []
+        for l_ags, color in zip(l_l_ags, colors):
+            which = self._select(l_ags)
+            paths.extend(self.__paths[i] for i in which)
+            facecolors.extend([color]*len(which))
+        collection = PathCollection(paths, facecolors=facecolors, alpha=alpha,
+                                    linewidths=self.linewidth,
+                                    edgecolors=self.edgecolor)
+        self.__overlay.append(self.ax.add_collection(collection, autolim=False))
+        pass
+    
+    def add_points(self, l_ags, color='black', markersize=30, **kwargs):
+        assert len(l_ags), f"An empty list was inputted."
+        points = _coords.loc[l_ags].geometry
+        self.__overlay.append(self.ax.scatter(points.x, points.y, c=color,
+                                              s=markersize, **kwargs))
+        pass
+    
+    def clear(self):
+        """removes everything but the shared background"""
+        for artist in self.__overlay:
+            artist.remove()
+        self.__overlay = []
+        self.ax.set_title('')
+        self.ax.set_xlim(self.__xlim)
+        self.ax.set_ylim(self.__ylim)
+        pass
+    
+    def draw_solution(self, solution, alpha=.5):
+        """overlays the areas and coworking spaces of a solution"""
+        colors = plt.get_cmap('tab20').colors
+        self.highlight_many([[mun.ags for mun in area] for area in solution.areas],
+                            [colors[i % len(colors)] for i in range(len(solution.areas))],
+                            alpha=alpha)
+        if solution.n_fixed:
+            self.add_points([mun.ags for mun in solution.fixed_cws], color='grey')
+        self.add_points([mun.ags for mun in solution.variable_cws], color='black')
+        pass
+        
+    def export(self, solutions, path, titles=None):
+        """writes one map per solution.
+
+        Args:
+            solutions (iterable of Solution): the solutions to render, e.g. the Solution column of a kLocs or GA result
+            path (str): a '.pdf' file for a multi-page PDF or a pattern like 'frame_{:03d}.png' for an image sequence.
+                A pattern without placeholder gets '_{}' before its extension if there is more than one solution.
+            titles (iterable of str, optional): one title per solution
+
+        Returns:
+            lst: the written files
+        """
+        solutions = list(solutions)
+        titles = [None]*len(solutions) if titles is None else list(titles)
+        files = []
+        pdf = PdfPages(path) if path.endswith('.pdf') else None
+        if pdf is None and len(solutions) > 1 and path.format(0) == path.format(1): # every map would overwrite the last
+            root, ext = os.path.splitext(path)
+            path = root + '_{}' + ext
+        try:
+            for i, (sol, title) in enumerate(zip(solutions, titles)):
+                self.draw_solution(sol)
+                if title is not None:
+                    self.ax.set_title(title)
+                if pdf is not None:
+                    pdf.savefig(self.f)
+                else:
+                    files.append(path.format(i))
+                    self.f.savefig(files[-1])
+                self.clear()
+        finally:
+            if pdf is not None:
+                pdf.close()
+                files.append(path)
+        return files
+
+
+def _path(geom):
+    """converts a (multi)polygon into a single matplotlib path"""
+    polygons = getattr(geom, 'geoms', [geom])
+    rings = [ring for polygon in polygons
+             for ring in (polygon.exterior, *polygon.interiors)]
+    return Path.make_compound_path(*[Path(np.asarray(ring.coords)[:, :2], closed=True)
+                                     for ring in rings])
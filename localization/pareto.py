@@ -0,0 +1,204 @@
+import time
+import numpy as np
+import pandas as pd
+import commuting_model as como
+import cowork_locations as coloc
+from region_model import RegionModel
+
+
+# This code searches the trade-off between the two targets of a solution, the saved person minutes (total_saving) and the addressed commuters (total_commuters), with a multi-objective genetic algorithm in the style of NSGA-II. Individuals are encoded as sorted arrays of positions in the RegionModel of the region, so that a whole population is evaluated at once and non-dominated sorting and crowding distance are array operations; combination and mutation work like Solution.combine and Solution.mutate. The result is the Pareto front: the solutions that cannot be improved in one target without losing in the other.
+
+
+OBJECTIVES = ('Total saving', 'Total commuters')
+
+
+def non_dominated_sort(objectives):
+    """sorts individuals into fronts; a front consists of the individuals that are only dominated by earlier fronts
+
+    Args:
+        objectives (np.array): (individuals, objectives), all objectives are maximised
+
+    Returns:
+        np.array of int: the front of every individual, 0 is the non-dominated front
+    """
+    geq = np.all(objectives[:, np.newaxis] >= objectives[np.newaxis], axis = 2)
+    gt = np.any(objectives[:, np.newaxis] > objectives[np.newaxis], axis = 2)
+    dominates = geq & gt # [i, j]: i dominates j
+    n_dominating = np.sum(dominates, axis = 0)
+    front = np.full(len(objectives), -1)
+    remaining = np.ones(len(objectives), dtype = bool)
+    rank = 0
+    while remaining.any():
+        current = remaining & (n_dominating == 0)
+        front[current] = rank
+        remaining &= ~current
+        n_dominating -= np.sum(dominates[current], axis = 0)
+        rank += 1
+    return front
+
+def crowding_distance(objectives, front):
+    """sum over the objectives of the normalized distance between the neighbours of an individual in its front;
+    the extreme individuals of a front get np.inf
+
+    Args:
+        objectives (np.array): (individuals, objectives)
+        front (np.array of int): the front of every individual, see non_dominated_sort
+
+    Returns:
+        np.array: the crowding distance of every individual
+    """
+    n = len(objectives)
+    res = np.zeros(n)
+    if not n:
+        return res
+    for values in objectives.T:
+        order = np.lexsort((values, front))
+        v, f = values[order], front[order]
+        first = np.r_[True, f[1:] != f[:-1]]
+        last = np.r_[f[1:] != f[:-1], True]
+        starts = np.flatnonzero(first)
+        span = np.repeat(v[last] - v[first], np.diff(np.r_[starts, n]))
+        gap = np.zeros(n)
+        gap[1:-1] = v[2:] - v[:-2]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            gap = np.where(span > 0, gap/span, 0)
+        res[order] += np.where(first | last, np.inf, gap)
+    return res
+
+def hypervolume(objectives):
+    """area dominated by a set of points with two non-negative objectives, relative to the origin"""
+    points = objectives[np.lexsort((-objectives[:, 0], objectives[:, 1]))] # by the second objective, ascending
+    best_first = np.maximum.accumulate(points[::-1, 0])[::-1] # best first objective among points at least as high
+    return np.sum(best_first * np.diff(np.r_[0, points[:, 1]]))
+
+def pareto_genetic_algorithm(n_pop, n_gen, p_mut, time_budget = None, patience = None, rel_tol = 0, **kwargs):
+    """searches the Pareto front of total saving and total commuters with an NSGA-II-style genetic algorithm:
+    parents are chosen by binary tournaments (lower front, then larger crowding distance), children are combined
+    and mutated like Solutions, and parents and children compete for the next generation by front and crowding distance.
+
+    Args:
+        n_pop (int): population size
+        n_gen (int): number of generations
+        p_mut (float [0, 1]): probability of mutation in each location, as in Solution.mutate
+        time_budget (float, optional): wall-clock budget in seconds. No further generation is started
+            if it would probably not finish within the budget.
+        patience (int, optional): stop after that many generations without increase of the hypervolume of the front
+        rel_tol (float, optional): relative increase of the hypervolume that counts as improvement. Defaults to 0.
+        kwargs: arguments for initializing Solutions (region, fixed_cws, n_cws). Mandatory.
+        rng (np.random.Generator or seed; optional): random number generator of the run
+        seed (int; optional): seed, if no rng is given
+        progress (optional) : a streamlit progressbar
+
+    Returns:
+        result_df : a pandas dataframe indexed by 'Pareto' (1 has the largest saving) with the solutions of the front
+        ('Solution'), their 'Total saving', 'Total commuters' and the AGS of the new cws ('CWS'). The reason for stopping
+        is stored in result_df.attrs['stop_reason'], the development of the front in result_df.attrs['history'],
+        indexed by 'Generation' with the columns 'Front' (number of solutions), 'Max saving', 'Max commuters' and
+        'Hypervolume' (in person minutes times commuters).
+    """
+    progress = kwargs.pop('progress', None)
+    rng = np.random.default_rng(kwargs.pop('rng', kwargs.pop('seed', None)))
+    region = kwargs['region']
+    if not all(isinstance(el, como.Municipality) for el in region):
+        region = como.Municipality.dissolve(tuple(region))
+    fixed_cws = list(kwargs.get('fixed_cws', []))
+    n_new = kwargs['n_cws'] - len(fixed_cws)
+    assert n_new > 0, f"More fixed cws than cws to be set. Ensure n_cws > len(fixed_cws)"
+
+    model = RegionModel.get(region)
+    n = len(model)
+    fixed = model.index(fixed_cws)
+    candidates = np.setdiff1d(np.arange(n), fixed)
+    # commuting targets of every municipality in the region, the mutations of Solution.mutate
+    in_region = set(mun.ags for mun in model.muns)
+    targets, weights = [], []
+    for mun in model.muns:
+        wpls = [wpl for wpl in mun.commutes_to if wpl.ags in in_region and wpl != mun]
+        targets.append(model.index(wpls))
+        weights.append(np.array([mun.get_commuters(wpl) for wpl in wpls], dtype = float))
+
+    def evaluate(pop):
+        locs = np.hstack([np.broadcast_to(fixed, (len(pop), len(fixed))), pop])
+        result = coloc.evaluate_positions(model, locs)
+        return np.column_stack([result[objective] for objective in OBJECTIVES])
+
+    def combine(a, b):
+        union = np.union1d(a, b)
+        return np.sort(rng.choice(union, size = n_new, replace = False))
+
+    def mutate(ind):
+        exclude = set(fixed) | set(ind)
+        res = []
+        for loc in ind:
+            allowed = np.array([t not in exclude for t in targets[loc]], dtype = bool)
+            cand, w = targets[loc][allowed], weights[loc][allowed]
+            choice = rng.choice(np.r_[loc, cand], p = np.r_[(1 - p_mut)*np.sum(w) + .1, w]/((2 - p_mut)*np.sum(w) + .1))
+            exclude.add(choice)
+            res.append(choice)
+        return np.sort(res)
+
+    def select(pop, objectives, size):
+        """the size best of pop by front and crowding distance, without duplicates"""
+        pop, unique = np.unique(pop, axis = 0, return_index = True)
+        objectives = objectives[unique]
+        front = non_dominated_sort(objectives)
+        crowding = crowding_distance(objectives, front)
+        best = np.lexsort((-crowding, front))[:size]
+        return pop[best], objectives[best], front[best], crowding[best]
+
+    start = last = time.perf_counter()
+    pop = np.array([np.sort(rng.choice(candidates, size = n_new, replace = False)) for i in range(n_pop)], dtype = int)
+    pop = pop.reshape(n_pop, n_new)
+    pop, objectives, front, crowding = select(pop, evaluate(pop), n_pop)
+    history = []
+    for i in range(n_gen + 1):
+        pareto = front == 0
+        volume = hypervolume(objectives[pareto])
+        history.append([i, np.sum(pareto), objectives[:, 0].max(), objectives[:, 1].max(), volume])
+
+        # stopping criteria
+        if i == 0 or volume > best_volume + rel_tol*abs(best_volume):
+            best_volume = volume
+            stagnating = 0
+        else:
+            stagnating += 1
+        now = time.perf_counter()
+        if i == n_gen:
+            stop = 'n_gen'
+        elif patience is not None and stagnating >= patience:
+            stop = 'stagnation'
+        elif time_budget is not None and 2*now - last - start > time_budget:
+            stop = 'time_budget'
+        else:
+            stop = None
+        last = now
+        if progress is not None:
+            progress.progress(1 if stop else (i+1)/(n_gen+1),
+                              text=f"Generation {i}: {np.sum(pareto)} Pareto-optimale Lösungen")
+        if stop:
+            break
+
+        # binary tournaments, lower front first, then larger crowding distance
+        rivals = rng.integers(len(pop), size = (2*n_pop, 2))
+        a, b = rivals.T
+        first_wins = (front[a] < front[b]) | ((front[a] == front[b]) & (crowding[a] >= crowding[b]))
+        parents = np.where(first_wins, a, b).reshape(n_pop, 2)
+        children = np.array([mutate(combine(pop[a], pop[b])) for a, b in parents], dtype = int).reshape(n_pop, n_new)
+
+        pop, objectives, front, crowding = select(np.vstack([pop, children]),
+                                                  np.vstack([objectives, evaluate(children)]), n_pop)
+
+    # the front as Solutions, sorted by saving
+    pareto = np.flatnonzero(front == 0)
+    pareto = pareto[np.argsort(-objectives[pareto, 0], kind = 'stable')]
+    sols = [coloc.Solution(region = region, fixed_cws = fixed_cws, locs = [*fixed_cws, *[model.muns[c] for c in pop[j]]])
+            for j in pareto]
+    result_df = pd.DataFrame({'Pareto': np.arange(1, len(sols) + 1),
+                              'Solution': sols,
+                              OBJECTIVES[0]: objectives[pareto, 0],
+                              OBJECTIVES[1]: objectives[pareto, 1],
+                              'CWS': [como.ags(sol.variable_cws) for sol in sols]}).set_index('Pareto')
+    result_df.attrs['stop_reason'] = stop
+    result_df.attrs['history'] = pd.DataFrame(history, columns = ['Generation', 'Front', 'Max saving', 'Max commuters',
+                                                                  'Hypervolume']).set_index('Generation')
+    return result_df
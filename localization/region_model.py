@@ -0,0 +1,220 @@
+import hashlib
+import numpy as np
+import commuting_model as como
+
+
+# This code precomputes, for every pair of municipalities in a region, the travel time between them and the savings and commuters that a coworking space in one municipality would generate among the residents of the other. The resulting matrices are the basis for the vectorized and exact solvers, which then no longer need to call `assess_savings` for every candidate. With a radius (como.set_radius) only the pairs within it are stored, so that the model of a large region grows with the number of municipalities times their neighbours instead of its square. Models are cached per region and setting, the least recently used ones are dropped beyond MAX_BYTES.
+
+
+class TruncatedMatrix:
+    """a matrix of which only the entries within como.RADIUS are stored, sorted by column and row; all other entries
+    are fill. Indexing works like for a np.array and returns np.arrays, so that the solvers use it like the dense
+    matrices of a model without radius. Operations on the whole matrix convert it with np.asarray, which is dense.
+    """
+    shape = property(lambda self : self.__pattern[3])
+    ndim = 2
+
+    def __init__(self, pattern, data, fill):
+        """
+        Args:
+            pattern (tuple): positions of the stored entries, see pattern; shared by matrices of the same pairs
+            data (np.array): the stored entries in the order of the pattern
+            fill (float): value of all other entries
+        """
+        self.__pattern, self.__data, self.__fill = pattern, data, fill
+
+    @staticmethod
+    def pattern(keys, shape):
+        """positions of stored entries
+
+        Args:
+            keys (np.array of int): sorted column * shape[0] + row of every stored entry
+            shape (tuple of int): shape of the matrix
+
+        Returns:
+            tuple: keys, rows, start of every column in keys, shape
+        """
+        return keys, (keys % shape[0]).astype(np.int32), np.searchsorted(keys, np.arange(shape[1] + 1)*shape[0]), shape
+
+    @property
+    def nbytes(self):
+        return self.__data.nbytes + sum(array.nbytes for array in self.__pattern[:3])
+
+    def __columns(self, cols):
+        """dense columns"""
+        keys, rows, indptr, shape = self.__pattern
+        starts = indptr[cols]
+        counts = indptr[cols + 1] - starts
+        pos = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(np.sum(counts))
+        res = np.full((shape[0], len(cols)), self.__fill)
+        res[rows[pos], np.repeat(np.arange(len(cols)), counts)] = self.__data[pos]
+        return res
+
+    def __lookup(self, rows, cols):
+        """entries at broadcasted row and column indices"""
+        keys, shape = self.__pattern[0], self.__pattern[3]
+        rows, cols = np.broadcast_arrays(rows, cols)
+        wanted = cols.ravel()*shape[0] + rows.ravel()
+        pos = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+        found = keys[pos] == wanted if len(keys) else np.zeros(len(wanted), dtype = bool)
+        return np.where(found, self.__data[pos] if len(keys) else self.__fill, self.__fill).reshape(rows.shape)
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        n_rows, n_cols = self.shape
+        all_rows = isinstance(rows, slice) and rows == slice(None)
+        row_slice, col_slice = isinstance(rows, slice), isinstance(cols, slice)
+        rows, cols = np.arange(n_rows)[rows], np.arange(n_cols)[cols] # also bool, negative and np.ix_ indices
+        if all_rows:
+            return self.__columns(cols.ravel()).reshape(n_rows, *cols.shape)
+        if row_slice and col_slice:
+            rows, cols = rows[:, np.newaxis], cols[np.newaxis]
+        elif row_slice:
+            rows, cols = rows.reshape(-1, *[1]*cols.ndim), cols[np.newaxis]
+        elif col_slice:
+            rows, cols = rows[..., np.newaxis], cols.reshape(*[1]*rows.ndim, -1)
+        return self.__lookup(rows, cols)
+
+    def __array__(self, dtype = None, copy = None):
+        res = self[:, :]
+        return res if dtype is None else res.astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(x) if isinstance(x, TruncatedMatrix) else x for x in inputs]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    __lt__ = lambda self, other : np.less(self, other)
+    __le__ = lambda self, other : np.less_equal(self, other)
+    __gt__ = lambda self, other : np.greater(self, other)
+    __ge__ = lambda self, other : np.greater_equal(self, other)
+    __add__ = __radd__ = lambda self, other : np.add(self, other)
+    __sub__ = lambda self, other : np.subtract(self, other)
+    __rsub__ = lambda self, other : np.subtract(other, self)
+    __mul__ = __rmul__ = lambda self, other : np.multiply(self, other)
+
+
+MAX_BYTES = 1024 * 2**20 # memory limit of the cached models
+
+
+class RegionModel:
+    __models = dict() # cache of models: ((radius, llcw max error), *AGS) -> RegionModel, least recently used first
+    __data_version = None # como.DATA_VERSION the cached models are based on
+
+    muns = property(lambda self : self.__muns) # lst of como.Municipality, fixes the order of all axes
+    key = property(lambda self : self.__key) # digest of radius, llcw setting, data version and the AGS of the region
+    # np.arrays, or TruncatedMatrix if como.RADIUS is set
+    dist = property(lambda self : self.__dist) # (res, cws) travel times in minutes, np.inf if out of como.RADIUS
+    savings = property(lambda self : self.__savings) # (res, cws) saved person minutes if res is served by cws
+    commuters = property(lambda self : self.__commuters) # (res, cws) addressed commuters if res is served by cws
+    workplaces = property(lambda self : self.__workplaces) # flat (res, wpl) pairs sorted by res: res index, travel time, commuters
+    nbytes = property(lambda self : self.__nbytes) # memory of the matrices and workplaces
+
+    def __init__(self, region, base = None):
+        """precomputes travel times, savings and commuters between all municipalities of a region.
+        Row r of savings equals the result of como.assess_savings(cws, [res]) for every cws.
+        If como.RADIUS is set, the matrices are TruncatedMatrix that only store the pairs within the radius.
+
+        Args:
+            region (lst of como.Municipality): the municipalities of the region, in the order used for all matrices
+            base (RegionModel, optional): a model of an overlapping region (same radius, llcw setting and data), e.g.
+                before the user added a county. Its values for municipalities in both regions are reused, so only the
+                rows and columns of the added municipalities are computed. The result is identical to computing all.
+        """
+        self.__muns = list(region)
+        self.__key = hashlib.sha256(repr(((como.RADIUS, como.LLCW_MAX_ERROR, como.DATA_VERSION),
+                                          *(mun.ags for mun in self.muns))).encode('utf-8')).hexdigest()
+        self.__index = {mun.ags: i for i, mun in enumerate(self.muns)}
+        n = len(self.muns)
+        
+        # municipalities known to base (old) and the others (new)
+        in_base = np.array([base.__index.get(mun.ags, -1) if base else -1 for mun in self.muns], dtype = int)
+        old, new = np.flatnonzero(in_base >= 0), np.flatnonzero(in_base < 0)
+
+        # row by row, so that a truncated model never holds a dense matrix
+        truncated = como.RADIUS is not None
+        if truncated:
+            entries = []
+        else:
+            self.__dist, self.__savings, self.__commuters = np.zeros((n, n)), np.zeros((n, n)), np.zeros((n, n))
+        workplaces = [(np.zeros(0, dtype = int), np.zeros(0), np.zeros(0))]
+        for r, res in enumerate(self.muns):
+            dist, savings, commuters = np.zeros(n), np.zeros(n), np.zeros(n)
+            if in_base[r] >= 0: # known to base, only the new cws are computed
+                reused = in_base[r], in_base[old]
+                dist[old], savings[old], commuters[old] = base.dist[reused], base.savings[reused], base.commuters[reused]
+                dist[new] = [como.get_reach(res, self.muns[c]) for c in new]
+                rows = slice(*np.searchsorted(base.workplaces[0], [in_base[r], in_base[r] + 1]))
+                dist_wpl, comm_res_wpl = base.workplaces[1][rows], base.workplaces[2][rows]
+                cws = new
+            else:
+                dist[:] = [como.get_reach(res, mun) for mun in self.muns]
+                dist_wpl = np.array([como.get_dist(res, wpl) for wpl in res.commutes_to])
+                comm_res_wpl = np.array([como.get_commuters(res, wpl) for wpl in res.commutes_to])
+                cws = slice(None)
+            if len(res.commutes_to):
+                workplaces.append((np.full(len(dist_wpl), r), dist_wpl, comm_res_wpl))
+                dist_cws = dist[cws][:, np.newaxis]
+                # same operations as in como.assess_savings, broadcasted over all cws
+                with np.errstate(invalid = 'ignore'): # inf * 0 for cws out of radius
+                    commuters_wpl = como.llcw(dist_cws, dist_wpl) * comm_res_wpl
+                    savings_wpl = como.spcw(dist_cws, dist_wpl) * commuters_wpl
+                savings[cws] = np.sum(savings_wpl, axis = 1)
+                commuters[cws] = np.sum(commuters_wpl, axis = 1)
+            savings[~np.isfinite(dist)] = 0 # out of radius
+            if truncated:
+                cws = np.flatnonzero(np.isfinite(dist))
+                entries.append((cws*n + r, dist[cws], savings[cws], commuters[cws]))
+            else:
+                self.__dist[r], self.__savings[r], self.__commuters[r] = dist, savings, commuters
+        if truncated:
+            keys, dist, savings, commuters = (np.concatenate(arrays) for arrays in zip(*entries))
+            order = np.argsort(keys)
+            pattern = TruncatedMatrix.pattern(keys[order], (n, n))
+            self.__dist = TruncatedMatrix(pattern, dist[order], np.inf)
+            self.__savings = TruncatedMatrix(pattern, savings[order], 0.)
+            self.__commuters = TruncatedMatrix(pattern, commuters[order], 0.)
+            self.__nbytes = self.__dist.nbytes + savings.nbytes + commuters.nbytes # pattern shared
+        else:
+            self.__nbytes = self.__dist.nbytes + self.__savings.nbytes + self.__commuters.nbytes
+        self.__workplaces = tuple(np.concatenate(arrays) for arrays in zip(*workplaces))
+        self.__nbytes += sum(array.nbytes for array in self.__workplaces)
+
+    @classmethod
+    def get(cls, region):
+        """returns the (cached) model of a region for the current como.RADIUS and como.LLCW_MAX_ERROR. The least
+        recently used models are dropped from the cache when the cached models exceed MAX_BYTES.
+
+        Args:
+            region (lst of como.Municipality): the municipalities of the region
+
+        Returns:
+            RegionModel: the model
+        """
+        if cls.__data_version != como.DATA_VERSION: # data reloaded
+            cls.clear()
+            cls.__data_version = como.DATA_VERSION
+        key = ((como.RADIUS, como.LLCW_MAX_ERROR), *(mun.ags for mun in region))
+        model = cls.__models.pop(key, None)
+        if model is None:
+            # extend the cached model that shares the most municipalities, if it covers at least half of the region
+            ags = set(key[1:])
+            overlap = {other: len(ags.intersection(other[1:])) for other in list(cls.__models) if other[0] == key[0]}
+            base = max(overlap, key = overlap.get, default = None)
+            base = cls.__models.get(base) if base and 2*overlap[base] >= len(ags) else None
+            model = cls(region, base)
+        cls.__models[key] = model # most recently used last
+        # summed anew rather than counted, as the sessions of the webapp share the cache in threads
+        while sum(other.nbytes for other in list(cls.__models.values())) > MAX_BYTES and len(cls.__models) > 1:
+            cls.__models.pop(next(iter(cls.__models)), None)
+        return model
+
+    @classmethod
+    def clear(cls):
+        cls.__models.clear()
+
+    def __len__(self):
+        return len(self.muns)
+
+    def index(self, muns):
+        """returns the positions of municipalities (or AGS) in the model as int array"""
+        return np.array([self.__index[getattr(mun, 'ags', mun)] for mun in muns], dtype = int)
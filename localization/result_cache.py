@@ -0,0 +1,108 @@
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+import commuting_model as como
+import capacity
+
+
+# This code stores results that only depend on the region, the existing coworking spaces and the data, such as the heatmap, on disk, so that repeated requests from any session are served without recomputation. Entries are content-addressed: the key is a hash of the region, the fixed coworking spaces and a fingerprint of the loaded data, the model parameters and the model code, so that a change of any of them invalidates the cache automatically. The least recently used entries are evicted when the cache exceeds its size limit.
+
+
+CACHE_DIR = os.path.join(como.ROOT_DIR, 'data', 'cache', 'results')
+MAX_BYTES = 256 * 2**20 # size limit of the cache
+VERSION = 1 # increase if cached results change without a change of data, parameters or model code
+
+_LOCALIZATION_DIR = os.path.dirname(os.path.abspath(como.__file__))
+CODE_FILES = [os.path.join(_LOCALIZATION_DIR, 'commuting_model.py'),
+              os.path.join(_LOCALIZATION_DIR, 'cowork_locations.py'),
+              os.path.join(_LOCALIZATION_DIR, 'capacity.py'),
+              os.path.join(_LOCALIZATION_DIR, 'region_model.py')]
+
+
+def data_version():
+    """fingerprint of everything results depend on besides region and fixed_cws
+
+    Returns:
+        dict: the loaded data (como.DATA_VERSION and the size and modification time of the data files when they were
+        loaded, not as they are now on disk), model parameters, capacities and a hash of the model code
+    """
+    code = hashlib.sha256()
+    for file in CODE_FILES:
+        with open(file, 'rb') as f:
+            code.update(f.read())
+    return {'data_version': como.DATA_VERSION,
+            'files': como.DATA_SNAPSHOT,
+            'code': code.hexdigest(),
+            'coeffs': list(como.COEFFS),
+            'phi': como.PHI,
+            'radius': como.RADIUS,
+            'llcw_max_error': como.LLCW_MAX_ERROR,
+            'capacity': capacity.CAPACITY,
+            'site_capacity': capacity.SITE_CAPACITY,
+            'version': VERSION}
+
+def key(kind, region, fixed_cws):
+    """canonical key of a result
+
+    Args:
+        kind (str): kind of the result, e.g. 'heatmap'
+        region (lst of como.Municipality): the region
+        fixed_cws (lst of como.Municipality): the fixed coworking spaces
+
+    Returns:
+        str: hex digest, independent of the order of region and fixed_cws
+    """
+    content = {'kind': kind,
+               'region': sorted(como.ags(region)),
+               'fixed_cws': sorted(como.ags(fixed_cws)),
+               'data': data_version()}
+    return hashlib.sha256(json.dumps(content, sort_keys = True).encode('utf-8')).hexdigest()
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key + '.parquet')
+
+def load(key):
+    """returns the cached DataFrame or None; a hit marks the entry as recently used"""
+    try:
+        df = pd.read_parquet(_path(key))
+        os.utime(_path(key))
+        return df
+    except (FileNotFoundError, OSError):
+        return None
+
+def store(key, df):
+    """stores a DataFrame (atomically, so concurrent sessions never read partial files) and evicts old entries"""
+    os.makedirs(CACHE_DIR, exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = CACHE_DIR, suffix = '.tmp')
+    os.close(fd)
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, _path(key))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    evict()
+
+def evict(max_bytes = None):
+    """removes the least recently used entries until the cache is not larger than max_bytes (default MAX_BYTES)"""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        entries = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith('.parquet')]
+    except FileNotFoundError:
+        return
+    entries = sorted(((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in entries))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError: # removed by another session
+            pass
+        total -= size
+
+def clear():
+    """removes all entries"""
+    evict(0)
@@ -0,0 +1,310 @@
+import itertools
+import numpy as np
+import pandas as pd
+from scipy.stats import rankdata
+import commuting_model as como
+from region_model import RegionModel
+
+
+# This code evaluates solutions and heatmaps under many parameter sets of the behaviour model (coefficients and precision of `llcw`, metric of `spcw`) at once, e.g. for a sensitivity analysis. Travel times and commuters are taken from the RegionModel of the region and reused for all scenarios; the scenarios form an additional leading axis of the computation, which is processed in chunks to bound the memory.
+#
+# For a Monte Carlo analysis of the uncertainty, `monte_carlo` draws random parameter sets and randomly perturbed commuter numbers. As only the serving coworking space of every municipality matters for a solution, it evaluates just the (residence, workplace, serving cws) triples of the solutions instead of all cws, which makes thousands of samples affordable.
+
+
+METRICS = {'abs': np.abs, 'square': np.square} # names of the metrics for como.spcw
+CHUNK = 2**24 # maximal number of (scenario, residence-workplace pair, cws) values computed at once
+
+
+def parameter_grid(intercept = (como.COEFFS[0],), slope = (como.COEFFS[1],),
+                   phi = (como.PHI,), metric = ('abs',)):
+    """builds all combinations of the given model parameters. Every argument is a list of values;
+    the default is the single value used by como.llcw and como.spcw.
+
+    Args:
+        intercept, slope (lst of float, optional): coefficients of the logistic model in como.llcw
+        phi (lst of float, optional): precision of the beta distribution in como.llcw
+        metric (lst of str, optional): keys of METRICS for como.spcw
+
+    Returns:
+        pd.DataFrame: one row per scenario, indexed by 'Scenario'
+    """
+    assert all(m in METRICS for m in metric), f"unknown metric in {metric}, use one of {list(METRICS)}"
+    grid = pd.DataFrame(itertools.product(intercept, slope, phi, metric),
+                        columns = ['intercept', 'slope', 'phi', 'metric'])
+    grid.index.name = 'Scenario'
+    return grid
+
+def _iter_savings(model, grid, cws):
+    """yields savings and commuters for chunks of scenarios. Within a chunk, the residence-workplace pairs and the cws
+    are processed in blocks as well, so that no more than CHUNK values are computed at once even for one scenario.
+
+    Args:
+        model (RegionModel): the model of the region
+        grid (pd.DataFrame): scenarios as returned by parameter_grid
+        cws (np.array of int): positions of the cws in the model
+
+    Yields:
+        positions of the scenarios in grid, savings and commuters with shape (scenarios, res, cws)
+    """
+    res_idx, dist_wpl, comm_res_wpl = model.workplaces
+    cws = np.asarray(cws, dtype = int)
+    residences, starts = np.unique(res_idx, return_index = True)
+    n_pairs, n_cws = max(len(res_idx), 1), max(len(cws), 1)
+    n_chunk = max(1, CHUNK // (n_pairs * n_cws))
+    cws_block = max(1, min(n_cws, CHUNK // (n_chunk * n_pairs)))
+    pair_block = max(1, CHUNK // (n_chunk * cws_block))
+    # split the pairs at residences, a residence with more than pair_block workplaces is a block of its own
+    bounds = [0]
+    for start, end in zip(starts, np.r_[starts[1:], len(res_idx)]):
+        if end - bounds[-1] > pair_block and start > bounds[-1]:
+            bounds.append(start)
+    bounds.append(len(res_idx))
+    blocks = [(slice(lo, hi), residences[(starts >= lo) & (starts < hi)], starts[(starts >= lo) & (starts < hi)] - lo)
+              for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+    for start in range(0, len(grid), n_chunk):
+        scenarios = np.arange(start, min(start + n_chunk, len(grid)))
+        params = grid.iloc[scenarios]
+        param = lambda col : params[col].to_numpy(dtype = float)[:, np.newaxis, np.newaxis]
+        metrics = {name: (params['metric'] == name).to_numpy() for name in METRICS}
+        savings = np.zeros((len(scenarios), len(model), len(cws)))
+        commuters = np.zeros((len(scenarios), len(model), len(cws)))
+        for pairs, block_res, block_starts in blocks:
+            for c in range(0, len(cws), cws_block):
+                cols = slice(c, c + cws_block)
+                dist_cws = model.dist[np.ix_(res_idx[pairs], cws[cols])]
+                # same operations as in como.assess_savings, broadcasted over scenarios and cws
+                with np.errstate(invalid = 'ignore'): # inf * 0 for cws out of radius
+                    comm = como.llcw(dist_cws, dist_wpl[pairs, np.newaxis],
+                                     coeffs = (param('intercept'), param('slope')),
+                                     phi = param('phi')) * comm_res_wpl[pairs, np.newaxis]
+                    spcw = np.empty_like(comm)
+                    for name, metric in METRICS.items():
+                        spcw[metrics[name]] = como.spcw(dist_cws, dist_wpl[pairs, np.newaxis], metric)
+                    sav = np.where(np.isfinite(dist_cws), spcw * comm, 0)
+                # sum over the workplaces of every residence
+                savings[:, block_res, cols] = np.add.reduceat(sav, block_starts, axis = 1)
+                commuters[:, block_res, cols] = np.add.reduceat(comm, block_starts, axis = 1)
+        yield scenarios, savings, commuters
+
+def _assign(model, locs):
+    """positions of the serving cws for every municipality of the model, like Solution.update; -1 if none is in reach"""
+    dist = model.dist[:, locs]
+    res = np.full(len(model), -1)
+    if len(locs):
+        reach = np.isfinite(dist).any(axis = 1)
+        res[reach] = np.asarray(locs)[np.argmin(dist[reach], axis = 1)]
+    return res
+
+def evaluate(solutions, grid, region = None):
+    """evaluates solutions under all scenarios of a parameter grid. The areas of the solutions do not depend
+    on the model parameters and are kept.
+
+    Args:
+        solutions (lst of Solution or lst of lst of como.Municipality): the solutions
+        grid (pd.DataFrame): scenarios as returned by parameter_grid
+        region (lst of como.Municipality, optional): the region. Defaults to the region of the first solution.
+
+    Returns:
+        pd.DataFrame: indexed by 'Scenario' and 'Solution' (position in solutions), columns are the
+        parameters of the scenario, 'Total saving' and 'Total commuters'
+    """
+    if region is None:
+        region = solutions[0].region
+    model = RegionModel.get(region)
+    locs = [model.index(getattr(sol, 'locs', sol)) for sol in solutions]
+    cws = np.unique(np.concatenate([np.zeros(0, dtype = int), *locs]))
+    col = {c: i for i, c in enumerate(cws)}
+    assigned = np.array([_assign(model, l) for l in locs]).reshape(len(solutions), len(model))
+    served = assigned >= 0
+    columns = np.vectorize(lambda c : col.get(c, 0), otypes = [int])(assigned)
+    rows = np.broadcast_to(np.arange(len(model)), assigned.shape)
+
+    savings = np.zeros((len(grid), len(solutions)))
+    commuters = np.zeros((len(grid), len(solutions)))
+    for scenarios, sav, comm in _iter_savings(model, grid, cws):
+        savings[scenarios] = np.sum(np.where(served, sav[:, rows, columns], 0), axis = 2)
+        commuters[scenarios] = np.sum(np.where(served, comm[:, rows, columns], 0), axis = 2)
+
+    result_df = pd.DataFrame({'Scenario': np.repeat(grid.index, len(solutions)),
+                              'Solution': np.tile(np.arange(len(solutions)), len(grid)),
+                              'Total saving': savings.ravel(),
+                              'Total commuters': commuters.ravel()})
+    result_df = result_df.join(grid, on = 'Scenario')
+    result_df.set_index(['Scenario', 'Solution'], inplace = True)
+    return result_df[[*grid.columns, 'Total saving', 'Total commuters']]
+
+def heatmap(region, fixed_cws, grid):
+    """calculates the heatmap of cowork_locations.heatmap under all scenarios of a parameter grid
+
+    Args:
+        region (lst of AGS): the municipalities of the investigated region
+        fixed_cws (lst of como.Municipality): the municipalities that already host a coworking space
+        grid (pd.DataFrame): scenarios as returned by parameter_grid
+
+    Returns:
+        pd.DataFrame: indexed by 'Scenario' and 'LAU_ID', columns are the parameters of the scenario and
+        'Improvement', the improvement of a new coworking space in that municipality to the status quo ante
+    """
+    region = como.Municipality.dissolve(region)
+    model = RegionModel.get(region)
+    fixed = model.index(fixed_cws)
+    n = len(model)
+
+    # a new cws takes over every municipality to which it is strictly closer than the serving fixed cws
+    ref = _assign(model, fixed)
+    ref_dist = np.where(ref >= 0, model.dist[np.arange(n), ref], np.inf)
+    takeover = model.dist < ref_dist[:, np.newaxis]
+    takeover[:, fixed] = False
+
+    improvement = np.zeros((len(grid), n))
+    for scenarios, sav, _ in _iter_savings(model, grid, np.arange(n)):
+        ref_sav = np.where(ref >= 0, sav[:, np.arange(n), np.maximum(ref, 0)], 0)
+        improvement[scenarios] = np.sum(np.where(takeover, sav - ref_sav[:, :, np.newaxis], 0), axis = 1)
+
+    result_df = pd.DataFrame({'Scenario': np.repeat(grid.index, n),
+                              'LAU_ID': np.tile(como.ags(model.muns), len(grid)),
+                              'Improvement': improvement.ravel()})
+    result_df = result_df.join(grid, on = 'Scenario')
+    result_df.set_index(['Scenario', 'LAU_ID'], inplace = True)
+    return result_df[[*grid.columns, 'Improvement']]
+
+def sample_parameters(n_samples, coeffs_cov = ((0.25**2, 0), (0, 1.**2)), phi_cv = 0.2, rng = None):
+    """draws random parameter sets of como.llcw around its defaults, e.g. for monte_carlo
+
+    Args:
+        n_samples (int): number of parameter sets
+        coeffs_cov (2x2 array, optional): covariance of intercept and slope, which are normally distributed
+            around como.COEFFS. Defaults to standard deviations of 0.25 and 1.
+        phi_cv (float, optional): coefficient of variation of the precision, which is gamma distributed with mean
+            como.PHI. 0 keeps it fixed. Defaults to 0.2.
+        rng (np.random.Generator or seed, optional): random number generator
+
+    Returns:
+        pd.DataFrame: one row per sample with the columns of parameter_grid, indexed by 'Scenario'
+    """
+    rng = np.random.default_rng(rng)
+    coeffs = rng.multivariate_normal(como.COEFFS, coeffs_cov, size = n_samples)
+    phi = rng.gamma(phi_cv**-2, como.PHI*phi_cv**2, size = n_samples) if phi_cv else np.full(n_samples, como.PHI)
+    grid = pd.DataFrame({'intercept': coeffs[:, 0], 'slope': coeffs[:, 1], 'phi': phi, 'metric': 'abs'})
+    grid.index.name = 'Scenario'
+    return grid
+
+def _iter_totals(model, locs, grid, noise):
+    """yields total savings and commuters of solutions for chunks of scenarios
+
+    Args:
+        model (RegionModel): the model of the region
+        locs (lst of np.array of int): positions of the cws of every solution in the model
+        grid (pd.DataFrame): scenarios as returned by parameter_grid or sample_parameters
+        noise (function): noise(n) returns factors of the commuters of every (res, wpl) pair of model.workplaces
+            for n scenarios, shape (n, pairs)
+
+    Yields:
+        positions of the scenarios in grid, total savings and total commuters with shape (scenarios, solutions)
+    """
+    res_idx, dist_wpl, comm_res_wpl = model.workplaces
+    n = len(model)
+    assigned = np.array([_assign(model, l) for l in locs]).reshape(len(locs), n)
+
+    # distinct (res, serving cws) assignments of all solutions and which solutions use them
+    served = np.flatnonzero(assigned.ravel() >= 0)
+    keys, inverse = np.unique((served % n)*n + assigned.ravel()[served], return_inverse = True)
+    usage = np.zeros((len(keys), len(locs)))
+    np.add.at(usage, (inverse, served // n), 1)
+    res, cws = keys // n, keys % n
+
+    # one triple per assignment and workplace of its residence, grouped by assignment
+    starts, ends = np.searchsorted(res_idx, res), np.searchsorted(res_idx, res, side = 'right')
+    counts = ends - starts
+    first = np.cumsum(counts) - counts
+    triple_assignment = np.repeat(np.arange(len(keys)), counts)
+    pair = np.repeat(starts - first, counts) + np.arange(counts.sum())
+    dist_cws = model.dist[res, cws][triple_assignment]
+    dist_wpl, comm_res_wpl = dist_wpl[pair], comm_res_wpl[pair]
+    nonempty = counts > 0
+
+    n_chunk = max(1, CHUNK // max(len(pair), 1))
+    for start in range(0, len(grid), n_chunk):
+        scenarios = np.arange(start, min(start + n_chunk, len(grid)))
+        params = grid.iloc[scenarios]
+        param = lambda col : params[col].to_numpy(dtype = float)[:, np.newaxis]
+        # same operations as in como.assess_savings, broadcasted over scenarios
+        commuters = como.llcw(dist_cws, dist_wpl, coeffs = (param('intercept'), param('slope')), phi = param('phi')) \
+            * comm_res_wpl * noise(len(scenarios))[:, pair]
+        commuters = commuters.reshape(len(scenarios), len(pair))
+        spcw = np.empty_like(commuters)
+        for name, metric in METRICS.items():
+            mask = (params['metric'] == name).to_numpy()
+            spcw[mask] = como.spcw(dist_cws, dist_wpl, metric)
+        savings = spcw * commuters
+
+        def total(values): # sum over the workplaces of every assignment, then over the assignments of every solution
+            res = np.zeros((len(scenarios), len(keys)))
+            if len(pair):
+                res[:, nonempty] = np.add.reduceat(values, first[nonempty], axis = 1)
+            return res @ usage
+        yield scenarios, total(savings), total(commuters)
+
+def monte_carlo(solutions, n_samples = 1000, commuters_cv = 0.1, quantiles = (0.05, 0.5, 0.95),
+                region = None, seed = None, **kwargs):
+    """evaluates solutions under random parameters of como.llcw and random commuter numbers. Every sample perturbs
+    the commuters of every (residence, workplace) pair independently by a gamma distributed factor with mean 1.
+    The areas of the solutions do not depend on the samples and are kept.
+
+    Args:
+        solutions (lst of Solution or lst of lst of como.Municipality): the solutions
+        n_samples (int, optional): number of samples. Defaults to 1000.
+        commuters_cv (float, optional): coefficient of variation of the commuter numbers. 0 keeps them. Defaults to 0.1.
+        quantiles (lst of float, optional): quantiles of the savings to report. Defaults to (0.05, 0.5, 0.95).
+        region (lst of como.Municipality, optional): the region. Defaults to the region of the first solution.
+        seed (int or np.random.Generator, optional): seed of the samples
+        kwargs: arguments of sample_parameters (coeffs_cov, phi_cv)
+
+    Returns:
+        pd.DataFrame: indexed by 'Solution' (position in solutions) with the columns
+        'Total saving' (without perturbation), 'Mean saving', 'Std saving', one column per quantile (e.g. 'Q5 saving'),
+        'Mean commuters', 'Rank' (by total saving, 1 is best), 'Mean rank', 'P rank' (share of samples in which
+        the solution keeps its rank) and 'P best' (share of samples in which it is best).
+        The samples are stored in result_df.attrs['samples'], indexed by 'Scenario' and 'Solution' with the
+        parameters, 'Total saving' and 'Total commuters' of every sample.
+    """
+    if region is None:
+        region = solutions[0].region
+    rng = np.random.default_rng(seed)
+    model = RegionModel.get(region)
+    locs = [model.index(getattr(sol, 'locs', sol)) for sol in solutions]
+    n_pairs = len(model.workplaces[0])
+
+    _, point, _ = next(_iter_totals(model, locs, parameter_grid(), lambda n : np.ones((n, n_pairs))))
+    grid = sample_parameters(n_samples, rng = rng, **kwargs)
+    if commuters_cv:
+        noise = lambda n : rng.gamma(commuters_cv**-2, commuters_cv**2, size = (n, n_pairs))
+    else:
+        noise = lambda n : np.ones((n, n_pairs))
+    savings = np.zeros((n_samples, len(solutions)))
+    commuters = np.zeros((n_samples, len(solutions)))
+    for scenarios, sav, comm in _iter_totals(model, locs, grid, noise):
+        savings[scenarios], commuters[scenarios] = sav, comm
+
+    # ranks by saving, 1 is best; ties get the better rank
+    rank = rankdata(-point[0], method = 'min')
+    sample_ranks = rankdata(-savings, method = 'min', axis = 1)
+    result_df = pd.DataFrame({'Total saving': point[0],
+                              'Mean saving': savings.mean(axis = 0),
+                              'Std saving': savings.std(axis = 0),
+                              **{f"Q{100*q:g} saving": np.quantile(savings, q, axis = 0) for q in quantiles},
+                              'Mean commuters': commuters.mean(axis = 0),
+                              'Rank': rank,
+                              'Mean rank': sample_ranks.mean(axis = 0),
+                              'P rank': np.mean(sample_ranks == rank, axis = 0),
+                              'P best': np.mean(sample_ranks == 1, axis = 0)})
+    result_df.index.name = 'Solution'
+
+    samples = pd.DataFrame({'Scenario': np.repeat(grid.index, len(solutions)),
+                            'Solution': np.tile(np.arange(len(solutions)), n_samples),
+                            'Total saving': savings.ravel(),
+                            'Total commuters': commuters.ravel()})
+    samples = samples.join(grid, on = 'Scenario').set_index(['Scenario', 'Solution'])
+    result_df.attrs['samples'] = samples[[*grid.columns, 'Total saving', 'Total commuters']]
+    return result_df
@@ -0,0 +1,306 @@
+import sys
+import json
+import hashlib
+import asyncio
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+from http import HTTPStatus
+import numpy as np
+import commuting_model as como
+import cowork_locations as coloc
+import export
+
+
+# This code serves the optimisation engine over HTTP for other local tools, e.g. GIS dashboards or notebooks. It is a small asyncio server that only uses the standard library. CPU work runs in a process pool whose workers keep the model data loaded. Identical requests (same endpoint, region, fixed coworking spaces, parameters and seed) that arrive while one of them is computed are coalesced into that one computation. With ?stream=1 the response is a stream of JSON lines with the progress of the computation, followed by the result.
+#
+# usage: python localization/service.py [--host 127.0.0.1] [--port 8765] [--workers N] [--llcw-error 1e-4]
+#
+# Endpoints (POST with a JSON body, answers are JSON):
+# /kLocs, /genetic_algorithm, /annealing : {"region": [...], "fixed_cws": [...], "n_new": 5, "seed": 1, "params": {...}}
+# /heatmap : {"region": [...], "fixed_cws": [...]}
+# /evaluate : {"region": [...], "fixed_cws": [...], "locs": [[AGS, ...], ...]}
+# /health (GET)
+# Every POST body may set "llcw_error", the maximal error of the llcw lookup table (como.set_llcw_table); it defaults to --llcw-error.
+
+
+ENDPOINTS = ('kLocs', 'genetic_algorithm', 'annealing', 'heatmap', 'evaluate')
+# required and optional keys of params per optimizer
+PARAMS = {'kLocs': ((), ('max_steps', 'time_budget', 'rel_tol')),
+          'genetic_algorithm': (('n_pop', 'n_gen', 'p_survive', 'p_mut'),
+                                ('n_best', 'time_budget', 'patience', 'rel_tol')),
+          'annealing': ((), ('n_moves', 'temp', 'temp_ratio', 'tabu', 'time_budget', 'patience', 'n_reports'))}
+
+def _json(obj):
+    """serializes results containing numpy values"""
+    def default(o):
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        if isinstance(o, np.generic):
+            return o.item()
+        return str(o)
+    return json.dumps(obj, default = default)
+
+def canonical(endpoint, body, llcw_error = None):
+    """the request as it is computed: defaults filled in, order of region and fixed_cws irrelevant
+
+    Args:
+        endpoint (str): one of ENDPOINTS
+        body (dict): the JSON body of the request
+        llcw_error (float, optional): llcw_error if the body does not set it. Defaults to exact.
+
+    Returns:
+        dict: the canonical request; raises KeyError or ValueError for invalid requests
+    """
+    if endpoint not in ENDPOINTS:
+        raise ValueError(f"unknown endpoint {endpoint}")
+    if isinstance(body['region'], str):
+        raise TypeError(f"region must be a list of AGS")
+    request = {'endpoint': endpoint,
+               'region': sorted(str(ags) for ags in body['region']),
+               'fixed_cws': sorted(str(ags) for ags in body.get('fixed_cws', [])),
+               'llcw_error': body.get('llcw_error', llcw_error)}
+    all_ags = list(como.Municipality.get_mundict())
+    unknown = [prefix for prefix in request['region'] if not any(ags.startswith(prefix) for ags in all_ags)]
+    if unknown or not request['region']:
+        raise ValueError(f"region must be AGS or prefixes of municipalities, unknown are {unknown}")
+    unknown = [ags for ags in request['fixed_cws'] if not como.Municipality.get([ags])]
+    if unknown:
+        raise ValueError(f"unknown municipalities {unknown}")
+    if request['llcw_error'] is not None:
+        request['llcw_error'] = float(request['llcw_error'])
+        if not request['llcw_error'] > 0:
+            raise ValueError(f"llcw_error must be positive or None")
+    if endpoint in PARAMS:
+        request.update({'n_new': int(body['n_new']),
+                        'seed': body.get('seed'),
+                        'params': dict(body.get('params', {}))})
+        required, optional = PARAMS[endpoint]
+        unknown = sorted(set(request['params']) - set(required) - set(optional))
+        missing = sorted(set(required) - set(request['params']))
+        if unknown or missing:
+            raise ValueError(f"params of {endpoint}: unknown {unknown}, missing {missing}")
+    elif endpoint == 'evaluate':
+        request['locs'] = [[str(ags) for ags in row] for row in body['locs']]
+        region = tuple(request['region'])
+        outside = sorted({ags for row in [request['fixed_cws'], *request['locs']] for ags in row
+                          if not como.Municipality.get([ags]) or not ags.startswith(region)})
+        if outside:
+            raise ValueError(f"unknown municipalities or not in the region {outside}")
+        if not request['locs'] or len({len(row) for row in request['locs']}) > 1:
+            raise ValueError(f"locs must be rows of the same length")
+    return request
+
+def request_key(request):
+    return hashlib.sha256(json.dumps(request, sort_keys = True).encode('utf-8')).hexdigest()
+
+
+# worker side ---------------------------------------------------------------
+
+_queue = None # progress events (key, value, text) to the server, set in every worker
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+class _Progress:
+    """progress bar interface of the optimizers, forwarding to the server"""
+    def __init__(self, key):
+        self.key = key
+
+    def progress(self, value, text = ''):
+        _queue.put((self.key, float(value), text))
+
+def _compute(key, request):
+    """runs a canonical request in a worker process and returns a JSON serializable result"""
+    como.set_llcw_table(request['llcw_error']) # global in the process, which runs one request at a time
+    fixed_cws = como.Municipality.get(request['fixed_cws'])
+    endpoint = request['endpoint']
+    if endpoint == 'evaluate':
+        result_df = coloc.evaluate_many(request['region'], fixed_cws,
+                                        [como.Municipality.get(row) for row in request['locs']], areas = True)
+        return result_df.to_dict('records')
+    if endpoint == 'heatmap':
+        result_df = coloc.heatmap(request['region'], fixed_cws, progress = _Progress(key))
+        return export.heatmap_table(result_df).reset_index().to_dict('records')
+    # saving of the fixed coworking spaces alone, the genetic algorithm reports its progress relative to it
+    ref_saving = coloc.Solution(region = request['region'], fixed_cws = fixed_cws, locs = fixed_cws).total_saving \
+        if fixed_cws else 0
+    result_df = getattr(coloc, endpoint)(region = request['region'], fixed_cws = fixed_cws,
+                                         n_cws = len(fixed_cws) + request['n_new'], seed = request['seed'],
+                                         progress = _Progress(key), ref_saving = ref_saving, **request['params'])
+    best = max(result_df['Solution'])
+    return {'stop_reason': result_df.attrs.get('stop_reason'),
+            'total_saving': best.total_saving,
+            'total_commuters': best.total_commuters,
+            'locs': como.ags(best.locs),
+            'areas': export.solution_table(result_df[result_df['Solution'] == best].iloc[[0]])
+                .reset_index().to_dict('records'),
+            'history': [sol.total_saving for sol in result_df['Solution']]}
+
+
+# server side ---------------------------------------------------------------
+
+class _Job:
+    """a computation with all requests waiting for it"""
+    def __init__(self):
+        self.events = [] # progress events, replayed to late subscribers
+        self.changed = asyncio.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.waiting = 1 # number of requests
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+class Service:
+    def __init__(self, workers = None, llcw_error = None):
+        self.__llcw_error = llcw_error # default of requests without llcw_error
+        self.__queue = multiprocessing.get_context().Queue()
+        self.__pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                                                             initargs = (self.__queue,))
+        self.__jobs = dict() # in-flight computations: request key -> _Job
+        self.stats = {'requests': 0, 'computations': 0, 'coalesced': 0}
+
+    def __pump(self, loop):
+        """forwards progress events from the workers to the jobs (runs in a thread)"""
+        while True:
+            event = self.__queue.get()
+            if event is None:
+                break
+            loop.call_soon_threadsafe(self.__progress, *event)
+
+    def __progress(self, key, value, text):
+        job = self.__jobs.get(key)
+        if job is not None:
+            job.events.append({'progress': value, 'text': text})
+            asyncio.ensure_future(job.notify())
+
+    async def __run(self, key, request, job):
+        try:
+            job.result = await asyncio.get_running_loop().run_in_executor(self.__pool, _compute, key, request)
+        except Exception as e:
+            job.error = repr(e)
+        finally:
+            job.done = True
+            del self.__jobs[key]
+            await job.notify()
+
+    def submit(self, request):
+        """returns the job computing a canonical request, starting it unless an identical one is in flight"""
+        self.stats['requests'] += 1
+        key = request_key(request)
+        if key in self.__jobs:
+            self.stats['coalesced'] += 1
+            job = self.__jobs[key]
+            job.waiting += 1
+            return job, True
+        self.stats['computations'] += 1
+        job = self.__jobs[key] = _Job()
+        asyncio.ensure_future(self.__run(key, request, job))
+        return job, False
+
+    async def events(self, job):
+        """yields the progress events of a job and finally the result or error"""
+        seen = 0
+        while True:
+            async with job.changed:
+                await job.changed.wait_for(lambda : job.done or len(job.events) > seen)
+            for event in job.events[seen:]:
+                yield event
+            seen = len(job.events)
+            if job.done:
+                yield {'error': job.error} if job.error else {'result': job.result}
+                return
+
+    async def handle(self, reader, writer):
+        """answers one HTTP request per connection"""
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, value = line.decode('latin-1').split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            path, _, query = target.partition('?')
+            endpoint = path.strip('/')
+
+            if method == 'GET' and endpoint == 'health':
+                return await self.respond(writer, HTTPStatus.OK,
+                                          {'status': 'ok', 'in_flight': len(self.__jobs),
+                                           'data_version': como.DATA_VERSION, **self.stats})
+            if method != 'POST' or endpoint not in ENDPOINTS:
+                return await self.respond(writer, HTTPStatus.NOT_FOUND, {'error': f"no endpoint {method} {path}"})
+            try:
+                request = canonical(endpoint, json.loads(body or b'{}'), self.__llcw_error)
+            except (KeyError, ValueError, TypeError) as e:
+                return await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': repr(e)})
+
+            job, coalesced = self.submit(request)
+            extra = {'X-Coalesced': str(int(coalesced))}
+            if 'stream=1' in query.split('&'):
+                await self.stream(writer, self.events(job), extra)
+            else:
+                async for event in self.events(job):
+                    pass
+                status = HTTPStatus.INTERNAL_SERVER_ERROR if 'error' in event else HTTPStatus.OK
+                await self.respond(writer, status, event, extra)
+        except (ValueError, asyncio.IncompleteReadError):
+            await self.respond(writer, HTTPStatus.BAD_REQUEST, {'error': 'malformed request'})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, obj, headers = {}):
+        payload = _json(obj).encode('utf-8')
+        head = [f"HTTP/1.1 {status.value} {status.phrase}", 'Content-Type: application/json',
+                f"Content-Length: {len(payload)}", 'Connection: close',
+                *(f"{name}: {value}" for name, value in headers.items())]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+
+    @staticmethod
+    async def stream(writer, events, headers = {}):
+        """chunked response of JSON lines"""
+        head = ['HTTP/1.1 200 OK', 'Content-Type: application/x-ndjson', 'Transfer-Encoding: chunked',
+                'Connection: close', *(f"{name}: {value}" for name, value in headers.items())]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        async for event in events:
+            line = (_json(event) + '\n').encode('utf-8')
+            writer.write(f"{len(line):X}\r\n".encode('latin-1') + line + b'\r\n')
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def serve(self, host = '127.0.0.1', port = 8765):
+        loop = asyncio.get_running_loop()
+        pump = threading.Thread(target = self.__pump, args = (loop,), daemon = True)
+        pump.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"serving on http://{host}:{port}", flush = True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.__queue.put(None)
+            self.__pool.shutdown(cancel_futures = True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serves the coworking space optimisation over HTTP.')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'address to listen on (default: local only)')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--workers', type = int, default = None, help = 'worker processes (default: all processors)')
+    parser.add_argument('--llcw-error', type = float, default = None,
+                        help = 'interpolate llcw in a lookup table with this maximal error in the requests '
+                               'that do not set llcw_error (default: exact)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(Service(args.workers, args.llcw_error).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
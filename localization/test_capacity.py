@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+try:
+    import commuting_model as como
+    import cowork_locations as coloc
+    import capacity
+except FileNotFoundError: # the data files are not part of the repository
+    pytest.skip("commuter and municipality data not available", allow_module_level = True)
+
+
+# This code tests that limited capacities never place two coworking spaces in the same municipality, although the areas of coworking spaces overlap when a municipality is split between them.
+
+
+@pytest.fixture
+def region():
+    # neighbouring municipalities, the first ones by AGS
+    region = [mun for _, mun in sorted(como.Municipality.get_mundict().items())][:100]
+    capacity.set_capacity(5)
+    yield region
+    capacity.set_capacity()
+
+def unique(solution):
+    return len({mun.ags for mun in solution.locs}) == solution.n_cws
+
+def test_step_unique_locs(region):
+    for seed in range(60):
+        sol = coloc.Solution(region, n_cws = 8, rng = np.random.default_rng(seed))
+        for _ in range(3):
+            sol.step()
+            assert unique(sol), f"seed {seed}: {sol.locs}"
+
+def test_klocs_unique_locs(region):
+    for seed in range(10):
+        result = coloc.kLocs(seed = seed, region = region, n_cws = 8)
+        assert all(unique(sol) for sol in result.Solution), f"seed {seed}"
@@ -6,13 +6,14 @@ import commuting_model as como
 
 # This part of the code utilizes the Folium library to generate interactive maps, visualizing the results of a commuting optimization model. It includes functions to plot coworking spaces, municipalities, areas of influence, and a heatmap representing potential time savings in commuting.
 
-def generate_colors(x):
-    red, green, blue = np.random.randint(0,255, 3)
+def generate_colors(x, rng = None):
+    rng = np.random.default_rng(rng)
+    red, green, blue = rng.integers(0,255, 3)
     previous = np.array([[red, green, blue]])
     color_hex = "#{:02X}{:02X}{:02X}".format(red, green, blue)
     yield color_hex
     while True:
-        candidates = np.random.randint(0,255,(x,3))
+        candidates = rng.integers(0,255,(x,3))
         red, green, blue = candidates[np.argmax(
             [min(np.linalg.norm(candidate - previous, axis = 1)) for candidate in candidates])]
         previous = np.append(previous, np.array([[red,green,blue]]), axis = 0)
@@ -79,10 +80,10 @@ def plot_solution(solution, region_df):
     # add Einzugsgebiete
     def assign_cws(lau_id):
         condition = [lau_id in [mun.ags for mun in area] for area in solution.areas]
-        return np.where(condition)[0][0]
+        return np.where(condition)[0][0] if any(condition) else -1 # -1: no cws in reach
     
     region_df['belongs_to'] = [assign_cws(lau_id) for lau_id in region_df['LAU_ID']]
-    new_df = region_df.dissolve(by='belongs_to')   
+    new_df = region_df[region_df['belongs_to'] >= 0].dissolve(by='belongs_to')   
     folium.GeoJson(
         data = new_df,
         style_function = style_Einzugsgebiete
@@ -129,11 +130,50 @@ def plot_heatmap(res_heatmap, region_df):
 
     folium.LayerControl().add_to(m)
     
-    solexample = res_heatmap.loc[0].Solution
-    for cws in solexample.fixed_cws:
+    for cws in como.Municipality.get(res_heatmap.attrs['fixed_cws']):
         folium.Marker(cws.coord,
                         icon=folium.Icon(color = 'lightgray'),
                         tooltip = cws
                         ).add_to(m) 
          
     return m
+
+def plot_partners(res_pairs, region_df, n_pairs = 10):
+    """plots the improvement of every municipality together with its best partner and connects the n_pairs best pairs"""
+    meanloc = np.mean(como.Municipality.coords(res_pairs.LAU), axis = 0)
+    m = folium.Map(location=meanloc, zoom_start=9)
+
+    folium.Choropleth(
+        geo_data=region_df,
+        data=res_pairs,
+        columns=["LAU_ID", "Pair improvement"],
+        key_on="feature.properties.LAU_ID",
+        fill_color="OrRd",
+        fill_opacity=0.8,
+        line_opacity=0.4,
+        legend_name="Potentiell gesparte zusätzliche Personenminuten mit bestem Partner",
+    ).add_to(m)
+
+    folium.LayerControl().add_to(m)
+    
+    for cws in como.Municipality.get(res_pairs.attrs['fixed_cws']):
+        folium.Marker(cws.coord,
+                        icon=folium.Icon(color = 'lightgray'),
+                        tooltip = cws
+                        ).add_to(m) 
+    
+    for pair in res_pairs.attrs['pairs'].head(n_pairs).itertuples(index = False):
+        a, b = como.Municipality.get(pair[0]), como.Municipality.get(pair[1])
+        folium.PolyLine([a.coord, b.coord],
+                        color = 'blue',
+                        weight = 3,
+                        tooltip = f"{a} + {b}: {'{:0,.2f}'.format(pair[2])} Personenminuten\
+                            (Wechselwirkung {'{:0,.2f}'.format(pair[3])})").add_to(m)
+        for mun in (a, b):
+            folium.CircleMarker(mun.coord,
+                                fillColor = 'blue',
+                                color = None,
+                                fill_opacity = 1,
+                                radius = 5,
+                                tooltip = mun).add_to(m)
+    return m
@@ -9,9 +9,6 @@ import folium
 
 import commuting_model as como
 import cowork_locations as coloc
-import visualization_utils
-from importlib import reload
-reload(visualization_utils)
 import visualization_utils as wizard
 
 # The code is based on the Streamlit web application for the Commuter-based Coworking Space Localization (CoCoLoc) project. It initializes various libraries and modules, loads geographical and demographic data, and allows users to specify parameters for the analysis, such as selected counties and existing coworking spaces. Once the user confirms their input, the code visualizes the selected regions and existing coworking spaces on a map using Folium and prompts the user to proceed with optimization on pages related to K-Medoids or Genetic Algorithm.
@@ -19,6 +16,7 @@ import visualization_utils as wizard
 
 
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+STATES = ("01",) # AGS prefixes of the federal states that can be selected, e.g. ("01", "02") or ("",) for Germany
 
 st.set_page_config(page_title='RealWork-WebApp')
 st.title('Commuterbased Coworkingspace Localization', anchor=None)
@@ -50,7 +48,7 @@ st.session_state["county_df"] = county_df
 @st.cache_data
 def load_geodata(file):
     res = gpd.read_file(ROOT_DIR + file, dtype = {'LAU_ID': str})
-    res = res[[e.startswith("01") for e in res['LAU_ID']]]
+    res = res[[e.startswith(STATES) for e in res['LAU_ID']]]
     res = res.reset_index()
         
     return res
@@ -58,8 +56,19 @@ def load_geodata(file):
 shape_df = load_geodata('/data/processed/GeoData/Germany.shp')
 st.session_state["shape_df"] = shape_df
 
+# The model data (commuting_model) is loaded once per server process on import and shared by all sessions.
+# Administrators (environment variable REALWORK_ADMIN set) can reload it after the data files changed.
+if os.environ.get('REALWORK_ADMIN'):
+    with st.sidebar.expander("Administration"):
+        if st.button("Modelldaten neu laden",
+                     help="Liest Pendler, Gemeinden und Reisezeiten neu ein. Gilt für alle Sitzungen."):
+            with st.spinner("Die Modelldaten werden neu geladen."):
+                como.load_data()
+                st.cache_data.clear()
+            st.success(f"Modelldaten neu geladen (Version {como.DATA_VERSION}).")
+
 if not 'seed' in st.session_state:
-    st.session_state['seed'] = np.random.randint(999999)
+    st.session_state['seed'] = int(np.random.default_rng().integers(999999))
 
 with st.form("my_form"):
     #Entscheidungsvariablen 
@@ -7,17 +7,10 @@ import pickle
 import folium
 from streamlit_folium import st_folium
 
-import commuting_model
-import cowork_locations
-import visualization_utils
-from importlib import reload
-
-# reloading own modules
-from importlib import reload
-reload(commuting_model); reload(cowork_locations);reload(visualization_utils)
 import commuting_model as como
 import cowork_locations as coloc
 import visualization_utils as wizard
+import export
 
 
 # The code utilises the K-Medoids algorithm for coworking space (CWS) placement optimization, allowing users to input parameters such as the number of new CWS to be placed, seed for result reproducibility, and visualizing the results, including potential time savings and commuters addressed.
@@ -46,6 +39,15 @@ if 'base_solution' in st.session_state:
                             help="Diese Zahl dient der Reproduzierbarkeit der Ergebnisse. Im Zweifel belassen Sie die Default-Eingabe.")  
         st.session_state['seed'] = seed
         
+        time_budget = st.number_input('##### Maximale Rechenzeit in Sekunden',
+                                      value=0, min_value=0, max_value=3600,
+                                      help="Nach Ablauf dieser Zeit wird die bis dahin beste Lösung ausgegeben. 0 bedeutet unbegrenzt.")
+        
+        warm = st.checkbox('Vorheriges Ergebnis als Start verwenden', value = False, disabled = 'res_kmed' not in st.session_state,
+                           help="Die Standorte des letzten Ergebnisses dieser Seite, die noch im Gebiet liegen, werden übernommen\
+                               und nur fehlende ergänzt. Nach kleinen Änderungen an Gebiet oder bestehenden CWS ist die\
+                               Berechnung so meist schneller fertig.")
+        
         submitted = st.form_submit_button("Bestätigung und Neuberechnung")
 
         if submitted:
@@ -53,7 +55,10 @@ if 'base_solution' in st.session_state:
                 
                 st.session_state['res_kmed'] = coloc.kLocs(**st.session_state["problem_statement"],
                                             n_cws = st.session_state['base_solution'].n_cws + n_tbp,
-                                            seed = seed)
+                                            seed = seed,
+                                            time_budget = time_budget or None,
+                                            warm_start = st.session_state['res_kmed'] if warm else None)
+                st.markdown(coloc.STOP_REASONS[st.session_state['res_kmed'].attrs['stop_reason']])
                 
                 # with open('.../co2work/code/pynbs/Results_K_Med.pickle', 'wb') as handle:
                 #     pickle.dump(Results_K_Med, handle, protocol=pickle.HIGHEST_PROTOCOL) 
@@ -73,34 +78,16 @@ if 'base_solution' in st.session_state:
                     
         # Download-Area
         st.subheader("Download")
-        dl_kmed = []
-        for index, row in st.session_state['res_kmed'].iterrows():
-            for i in range(row.Solution.n_cws):
-                dl_kmed.append(
-                    
-                    [
-                        index,
-                        i,
-                        row.Solution.locs[i].name,
-                        row.Solution.areas[i],                                
-                        row.Solution.area_savings[i],
-                        row.Solution.area_commuters[i],                                                        
-                    ]
-                )
-        dl_kmed = pd.DataFrame(dl_kmed,
-                                columns = [
-                                    'Schritt',
-                                    'Cluster',
-                                    'CWS',
-                                    'Einzugsgebiet',
-                                    'Pot. gesparte Personenminuten',
-                                    'Pot. addressierte Pendler'
-                                    ])
-        dl_kmed.set_index(['Schritt', 'Cluster'], inplace = True)
-        csv = dl_kmed.to_csv(float_format='%.4f').encode('utf-8')
-        st.download_button("CSV-Download",csv,
-                        "Ergebnis_KMedoids.csv","text/csv",
-                        key='download-kmed-csv')
+        fmt = st.selectbox('Format', export.FORMATS, key = 'format-kmed',
+                           help = "GeoJSON und GeoPackage enthalten zusätzlich die Einzugsgebiete als Polygone.")
+        if st.button("Export erstellen", key = 'export-kmed'):
+            with st.spinner("Der Export wird erstellt."):
+                ext, mime = export.FORMATS[fmt]
+                st.download_button(f"{fmt}-Download",
+                                   export.solutions(st.session_state['res_kmed'].rename_axis(['Schritt']),
+                                                    st.session_state["region_df"], fmt),
+                                   f"Ergebnis_KMedoids.{ext}", mime,
+                                   key='download-kmed')
 else:
     st.markdown(f"**Diese Seite steht erst zur Verfügung,\
         wenn die Eingaben auf der Startseite getätigt wurden.**")
@@ -9,8 +9,9 @@ from streamlit_folium import st_folium
 import commuting_model as como
 import cowork_locations as coloc
 import visualization_utils as wizard
+import export
 
-# The code implements a genetic algorithm to optimize the placement of coworking spaces in selected regions based on specified parameters and constraints, allowing users to input and customize various parameters, visualize and analyze the results through interactive elements, and download the results in CSV format.
+# The code implements a genetic algorithm to optimize the placement of coworking spaces in selected regions based on specified parameters and constraints, allowing users to input and customize various parameters, visualize and analyze the results through interactive elements, and download the results as CSV, Parquet, GeoJSON or GeoPackage.
 
 
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
@@ -52,6 +53,19 @@ if 'base_solution' in st.session_state:
                             help="Diese Zahl dient der Reproduzierbarkeit der Ergebnisse. Im Zweifel belassen Sie die Default-Eingabe.")  
         st.session_state['seed'] = seed
         
+        time_budget = st.number_input('##### Maximale Rechenzeit in Sekunden',
+                                      value=0, min_value=0, max_value=3600,
+                                      help="Nach Ablauf dieser Zeit wird die bis dahin beste Lösung ausgegeben. 0 bedeutet unbegrenzt.")
+        patience = st.number_input('##### Generationen ohne Verbesserung bis zum Abbruch',
+                                   value=0, min_value=0, max_value=50,
+                                   help="Verbessert sich weder die beste noch die mittlere Lösung über so viele Generationen,\
+                                       wird der Algorithmus vorzeitig beendet. 0 bedeutet kein vorzeitiger Abbruch.")
+        
+        warm = st.checkbox('Vorheriges Ergebnis als Start verwenden', value = False, disabled = 'res_ga' not in st.session_state,
+                           help="Die Standorte des letzten Ergebnisses dieser Seite, die noch im Gebiet liegen, werden übernommen\
+                               und nur fehlende ergänzt. Nach kleinen Änderungen an Gebiet oder bestehenden CWS ist die\
+                               Berechnung so meist schneller fertig.")
+        
         submitted = st.form_submit_button("Bestätigung und Neuberechnung")
 
         if submitted:
@@ -66,9 +80,12 @@ if 'base_solution' in st.session_state:
                                         fixed_cws = st.session_state['existing_cws'],
                                         n_cws = st.session_state['n_exist'] + n_tbp,
                                         progress = my_bar,
-                                        ref_saving = st.session_state['base_solution'].total_saving)
+                                        ref_saving = st.session_state['base_solution'].total_saving,
+                                        time_budget = time_budget or None,
+                                        patience = patience or None,
+                                        warm_start = st.session_state['res_ga'] if warm else None)
                 st.session_state['res_ga'] = res_ga
-                st.markdown('Berechnung abgeschlossen.')
+                st.markdown('Berechnung abgeschlossen. ' + coloc.STOP_REASONS[res_ga.attrs['stop_reason']])
             
     if 'res_ga' in st.session_state:       
         st.subheader("Ergebnisse")
@@ -103,35 +120,16 @@ if 'base_solution' in st.session_state:
                     
         # Download-Area
         st.subheader("Download")
-        dl_ga = []
-        for index, row in st.session_state['res_ga'].iterrows():
-            for i in range(row.Solution.n_cws):
-                dl_ga.append(                    
-                    [
-                        index[0],
-                        index[1],
-                        i,
-                        row.Solution.locs[i].name,
-                        row.Solution.areas[i],                                
-                        row.Solution.area_savings[i],
-                        row.Solution.area_commuters[i],                                                        
-                    ]
-                )
-        dl_ga = pd.DataFrame(dl_ga,
-                             columns = [
-                                 'Generation',
-                                 'Platzierung',
-                                 'Cluster',
-                                 'CWS',
-                                 'Einzugsgebiet',
-                                 'Pot. gesparte Personenminuten',
-                                 'Pot. addressierte Pendler'
-                                 ])
-        dl_ga.set_index(['Generation', 'Platzierung', 'Cluster'], inplace = True)
-        csv = dl_ga.to_csv(float_format='%.4f').encode('utf-8')
-        st.download_button("CSV-Download",csv,
-                           "Ergebnis_GeneticAlgorithm.csv","text/csv",
-                           key='download-ga-csv')
+        fmt = st.selectbox('Format', export.FORMATS, key = 'format-ga',
+                           help = "GeoJSON und GeoPackage enthalten zusätzlich die Einzugsgebiete als Polygone.")
+        if st.button("Export erstellen", key = 'export-ga'):
+            with st.spinner("Der Export wird erstellt."):
+                ext, mime = export.FORMATS[fmt]
+                st.download_button(f"{fmt}-Download",
+                                   export.solutions(st.session_state['res_ga'].rename_axis(['Generation', 'Platzierung']),
+                                                    st.session_state["region_df"], fmt),
+                                   f"Ergebnis_GeneticAlgorithm.{ext}", mime,
+                                   key='download-ga')
                     
 else:
     st.markdown(f"**Diese Seite steht erst zur Verfügung,\
@@ -8,8 +8,9 @@ from streamlit_folium import st_folium
 import commuting_model as como
 import cowork_locations as coloc
 import visualization_utils as wizard
+import export
 
-# This code performs and visualizes computations related to commuting and coworking locations, presenting a heatmap of improvements in commuting with additional coworking spaces based on user-selected input. The application includes options for recalculation, visualization, and CSV download, contingent upon certain input conditions.
+# This code performs and visualizes computations related to commuting and coworking locations, presenting a heatmap of improvements in commuting with additional coworking spaces based on user-selected input. The application includes options for recalculation, visualization, and download as CSV, Parquet, GeoJSON or GeoPackage, contingent upon certain input conditions.
 
 
 st.title('RealWork-WebApp', anchor=None)
@@ -21,6 +22,8 @@ st.markdown('Es wurde für jeden zusätzlichen CWS im Kandidatenset\
 #Überprüfen der Vorraussetzungen
 if 'base_solution' in st.session_state:
     with st.form("my_form"):
+        partners = st.checkbox('Beste Partnerstandorte berechnen',
+                               help="Zusätzlich wird für jede Gemeinde der zweite neue CWS bestimmt, mit dem zusammen die größte Verbesserung erreicht wird. Nahe beieinander liegende Standorte teilen sich ihre Pendler (Kannibalisierung).")
         submitted = st.form_submit_button("Neuberechnung")
         
         if submitted:        
@@ -31,7 +34,14 @@ if 'base_solution' in st.session_state:
                                     st.session_state["existing_cws"],
                                     progress = my_bar)
                 st.session_state['res_hm'] = res_hm
-                st.markdown('Berechnung abgeschlossen.')    
+                st.markdown('Ergebnis aus dem Zwischenspeicher geladen.' if res_hm.attrs['cached']
+                            else 'Berechnung abgeschlossen.')    
+                if partners:
+                    st.session_state['res_pairs'] = coloc.pair_heatmap(st.session_state["selected_counties"],
+                                                                       st.session_state["existing_cws"],
+                                                                       progress = my_bar)
+                else:
+                    st.session_state.pop('res_pairs', None)
     
     if 'res_hm' in st.session_state:
         #Ausgabe der Visualisierung
@@ -43,16 +53,30 @@ if 'base_solution' in st.session_state:
                                     st.session_state["region_df"])
                 
                 st_data = st_folium(m, width=725, key = hash(3423))
+        
+        if 'res_pairs' in st.session_state:
+            st.subheader("Beste Partnerstandorte:")
+            st.markdown('Färbung nach der Verbesserung jeder Gemeinde zusammen mit ihrem besten Partner;\
+                        die besten Paare sind verbunden. Die Wechselwirkung gibt an, wie viel die beiden\
+                        Standorte gegenüber der Summe ihrer einzelnen Verbesserungen verlieren.')
+            with st.form("pairs_form"):
+                submitted = st.form_submit_button("Visualisierung der Partnerstandorte")
+                if submitted:
+                    m = wizard.plot_partners(st.session_state['res_pairs'],
+                                             st.session_state["region_df"])
+                    st_data = st_folium(m, width=725, key = hash(3424))
+            st.dataframe(st.session_state['res_pairs'].attrs['pairs'].head(20))
         #Download-Area
         st.subheader("Download")
-        df = st.session_state['res_hm'][["LAU_ID", "LAU", "Improvement"]]
-        df.rename(columns={'LAU_ID': 'AGS', 'LAU': 'Gemeinde', 'Improvement': 'Verbesserung'}, 
-                inplace = True)
-        df.set_index('AGS', inplace = True)
-        csv = df.to_csv().encode('utf-8')
-        st.download_button("CSV-Download",csv,
-                        "Ergebnis_Heatmap.csv","text/csv",
-                        key='download-hm-csv')
+        fmt = st.selectbox('Format', export.FORMATS, key = 'format-hm',
+                           help = "GeoJSON und GeoPackage enthalten zusätzlich die Gemeindeflächen.")
+        if st.button("Export erstellen", key = 'export-hm'):
+            with st.spinner("Der Export wird erstellt."):
+                ext, mime = export.FORMATS[fmt]
+                st.download_button(f"{fmt}-Download",
+                                   export.heatmap(st.session_state['res_hm'], st.session_state["region_df"], fmt),
+                                   f"Ergebnis_Heatmap.{ext}", mime,
+                                   key='download-hm')
 else:
     st.markdown(f"**Diese Seite steht erst zur Verfügung,\
         wenn die Eingaben auf der Startseite getätigt wurden.**")
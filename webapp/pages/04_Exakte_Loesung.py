@@ -0,0 +1,66 @@
+import os
+import streamlit as st
+import numpy as np
+import pandas as pd
+from streamlit_folium import st_folium
+
+import commuting_model as como
+import cowork_locations as coloc
+import visualization_utils as wizard
+
+# The code solves the coworking space (CWS) placement exactly as mixed integer linear program, allowing users to input the number of new CWS and a time limit, visualizing the optimal solution and reporting how far the results of the K-Medoids and Genetic Algorithm pages are from the optimum.
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+st.title('RealWork-WebApp', anchor=None)
+st.header('Exakte Lösung', anchor=None)
+
+st.markdown(open(ROOT_DIR + '/webapp/texts/exact_desc.md').read(),
+            unsafe_allow_html=True)
+
+#Überprüfen der Vorraussetzungen
+if 'base_solution' in st.session_state:
+
+    with st.form("my_form"):
+        #Entscheidungsvariablen als Input
+        st.markdown('#### Spezifikation der Parameter / Inputs')
+        
+        n_tbp = st.number_input('##### Neu zu platzierende CWS',
+                                value = 10, min_value=1, max_value=int(st.session_state["n_region"]/5 -st.session_state["n_exist"]),
+                                help="Diese neue Anzahl an CWS soll im ausgewählten Gebiet platziert werden.")  
+        
+        time_limit = st.number_input('##### Maximale Rechenzeit in Sekunden',
+                                     value=60, min_value=1, max_value=3600,
+                                     help="Nach Ablauf dieser Zeit wird die bis dahin beste Lösung ausgegeben.")
+        
+        submitted = st.form_submit_button("Bestätigung und Neuberechnung")
+
+        if submitted:
+            with st.spinner("Im Folgenden wird die Berechnung durchgeführt. Dies kann einige **wenige Minuten** dauern."):
+                st.session_state['res_exact'] = coloc.exact(**st.session_state["problem_statement"],
+                                                            n_cws = st.session_state['base_solution'].n_cws + n_tbp,
+                                                            time_limit = time_limit)
+                st.markdown(coloc.STOP_REASONS[st.session_state['res_exact'].attrs['stop_reason']])
+
+    if 'res_exact' in st.session_state:
+        res_exact = st.session_state['res_exact']
+        sol = res_exact.Solution.iloc[0]
+        st.subheader("Ergebnisse")
+        st.markdown(f"Die gefundene Lösung spart potentiell {'{:0,.2f}'.format(sol.total_saving)} Personenminuten ein.\
+                    Keine Lösung kann mehr als {'{:0,.2f}'.format(res_exact.Bound.iloc[0])} Personenminuten einsparen\
+                    (Optimalitätslücke {'{:.2%}'.format(res_exact.Gap.iloc[0])}).")
+        
+        # Vergleich mit den heuristischen Verfahren
+        for key, name in [('res_kmed', 'K-Medoids'), ('res_ga', 'Genetischer Algorithmus')]:
+            if key in st.session_state and max(st.session_state[key].Solution).n_cws == sol.n_cws:
+                gap = coloc.optimality_gap(st.session_state[key], res_exact)
+                st.markdown(f"Das Ergebnis von *{name}* liegt höchstens {'{:.2%}'.format(gap)} unter dem Optimum.")
+        
+        with st.form("vis_form"):
+            submitted = st.form_submit_button("Visualisierung")
+            if submitted:
+                m = wizard.plot_solution(sol, st.session_state["region_df"])
+                st_data = st_folium(m, width=725, key = hash(str(sol)))
+else:
+    st.markdown(f"**Diese Seite steht erst zur Verfügung,\
+        wenn die Eingaben auf der Startseite getätigt wurden.**")
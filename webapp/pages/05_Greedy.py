@@ -0,0 +1,61 @@
+import os
+import streamlit as st
+import numpy as np
+import pandas as pd
+from streamlit_folium import st_folium
+
+import commuting_model as como
+import cowork_locations as coloc
+import visualization_utils as wizard
+
+# The code places new coworking spaces (CWS) greedily one after another, allowing users to input the maximal number of new CWS, showing the additional potential savings over the number of new CWS and visualizing the solution for a chosen number of new CWS.
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+st.title('RealWork-WebApp', anchor=None)
+st.header('Greedy-Verfahren', anchor=None)
+
+st.markdown(open(ROOT_DIR + '/webapp/texts/greedy_desc.md').read(),
+            unsafe_allow_html=True)
+
+#Überprüfen der Vorraussetzungen
+if 'base_solution' in st.session_state:
+
+    with st.form("my_form"):
+        #Entscheidungsvariablen als Input
+        st.markdown('#### Spezifikation der Parameter / Inputs')
+        
+        n_tbp = st.number_input('##### Maximal neu zu platzierende CWS',
+                                value = 10, min_value=1, max_value=int(st.session_state["n_region"] -st.session_state["n_exist"]),
+                                help="Für jede Anzahl bis zu dieser wird eine Lösung berechnet.")  
+        
+        submitted = st.form_submit_button("Bestätigung und Neuberechnung")
+
+        if submitted:
+            with st.spinner("Im Folgenden wird die Berechnung durchgeführt. Dies kann einige **wenige Minuten** dauern."):
+                my_bar = st.progress(0, text="Die Berechnung wird durchgeführt.")
+                st.session_state['res_greedy'] = coloc.greedy(n_tbp,
+                                                              **st.session_state["problem_statement"],
+                                                              progress = my_bar)
+
+    if 'res_greedy' in st.session_state:
+        res_greedy = st.session_state['res_greedy']
+        st.subheader("Ergebnisse")
+        st.markdown("Potentiell zusätzlich gesparte Personenminuten nach Anzahl neuer CWS:")
+        st.line_chart(res_greedy['Improvement'])
+        
+        with st.form("vis_form"):
+            k = st.number_input('Anzahl neuer CWS',
+                                value=len(res_greedy), min_value=1, max_value=len(res_greedy),
+                                help="Die zu visualisierende Lösung")
+            submitted = st.form_submit_button("Visualisierung")
+            if submitted:
+                sol = res_greedy.loc[k].Solution
+                st.markdown(f"Visualisierung der Lösung mit {k} neuen CWS und Ersparnissen von\
+                    {'{:0,.2f}'.format(sol.total_saving)} Personenminuten.\n\
+                    (Verbesserung um {'{:0,.2f}'.format(res_greedy.loc[k].Improvement)})")
+                m = wizard.plot_solution(sol, st.session_state["region_df"])
+                st_data = st_folium(m, width=725, key = hash(str(sol)))
+else:
+    st.markdown(f"**Diese Seite steht erst zur Verfügung,\
+        wenn die Eingaben auf der Startseite getätigt wurden.**")
@@ -0,0 +1,98 @@
+import os
+import streamlit as st
+import numpy as np
+import pandas as pd
+from streamlit_folium import st_folium
+
+import commuting_model as como
+import cowork_locations as coloc
+import visualization_utils as wizard
+import export
+
+# The code utilises simulated annealing (optionally with a tabu memory) for coworking space (CWS) placement optimization, allowing users to input parameters such as the number of new CWS, the number of moves, the tabu tenure and the seed, showing the best potential savings over the moves and visualizing the best solution.
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+st.title('RealWork-WebApp', anchor=None)
+st.header('Simulated Annealing', anchor=None)
+
+st.markdown(open(ROOT_DIR + '/webapp/texts/sa_desc.md').read(),
+            unsafe_allow_html=True)
+
+#Überprüfen der Vorraussetzungen
+if 'base_solution' in st.session_state:
+
+    with st.form("my_form"):
+        #Entscheidungsvariablen als Input
+        st.markdown('#### Spezifikation der Parameter / Inputs')
+        
+        n_tbp = st.number_input('##### Neu zu platzierende CWS',
+                                value = 10, min_value=1, max_value=int(st.session_state["n_region"]/5 -st.session_state["n_exist"]),
+                                help="Diese neue Anzahl an CWS soll im ausgewählten Gebiet platziert werden.")  
+        
+        n_moves = st.number_input('##### Anzahl der Züge',
+                                  value = 100000, min_value=1000, max_value=10000000, step=10000,
+                                  help="In jedem Zug wird ein neuer CWS verschoben. Mehr Züge führen in der Regel zu besseren Lösungen.")
+        
+        tabu = st.number_input('##### Tabu-Dauer',
+                               value = 0, min_value=0, max_value=10000,
+                               help="Für so viele Züge darf ein aufgegebener Standort nicht erneut gewählt werden, außer er führt zu einer neuen besten Lösung. 0 bedeutet keine Tabu-Suche.")
+        
+        seed = st.number_input('##### Seed',value=st.session_state['seed'], min_value=0, max_value=999999999,
+                            help="Diese Zahl dient der Reproduzierbarkeit der Ergebnisse. Im Zweifel belassen Sie die Default-Eingabe.")  
+        st.session_state['seed'] = seed
+        
+        time_budget = st.number_input('##### Maximale Rechenzeit in Sekunden',
+                                      value=0, min_value=0, max_value=3600,
+                                      help="Nach Ablauf dieser Zeit wird die bis dahin beste Lösung ausgegeben. 0 bedeutet unbegrenzt.")
+        
+        warm = st.checkbox('Vorheriges Ergebnis als Start verwenden', value = False, disabled = 'res_sa' not in st.session_state,
+                           help="Die Standorte des letzten Ergebnisses dieser Seite, die noch im Gebiet liegen, werden übernommen\
+                               und nur fehlende ergänzt. Nach kleinen Änderungen an Gebiet oder bestehenden CWS ist die\
+                               Berechnung so meist schneller fertig.")
+        
+        submitted = st.form_submit_button("Bestätigung und Neuberechnung")
+
+        if submitted:
+            with st.spinner("Im Folgenden wird die Berechnung durchgeführt. Dies kann einige **wenige Minuten** dauern."):
+                my_bar = st.progress(0, text="Die Berechnung wird durchgeführt.")
+                st.session_state['res_sa'] = coloc.annealing(n_moves = n_moves,
+                                                             tabu = tabu,
+                                                             **st.session_state["problem_statement"],
+                                                             n_cws = st.session_state['base_solution'].n_cws + n_tbp,
+                                                             seed = seed,
+                                                             time_budget = time_budget or None,
+                                                             warm_start = st.session_state['res_sa'] if warm else None,
+                                                             progress = my_bar)
+                st.markdown(coloc.STOP_REASONS[st.session_state['res_sa'].attrs['stop_reason']])
+
+    if 'res_sa' in st.session_state:
+        res_sa = st.session_state['res_sa']
+        st.subheader("Ergebnisse")
+        st.markdown("Potentiell gesparte Personenminuten der besten Lösung nach Anzahl der Züge:")
+        st.line_chart(res_sa['Solution'].map(lambda sol : sol.total_saving))
+        
+        with st.form("vis_form"):
+            submitted = st.form_submit_button("Visualisierung")
+            if submitted:
+                sol = max(res_sa['Solution'])
+                st.markdown(f"Visualisierung der besten Lösung mit potentiell gesparten Personenminuten von\
+                    {'{:0,.2f}'.format(sol.total_saving)}:")
+                m = wizard.plot_solution(sol, st.session_state["region_df"])
+                st_data = st_folium(m, width=725, key = hash(str(sol)))
+        
+        # Download-Area
+        st.subheader("Download")
+        fmt = st.selectbox('Format', export.FORMATS, key = 'format-sa',
+                           help = "GeoJSON und GeoPackage enthalten zusätzlich die Einzugsgebiete als Polygone.")
+        if st.button("Export erstellen", key = 'export-sa'):
+            with st.spinner("Der Export wird erstellt."):
+                ext, mime = export.FORMATS[fmt]
+                st.download_button(f"{fmt}-Download",
+                                   export.solutions(res_sa.rename_axis(['Zug']),
+                                                    st.session_state["region_df"], fmt),
+                                   f"Ergebnis_SimulatedAnnealing.{ext}", mime,
+                                   key='download-sa')
+else:
+    st.markdown(f"**Diese Seite steht erst zur Verfügung,\
+        wenn die Eingaben auf der Startseite getätigt wurden.**")
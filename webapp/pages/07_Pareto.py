@@ -0,0 +1,100 @@
+import os
+import streamlit as st
+import numpy as np
+import pandas as pd
+from streamlit_folium import st_folium
+
+import commuting_model as como
+import cowork_locations as coloc
+import visualization_utils as wizard
+import pareto
+import export
+
+# The code searches the trade-off between potentially saved person minutes and addressed commuters with a multi-objective genetic algorithm (NSGA-II), allowing users to input parameters such as the number of new CWS, the population size, the number of generations and the seed, showing the Pareto front and visualizing a chosen solution of it.
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+st.title('RealWork-WebApp', anchor=None)
+st.header('Pareto-Optimierung', anchor=None)
+
+st.markdown(open(ROOT_DIR + '/webapp/texts/pareto_desc.md').read(),
+            unsafe_allow_html=True)
+
+#Überprüfen der Vorraussetzungen
+if 'base_solution' in st.session_state:
+
+    with st.form("my_form"):
+        #Entscheidungsvariablen als Input
+        st.markdown('#### Spezifikation der Parameter / Inputs')
+        
+        n_tbp = st.number_input('##### Neu zu platzierende CWS',
+                                value = 10, min_value=1, max_value=int(st.session_state["n_region"]/5 -st.session_state["n_exist"]),
+                                help="Diese neue Anzahl an CWS soll im ausgewählten Gebiet platziert werden.")  
+        
+        n_pop = st.number_input('##### Populationsgröße',
+                                value=50, min_value=4, max_value=500,
+                                help="Eine größere Population findet mehr und besser verteilte Pareto-optimale Lösungen, braucht aber länger.")  
+        n_gen = st.number_input('##### Anzahl an Generationen',
+                                value=50, min_value=0, max_value=500,
+                                help="Über so viele Generationen wird die Population weiterentwickelt.")  
+        p_mut = st.slider('##### Mutationswahrscheinlichkeit',
+                        value=.2, min_value=0., max_value=1., step= .05,
+                        help="Wahrscheinlichkeit, mit der ein neuer CWS in eine Gemeinde verschoben wird, in die seine Einwohner pendeln.")  
+        
+        seed = st.number_input('##### Seed',value=st.session_state['seed'], min_value=0, max_value=999999999,
+                            help="Diese Zahl dient der Reproduzierbarkeit der Ergebnisse. Im Zweifel belassen Sie die Default-Eingabe.")  
+        st.session_state['seed'] = seed
+        
+        time_budget = st.number_input('##### Maximale Rechenzeit in Sekunden',
+                                      value=0, min_value=0, max_value=3600,
+                                      help="Nach Ablauf dieser Zeit wird die bis dahin gefundene Pareto-Front ausgegeben. 0 bedeutet unbegrenzt.")
+        
+        submitted = st.form_submit_button("Bestätigung und Neuberechnung")
+
+        if submitted:
+            with st.spinner("Im Folgenden wird die Berechnung durchgeführt. Dies kann einige **wenige Minuten** dauern."):
+                my_bar = st.progress(0, text="Die Berechnung wird durchgeführt.")
+                st.session_state['res_pareto'] = pareto.pareto_genetic_algorithm(n_pop, n_gen, p_mut,
+                                                                                 **st.session_state["problem_statement"],
+                                                                                 n_cws = st.session_state['base_solution'].n_cws + n_tbp,
+                                                                                 seed = seed,
+                                                                                 time_budget = time_budget or None,
+                                                                                 progress = my_bar)
+                st.markdown(coloc.STOP_REASONS[st.session_state['res_pareto'].attrs['stop_reason']])
+
+    if 'res_pareto' in st.session_state:
+        res_pareto = st.session_state['res_pareto']
+        st.subheader("Ergebnisse")
+        st.markdown(f"{len(res_pareto)} Pareto-optimale Lösungen: keine lässt sich bei einem Ziel verbessern,\
+            ohne beim anderen schlechter zu werden.")
+        table = res_pareto[list(pareto.OBJECTIVES)].rename(columns = {'Total saving': export.COLUMNS['savings'],
+                                                                      'Total commuters': export.COLUMNS['commuters']})
+        st.scatter_chart(table, x = export.COLUMNS['commuters'], y = export.COLUMNS['savings'])
+        st.dataframe(table)
+        
+        with st.form("vis_form"):
+            k = st.number_input('Lösung',
+                                value=1, min_value=1, max_value=len(res_pareto),
+                                help="Die zu visualisierende Lösung (Zeile der Tabelle)")
+            submitted = st.form_submit_button("Visualisierung")
+            if submitted:
+                sol = res_pareto.loc[k].Solution
+                st.markdown(f"Visualisierung der Lösung mit potentiell gesparten Personenminuten von\
+                    {'{:0,.2f}'.format(sol.total_saving)} und {'{:0,.0f}'.format(sol.total_commuters)} addressierten Pendlern:")
+                m = wizard.plot_solution(sol, st.session_state["region_df"])
+                st_data = st_folium(m, width=725, key = hash(str(sol)))
+        
+        # Download-Area
+        st.subheader("Download")
+        fmt = st.selectbox('Format', export.FORMATS, key = 'format-pareto',
+                           help = "GeoJSON und GeoPackage enthalten zusätzlich die Einzugsgebiete als Polygone.")
+        if st.button("Export erstellen", key = 'export-pareto'):
+            with st.spinner("Der Export wird erstellt."):
+                ext, mime = export.FORMATS[fmt]
+                st.download_button(f"{fmt}-Download",
+                                   export.solutions(res_pareto[['Solution']], st.session_state["region_df"], fmt),
+                                   f"Ergebnis_Pareto.{ext}", mime,
+                                   key='download-pareto')
+else:
+    st.markdown(f"**Diese Seite steht erst zur Verfügung,\
+        wenn die Eingaben auf der Startseite getätigt wurden.**")